@@ -0,0 +1,135 @@
+"""
+Absolute Gaia XP mean spectra of many sources sampled on one wavelength grid, as gaiaxpy.calibrate does for a single
+file but in bulk.
+
+The BP and RP design matrices (basis functions through the external instrument model, 55 x samples) and the BP/RP
+merge weights are computed once for the grid. Fluxes of all sources are then a single coefficients @ design matrix
+product per band, and errors come from a batched D^T K D over the stacked coefficient covariances, in chunks of
+sources to bound memory. Spectra of every input file end up in one .npz (source_id, wavelength, flux, flux_error).
+
+Wavelengths in nm, fluxes in W nm^-1 m^-2, as gaiaxpy.
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+XP_EXTENSIONS = (".ecsv", ".csv", ".fits", ".xml")
+DEFAULT_SAMPLING = np.linspace(335, 1020, num=1000, endpoint=True)
+
+SampledSpectra = namedtuple("SampledSpectra", "source_id wavelength flux flux_error")
+XpDesign = namedtuple("XpDesign", "sampling design merge")
+
+def designMatrices(sampling: np.ndarray = DEFAULT_SAMPLING, bp_model: str = 'v375wi', rp_model: str = 'v142r') -> XpDesign:
+	"""
+	BP and RP design matrices (bases x samples) and merge weights for `sampling`, through the same builder
+	gaiaxpy.calibrate uses.
+	"""
+	from gaiaxpy.calibrator import calibrator
+	from gaiaxpy.core.generic_functions import validate_wl_sampling
+	validate_wl_sampling(sampling)
+	# module-private helper of gaiaxpy.calibrator (not name-mangled at module level)
+	matrices, merge = getattr(calibrator, '__generate_xp_matrices_and_merge')('calibrator', sampling, bp_model, rp_model)
+	return XpDesign(np.asarray(sampling, dtype=float), {band: m.get_design_matrix() for band, m in matrices.items()},
+					{band: np.asarray(w, dtype=float) for band, w in merge.items()})
+
+def readXpContinuous(input_object: str | pd.DataFrame, truncation: bool = False) -> pd.DataFrame:
+	"""
+	XP_CONTINUOUS sources of a file (ECSV, CSV, FITS, XML) or DataFrame, parsed by gaiaxpy (covariances included).
+	"""
+	from gaiaxpy.calibrator.calibrator import _calibrate
+	from gaiaxpy.input_reader.input_reader import InputReader
+	parsed, _ = InputReader(input_object, _calibrate, truncation=truncation, disable_info=True).read()
+	return parsed
+
+def xpFiles(path: str) -> list[str]:
+	if os.path.isdir(path):
+		return sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(XP_EXTENSIONS))
+	return [path]
+
+def _stackBand(parsed: pd.DataFrame, band: str, num_bases: int, truncation: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	(coefficients n x bases, covariances n x bases x bases, standard deviations) of a band; zeros/NaN for sources
+	without it. With truncation, coefficients beyond each source's relevant bases are zeroed, which is the same as
+	truncating the design matrix.
+	"""
+	numSources = len(parsed)
+	coefficients = np.zeros((numSources, num_bases))
+	covariances = np.zeros((numSources, num_bases, num_bases))
+	stdev = np.full(numSources, np.nan)
+	covColumn = f'{band}_covariance_matrix' if f'{band}_covariance_matrix' in parsed.columns else f'{band}_coefficient_covariances'
+	for i, (coeffs, cov, sd) in enumerate(zip(parsed[f'{band}_coefficients'], parsed[covColumn], parsed[f'{band}_standard_deviation'])):
+		if isinstance(coeffs, np.ndarray) and isinstance(cov, np.ndarray):
+			coefficients[i, :len(coeffs)] = coeffs
+			covariances[i, :cov.shape[0], :cov.shape[1]] = cov
+			stdev[i] = sd
+	if truncation and f'{band}_n_relevant_bases' in parsed.columns:
+		relevant = parsed[f'{band}_n_relevant_bases'].to_numpy(dtype=float)
+		keep = np.arange(num_bases)[np.newaxis, :] < np.nan_to_num(relevant, nan=num_bases)[:, np.newaxis]
+		coefficients *= keep
+		covariances *= keep[:, :, np.newaxis] & keep[:, np.newaxis, :]
+	return coefficients, covariances, stdev
+
+def sampleSpectra(parsed: pd.DataFrame, design: XpDesign, truncation: bool = False, chunk_size: int = 256,
+				  dtype: np.dtype = np.float32) -> SampledSpectra:
+	"""
+	Absolute spectra of every parsed source on the design's grid. Where one band is missing the other is used alone
+	(NaN outside its wavelength range), as in gaiaxpy.
+	"""
+	from gaiaxpy.core.satellite import BANDS, BP_WL, RP_WL
+
+	numSources, numSamples = len(parsed), len(design.sampling)
+	flux = np.full((numSources, numSamples), np.nan, dtype=dtype)
+	fluxError = np.full((numSources, numSamples), np.nan, dtype=dtype)
+	bands = [BANDS.bp, BANDS.rp]
+	inRange = {BANDS.bp: design.sampling < BP_WL.high, BANDS.rp: design.sampling > RP_WL.low}
+
+	for start in range(0, numSources, chunk_size):
+		chunk = parsed.iloc[start:start + chunk_size]
+		bandFlux, bandVar, available = {}, {}, {}
+		for band in bands:
+			D = design.design[band]
+			coefficients, covariances, stdev = _stackBand(chunk, band, D.shape[0], truncation)
+			bandFlux[band] = coefficients @ D
+			# diag(D^T K D) for every source at once: sum over bases of D * (K @ D)
+			bandVar[band] = np.einsum('ks,nks->ns', D, np.matmul(covariances, D)) * stdev[:, np.newaxis]**2
+			available[band] = np.isfinite(stdev)
+
+		bp, rp = BANDS.bp, BANDS.rp
+		both = available[bp] & available[rp]
+		chunkFlux = np.where(both[:, np.newaxis], bandFlux[bp] * design.merge[bp] + bandFlux[rp] * design.merge[rp], np.nan)
+		chunkVar = np.where(both[:, np.newaxis], bandVar[bp] * design.merge[bp]**2 + bandVar[rp] * design.merge[rp]**2, np.nan)
+		for band in bands:
+			only = (available[band] & ~both)[:, np.newaxis] & inRange[band][np.newaxis, :]
+			chunkFlux = np.where(only, bandFlux[band], chunkFlux)
+			chunkVar = np.where(only, bandVar[band], chunkVar)
+
+		flux[start:start + len(chunk)] = chunkFlux
+		fluxError[start:start + len(chunk)] = np.sqrt(chunkVar)
+	return SampledSpectra(parsed['source_id'].to_numpy(dtype=np.int64), design.sampling, flux, fluxError)
+
+def sampleXpFiles(path: str, output_path: str = None, sampling: np.ndarray = DEFAULT_SAMPLING, truncation: bool = False,
+				  chunk_size: int = 256, dtype: np.dtype = np.float32) -> SampledSpectra:
+	"""
+	Spectra of every source in an XP_CONTINUOUS file or a directory of them, written to `output_path` (.npz) if
+	given. The design matrices are built once for all files.
+	"""
+	design = designMatrices(sampling)
+	results = [sampleSpectra(readXpContinuous(f, truncation), design, truncation, chunk_size, dtype) for f in xpFiles(path)]
+	spectra = SampledSpectra(np.concatenate([r.source_id for r in results]), design.sampling,
+							 np.concatenate([r.flux for r in results]), np.concatenate([r.flux_error for r in results]))
+	if output_path is not None:
+		np.savez(output_path, **spectra._asdict())
+	return spectra
+
+def loadSampledSpectra(path: str) -> SampledSpectra:
+	with np.load(path) as spectraFile:
+		return SampledSpectra(*(spectraFile[f] for f in SampledSpectra._fields))
+
+def writePyHammerCsv(spectra: SampledSpectra, index: int, path: str) -> None:
+	"""
+	One source's spectrum as PyHammer input: wavelength in Angstrom and flux, without header.
+	"""
+	pd.DataFrame({'wavelength': spectra.wavelength * 10, 'flux': spectra.flux[index]}).to_csv(path, index=False, header=False)
@@ -0,0 +1,85 @@
+"""
+Pixel positions of sky coordinates across a collection of FITS images, from the headers alone.
+
+Only each file's header is read (no pixel data) to build its WCS, and all coordinates are projected with one
+vectorized call per image; files are spread across a process pool. The result is a long table with one row per
+image x coordinate: pixel position, image size and whether the position falls outside the image. `openImage` gives a
+memory-mapped CCDData for the images whose pixels are actually needed.
+"""
+
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+from astropy.coordinates import SkyCoord
+from astropy.nddata import CCDData
+from astropy.wcs import WCS, FITSFixedWarning
+from astropy.wcs.utils import skycoord_to_pixel
+
+FITS_EXTENSIONS = (".fits", ".fit", ".fts", ".fits.gz", ".fit.gz", ".fts.gz")
+
+def fitsFiles(directory: str, extensions: tuple[str] = FITS_EXTENSIONS) -> list[str]:
+	return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith(extensions))
+
+def openImage(path: str, unit: str = 'adu', hdu: int = 0) -> CCDData:
+	"""
+	Image with its pixels memory-mapped rather than read into memory.
+	"""
+	return CCDData.read(path, hdu=hdu, unit=unit, memmap=True)
+
+def _projectFile(path: str, coords: SkyCoord, hdu: int, header_keys: tuple[str]) -> tuple:
+	header = fits.getheader(path, hdu)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', FITSFixedWarning)
+		wcs = WCS(header)
+	if wcs.has_celestial:
+		x, y = skycoord_to_pixel(coords, wcs, origin=0)
+	else:
+		x, y = np.full(len(coords), np.nan), np.full(len(coords), np.nan)
+	return path, np.asarray(x, dtype=float), np.asarray(y, dtype=float), header.get('NAXIS1'), header.get('NAXIS2'), \
+		   {k: header.get(k) for k in header_keys}
+
+def scanImages(images: str | list[str], coords: dict[str, SkyCoord], hdu: int = 0, header_keys: tuple[str] = ('DATE-OBS',),
+			   workers: int = None, chunksize: int = 16) -> pd.DataFrame:
+	"""
+	Pixel position of every coordinate (name -> SkyCoord) in every image (a directory or a list of paths). Columns:
+	file, star, x, y, naxis1, naxis2, oob plus the requested `header_keys`. A position is out of bounds when it lies
+	outside [0, NAXIS] on either axis or the image has no celestial WCS.
+	"""
+	paths = fitsFiles(images) if isinstance(images, str) else list(images)
+	names = list(coords.keys())
+	allCoords = SkyCoord([c.icrs for c in coords.values()])
+	if len(paths) == 0:
+		return pd.DataFrame(columns=['file', 'star', 'x', 'y', 'naxis1', 'naxis2', 'oob', *header_keys])
+
+	workers = workers or min(max(os.cpu_count() - 2, 1), len(paths))
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		results = list(pool.map(_projectFile, paths, [allCoords] * len(paths), [hdu] * len(paths), [tuple(header_keys)] * len(paths),
+								chunksize=chunksize))
+
+	numStars = len(names)
+	files, x, y, naxis1, naxis2, headerValues = zip(*results)
+	table = pd.DataFrame({
+		'file': np.repeat([os.path.basename(f) for f in files], numStars),
+		'star': np.tile(names, len(files)),
+		'x': np.concatenate(x),
+		'y': np.concatenate(y),
+		'naxis1': np.repeat(np.array(naxis1, dtype=float), numStars),
+		'naxis2': np.repeat(np.array(naxis2, dtype=float), numStars),
+	})
+	with np.errstate(invalid='ignore'):
+		inside = (table['x'] >= 0) & (table['x'] <= table['naxis1']) & (table['y'] >= 0) & (table['y'] <= table['naxis2'])
+	table['oob'] = ~inside
+	for k in header_keys:
+		table[k] = np.repeat([h[k] for h in headerValues], numStars)
+	return table
+
+def oobFiles(table: pd.DataFrame) -> dict[str, list[str]]:
+	"""
+	Files where each star is out of bounds.
+	"""
+	oob = table[table['oob']]
+	return {star: oob.loc[oob['star'] == star, 'file'].tolist() for star in table['star'].unique()}
@@ -0,0 +1,148 @@
+"""
+Columnar on-disk store for the light curves of every survey (Iturbide, ZTF, Gaia, TESS, ...).
+
+A store is a directory with one .npy file per column (time, flux, err, band, source, quality) and an `index.json`
+with the band and source labels. Rows are kept sorted by band and then time, so a band is a contiguous block and a
+time range within it is found by binary search: selections are memory-mapped views, nothing is parsed or copied.
+Folding only computes the phase array. Bands and sources are labels such as 'ZTF:g' and 'ZTF'; times are JD-like
+days on whatever scale they were added with (keep one scale per store).
+"""
+
+import os
+import json
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+INDEX_FNAME = "index.json"
+COLUMN_DTYPES = {'time': '<f8', 'flux': '<f8', 'err': '<f8', 'band': '<i2', 'source': '<i2', 'quality': '<i4'}
+
+LightCurve = namedtuple("LightCurve", "time flux err source quality")
+FoldedLightCurve = namedtuple("FoldedLightCurve", "phase time flux err")
+
+def magToFlux(mag: np.ndarray, magerr: np.ndarray, zero_point: float | np.ndarray = 0) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Relative flux 10^(-0.4 (mag - zero_point)) and its first-order error.
+	"""
+	flux = 10**(-(2/5) * (np.asarray(mag, dtype=float) - zero_point))
+	return flux, flux * np.asarray(magerr, dtype=float) * np.log(10) / 2.5
+
+class LightCurveStore:
+
+	def __init__(self, path: str) -> None:
+		"""
+		Opens the store at `path`; a missing store is empty until something is added.
+		"""
+		self.path = path
+		self._load()
+
+	def _load(self) -> None:
+		indexPath = os.path.join(self.path, INDEX_FNAME)
+		if os.path.exists(indexPath):
+			with open(indexPath, 'r') as indexFile:
+				index = json.load(indexFile)
+			self.bands: list[str] = index['bands']
+			self.sources: list[str] = index['sources']
+			self.meta: dict = index.get('meta', {})
+			self._columns = {c: np.load(os.path.join(self.path, f"{c}.npy"), mmap_mode='r') for c in COLUMN_DTYPES}
+		else:
+			self.bands, self.sources, self.meta = [], [], {}
+			self._columns = {c: np.empty(0, dtype=dtype) for c, dtype in COLUMN_DTYPES.items()}
+		# rows are sorted by band code, so each band is the block between consecutive offsets
+		self._bandOffsets = np.searchsorted(self._columns['band'], np.arange(len(self.bands) + 1))
+
+	def __len__(self) -> int:
+		return len(self._columns['time'])
+
+	def add(self, time: np.ndarray, flux: np.ndarray, err: np.ndarray, band: str | np.ndarray, source: str,
+			quality: np.ndarray = None, replace: bool = True) -> None:
+		"""
+		Adds rows of one source (`band` a label or a label per row). With `replace`, rows already stored for the same
+		source and bands are dropped first, so re-ingesting a reduction doesn't duplicate it.
+		"""
+		time = np.asarray(time, dtype=float)
+		bandLabels = np.broadcast_to(np.asarray(band, dtype=str), time.shape)
+		newBands, newBandIdx = np.unique(bandLabels, return_inverse=True)
+
+		bands = self.bands + [b for b in newBands.tolist() if b not in self.bands]
+		sources = self.sources + ([source] if source not in self.sources else [])
+		bandCodes = np.array([bands.index(b) for b in newBands], dtype=COLUMN_DTYPES['band'])[newBandIdx]
+		new = {
+			'time': time,
+			'flux': np.asarray(flux, dtype=float),
+			'err': np.asarray(err, dtype=float),
+			'band': bandCodes,
+			'source': np.full(len(time), sources.index(source), dtype=COLUMN_DTYPES['source']),
+			'quality': np.zeros(len(time), dtype=COLUMN_DTYPES['quality']) if quality is None else np.asarray(quality),
+		}
+
+		keep = np.ones(len(self), dtype=bool)
+		if replace and len(self) > 0:
+			keep = ~((self._columns['source'] == sources.index(source)) & np.isin(self._columns['band'], np.unique(bandCodes)))
+		merged = {c: np.concatenate([np.asarray(self._columns[c])[keep], new[c]]).astype(dtype) for c, dtype in COLUMN_DTYPES.items()}
+		self._write(merged, bands, sources)
+
+	def _write(self, columns: dict[str, np.ndarray], bands: list[str], sources: list[str]) -> None:
+		order = np.lexsort((columns['time'], columns['band']))
+		os.makedirs(self.path, exist_ok=True)
+		self._columns = {} # release the memory maps before replacing their files
+		for c, values in columns.items():
+			tempPath = os.path.join(self.path, f"{c}.part.npy")
+			np.save(tempPath, values[order])
+			os.replace(tempPath, os.path.join(self.path, f"{c}.npy"))
+
+		indexPath = os.path.join(self.path, INDEX_FNAME)
+		with open(f"{indexPath}.part", 'w') as indexFile:
+			json.dump({'bands': bands, 'sources': sources, 'meta': self.meta, 'num_rows': len(order)}, indexFile, indent=1)
+		os.replace(f"{indexPath}.part", indexPath)
+		self._load()
+
+	def setMeta(self, **meta) -> None:
+		self.meta.update(meta)
+		self._write({c: np.asarray(v) for c, v in self._columns.items()}, self.bands, self.sources)
+
+	def _rows(self, band: str, t_min: float = None, t_max: float = None) -> slice:
+		if band not in self.bands:
+			raise KeyError(f"No band {band} in {self.path}; stored bands: {self.bands}")
+		code = self.bands.index(band)
+		start, stop = self._bandOffsets[code], self._bandOffsets[code + 1]
+		bandTime = self._columns['time'][start:stop]
+		lo = np.searchsorted(bandTime, t_min, side='left') if t_min is not None else 0
+		hi = np.searchsorted(bandTime, t_max, side='right') if t_max is not None else len(bandTime)
+		return slice(start + lo, start + hi)
+
+	def select(self, band: str, t_min: float = None, t_max: float = None) -> LightCurve:
+		"""
+		Rows of `band` with t_min <= time <= t_max, as memory-mapped views sorted by time.
+		"""
+		rows = self._rows(band, t_min, t_max)
+		return LightCurve(*(self._columns[c][rows] for c in LightCurve._fields))
+
+	def fold(self, band: str, period: float, t0: float = 0, t_min: float = None, t_max: float = None,
+			 sort: bool = False) -> FoldedLightCurve:
+		"""
+		Phase in [-0.5, 0.5) cycles of every row of `band` (as astropy's TimeSeries.fold with normalize_phase). The
+		other columns stay views in time order unless `sort` orders everything by phase.
+		"""
+		lc = self.select(band, t_min, t_max)
+		phase = np.mod((lc.time - t0) / period + 0.5, 1) - 0.5
+		if not sort:
+			return FoldedLightCurve(phase, lc.time, lc.flux, lc.err)
+		order = np.argsort(phase, kind='stable')
+		return FoldedLightCurve(phase[order], lc.time[order], lc.flux[order], lc.err[order])
+
+	def toPandas(self, bands: list[str] = None) -> pd.DataFrame:
+		"""
+		Copy of the given bands (all by default) with band and source labels.
+		"""
+		frames = []
+		for band in bands or self.bands:
+			rows = self._rows(band)
+			frame = pd.DataFrame({c: np.asarray(self._columns[c][rows]) for c in COLUMN_DTYPES if c not in ('band', 'source')})
+			frame['band'] = band
+			frame['source'] = np.asarray(self.sources)[self._columns['source'][rows]]
+			frames.append(frame)
+		if len(frames) == 0:
+			return pd.DataFrame(columns=list(COLUMN_DTYPES))
+		return pd.concat(frames, ignore_index=True)
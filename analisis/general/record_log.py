@@ -0,0 +1,70 @@
+"""
+Append-only table of float64 records: a JSON header with the column names (`<path>.json`) and the raw little-endian
+records (`<path>`). Rows are flushed as they're appended, so a run that's interrupted can be resumed from whatever
+made it to disk; reading memory-maps the file and returns each column as a view.
+"""
+
+import os
+import json
+
+import numpy as np
+
+class RecordLog:
+
+	def __init__(self, path: str, columns: list[str] = None, meta: dict = None) -> None:
+		"""
+		Opens an existing log, or creates it when `columns` are given. Reopening with different columns is an error.
+		"""
+		self.path = path
+		self.headerPath = f"{path}.json"
+		if os.path.exists(self.headerPath):
+			with open(self.headerPath, 'r') as headerFile:
+				header = json.load(headerFile)
+			if columns is not None and list(columns) != header['columns']:
+				raise ValueError(f"{path} already exists with columns {header['columns']}")
+		elif columns is not None:
+			header = {'columns': list(columns), 'meta': meta or {}}
+			os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+			with open(self.headerPath, 'w') as headerFile:
+				json.dump(header, headerFile, indent=1)
+		else:
+			raise FileNotFoundError(f"No record log at {path}")
+
+		self.columns: list[str] = header['columns']
+		self.meta: dict = header.get('meta', {})
+		self._file = None
+
+	def append(self, rows: np.ndarray) -> None:
+		rows = np.atleast_2d(np.asarray(rows, dtype='<f8'))
+		if rows.shape[1] != len(self.columns):
+			raise ValueError(f"Expected {len(self.columns)} columns, got {rows.shape[1]}")
+		if self._file is None:
+			numRows = len(self)
+			self._file = open(self.path, 'ab')
+			self._file.truncate(8 * len(self.columns) * numRows) # drop a partial record left by an interrupted run
+		self._file.write(np.ascontiguousarray(rows).tobytes())
+		self._file.flush()
+
+	def close(self) -> None:
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *_):
+		self.close()
+
+	def __len__(self) -> int:
+		return os.path.getsize(self.path) // (8 * len(self.columns)) if os.path.exists(self.path) else 0
+
+	def read(self) -> dict[str, np.ndarray]:
+		"""
+		Column name -> (memory-mapped) column view. A trailing partial record from an interrupted write is ignored.
+		"""
+		numRows = len(self)
+		if numRows == 0:
+			return {c: np.empty(0) for c in self.columns}
+		table = np.memmap(self.path, dtype='<f8', mode='r', shape=(numRows, len(self.columns)))
+		return {c: table[:, i] for i, c in enumerate(self.columns)}
@@ -0,0 +1,203 @@
+"""
+Aperture photometry of the Iturbide (IRAF qphot) nights as one columnar cube, and the cleaned differential light curve.
+
+Every night's `phot` file is parsed once (in parallel) and scattered into arrays of shape (frames x stars x apertures)
+for MAG, MERR, FLUX and AREA, with frames of all nights stacked along the first axis and sorted by night and time.
+Apertures are then scored for every night in a single pass (variance of the object's magnitude, grouped by night with
+np.add.reduceat), the comparison-star magnitude of the chosen aperture is gathered for all frames at once, and the
+frames whose comparison star strays from its median-filter baseline are clipped. The differential light curve is
+built from those arrays directly, without per-night DataFrames.
+
+Frames of a night are matched across stars by their order in time, as in qphot_sigma_clip.ipynb. Times are JD (TDB).
+"""
+
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.ndimage import median_filter
+
+TIMEZONE = 'America/Monterrey'
+
+EPADU = 10.0
+ZMAG = 25.0
+ITIME = 60.0 # seconds
+
+PhotCube = namedtuple("PhotCube", "dates lids apertures night julianDate otime rapert mag merr flux area stdev nsky")
+CleanLightCurve = namedtuple("CleanLightCurve", "data apertures scores keep baseline cube")
+
+def readPhot(path: str) -> pd.DataFrame:
+	from astropy.io import ascii
+	return ascii.read(path, format='daophot').to_pandas()
+
+def _apertureIds(columns) -> list[int]:
+	return sorted(int(m.group(1)) for m in (re.fullmatch(r"RAPERT(\d+)", c) for c in columns) if m)
+
+def loadPhotNights(dates: list[str], qphot_dirs: list[str], lids: list[int] = (1, 2, 3), timezone: str = TIMEZONE,
+				   workers: int = None) -> PhotCube:
+	"""
+	All nights' `<qphot_dir>/phot` files in one PhotCube. Nights with fewer apertures than others are padded with NaN.
+	"""
+	paths = [os.path.join(d, "phot") for d in qphot_dirs]
+	with ProcessPoolExecutor(max_workers=workers or min(len(paths), max(os.cpu_count() - 2, 1))) as pool:
+		tables = list(pool.map(readPhot, paths))
+
+	lids = np.sort(np.asarray(lids))
+	apertures = np.array(sorted(set().union(*(_apertureIds(t.columns) for t in tables))))
+	numStars, numApers = len(lids), len(apertures)
+
+	# frames of each star in time order; a night has as many frames as its best-covered star
+	nightFrames = []
+	for table in tables:
+		table = table[table['LID'].isin(lids)]
+		otime = pd.to_datetime(table['OTIME']).dt.tz_localize(timezone).dt.tz_convert('UTC').dt.tz_localize(None)
+		table = table.assign(_otime=otime.to_numpy()).sort_values('_otime', kind='stable')
+		table = table.assign(_frame=table.groupby('LID').cumcount().to_numpy())
+		nightFrames.append(table)
+	counts = np.array([t['_frame'].max() + 1 if len(t) > 0 else 0 for t in nightFrames])
+	offsets = np.concatenate([[0], np.cumsum(counts)])
+	numFrames = int(offsets[-1])
+
+	mag, merr, flux, area = (np.full((numFrames, numStars, numApers), np.nan) for _ in range(4))
+	stdev, nsky = np.full((numFrames, numStars), np.nan), np.full((numFrames, numStars), np.nan)
+	rapert = np.full((len(tables), numApers), np.nan)
+	otime = np.full(numFrames, np.datetime64('NaT'), dtype='datetime64[ns]')
+	night = np.repeat(np.arange(len(tables)), counts)
+
+	for n, table in enumerate(nightFrames):
+		frame = offsets[n] + table['_frame'].to_numpy()
+		star = np.searchsorted(lids, table['LID'].to_numpy())
+		otime[frame] = table['_otime'].to_numpy()
+		stdev[frame, star] = table['STDEV'].to_numpy(dtype=float)
+		nsky[frame, star] = table['NSKY'].to_numpy(dtype=float)
+
+		nightApers = _apertureIds(table.columns)
+		aperIdx = np.searchsorted(apertures, nightApers)
+		for name, cube in (('MAG', mag), ('MERR', merr), ('FLUX', flux), ('AREA', area)):
+			cube[frame[:, np.newaxis], star[:, np.newaxis], aperIdx] = table[[f"{name}{a}" for a in nightApers]].to_numpy(dtype=float)
+		if len(table) > 0:
+			rapert[n, aperIdx] = table[[f"RAPERT{a}" for a in nightApers]].iloc[0].to_numpy(dtype=float)
+
+	from astropy.time import Time
+	julianDate = Time(otime, format='datetime64', scale='utc').tdb.jd if numFrames > 0 else np.empty(0)
+	return PhotCube(list(dates), lids, apertures, night, julianDate, otime, rapert, mag, merr, flux, area, stdev, nsky)
+
+def _starIndex(cube: PhotCube, lid: int) -> int:
+	return int(np.flatnonzero(cube.lids == lid)[0])
+
+def _nightStarts(cube: PhotCube) -> np.ndarray:
+	return np.searchsorted(cube.night, np.arange(len(cube.dates)))
+
+def apertureScores(cube: PhotCube, lid: int = 1) -> np.ndarray:
+	"""
+	(nights x apertures) variance of the star's magnitude over each night, skipping frames without a magnitude (as
+	pandas does); NaN where a night has no magnitude at all for an aperture.
+	"""
+	values = cube.mag[:, _starIndex(cube, lid), :]
+	finite = np.isfinite(values)
+	scores = np.full((len(cube.dates), values.shape[1]), np.nan)
+	# reduceat repeats the previous segment for a night without frames, so only non-empty nights are reduced
+	nights = np.flatnonzero(np.bincount(cube.night, minlength=len(cube.dates)) > 0)
+	if len(nights) == 0:
+		return scores
+	starts = _nightStarts(cube)[nights]
+	counts = np.add.reduceat(finite.astype(float), starts, axis=0)
+	filled = np.where(finite, values, 0)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		mean = np.add.reduceat(filled, starts, axis=0) / counts
+		nightMean = np.zeros((len(cube.dates), values.shape[1]))
+		nightMean[nights] = np.nan_to_num(mean)
+		squares = np.where(finite, (values - nightMean[cube.night])**2, 0)
+		scores[nights] = np.where(counts > 0, np.add.reduceat(squares, starts, axis=0) / counts, np.nan)
+	return scores
+
+def bestApertures(scores: np.ndarray, dates: list[str] = None) -> np.ndarray:
+	"""
+	Aperture index of the lowest score of each night (the first one on ties). Raises if a night has no score for any
+	aperture.
+	"""
+	missing = np.flatnonzero(np.all(np.isnan(scores), axis=1))
+	if len(missing) > 0:
+		nights = [dates[n] for n in missing] if dates is not None else missing.tolist()
+		raise ValueError(f"No magnitudes to score the apertures of night(s) {nights}")
+	return np.nanargmin(scores, axis=1)
+
+def clipFrames(cube: PhotCube, aperture_idx: np.ndarray, comp_lid: int = 2, xi_low: float = 0.5, xi_high: float = 0.5,
+			   window_fraction: float = 1 / 1.7) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	(keep, baseline) for every frame. The comparison star's magnitude (at each night's chosen aperture) is compared
+	with its running median over `window_fraction` of the night's frames; frames deviating by more than xi_low (below)
+	or xi_high (above) times the night's standard deviation are dropped, as are frames without a comparison magnitude.
+	"""
+	compMag = cube.mag[np.arange(len(cube.night)), _starIndex(cube, comp_lid), aperture_idx[cube.night]]
+	valid = np.isfinite(compMag)
+	night, values = cube.night[valid], compMag[valid]
+	counts = np.bincount(night, minlength=len(cube.dates))
+	starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+	nonEmpty = counts > 0
+
+	sigma = np.zeros(len(cube.dates))
+	mean = np.add.reduceat(values, starts[nonEmpty]) / counts[nonEmpty]
+	sigma[nonEmpty] = np.sqrt(np.add.reduceat((values - np.repeat(mean, counts[nonEmpty]))**2, starts[nonEmpty]) / counts[nonEmpty])
+
+	# the filter window differs per night, so only the median filter itself runs per night
+	baseline = np.empty_like(values)
+	for n in np.flatnonzero(nonEmpty):
+		nightValues = values[starts[n]:starts[n] + counts[n]]
+		baseline[starts[n]:starts[n] + counts[n]] = median_filter(nightValues, size=max(round(counts[n] * window_fraction), 1),
+																  mode='constant', cval=np.median(nightValues))
+
+	residual = values - baseline
+	keep = np.zeros(len(compMag), dtype=bool)
+	keep[valid] = (residual > -xi_low * sigma[night]) & (residual < xi_high * sigma[night])
+	fullBaseline = np.full(len(compMag), np.nan)
+	fullBaseline[valid] = baseline
+	return keep, fullBaseline
+
+def differentialLightCurve(cube: PhotCube, aperture_idx: np.ndarray, keep: np.ndarray, comp_vmag: float, lid: int = 1,
+						   comp_lid: int = 2, zmag: float = ZMAG, itime: float = ITIME, epadu: float = EPADU,
+						   timezone: str = TIMEZONE) -> pd.DataFrame:
+	"""
+	Kept frames of the star, with FLUX from its magnitude corrected by the comparison star (of V magnitude
+	`comp_vmag`) and FERR from the CCD noise equation of the star's aperture.
+	"""
+	frames = np.flatnonzero(keep)
+	aper = aperture_idx[cube.night[frames]]
+	star, comp = _starIndex(cube, lid), _starIndex(cube, comp_lid)
+
+	mag = cube.mag[frames, star, aper]
+	correctedMag = mag - (cube.mag[frames, comp, aper] - comp_vmag)
+	flux = itime * 10**((2 / 5) * (zmag - correctedMag))
+	area, stdev, nsky = cube.area[frames, star, aper], cube.stdev[frames, star], cube.nsky[frames, star]
+	ferr = np.sqrt(flux / epadu + area * stdev**2 + area**2 * stdev**2 / nsky)
+
+	return pd.DataFrame({
+		'obsv_date': np.asarray(cube.dates)[cube.night[frames]],
+		'julianDate': cube.julianDate[frames],
+		'OTIME': pd.DatetimeIndex(cube.otime[frames]).tz_localize('UTC').tz_convert(timezone),
+		'MAG': mag,
+		'MERR': cube.merr[frames, star, aper],
+		'FLUX': flux,
+		'FERR': ferr,
+		'RAPERT': cube.rapert[cube.night[frames], aper],
+	})
+
+def cleanLightCurve(dates: list[str], qphot_dirs: list[str], comp_vmag: float, lid: int = 1, comp_lid: int = 2,
+					lids: list[int] = (1, 2, 3), xi_low: float = 0.5, xi_high: float = 0.5, window_fraction: float = 1 / 1.7,
+					zmag: float = ZMAG, itime: float = ITIME, epadu: float = EPADU, cube: PhotCube = None,
+					workers: int = None) -> CleanLightCurve:
+	"""
+	Cleaned differential light curve of star `lid` over all nights: loads the nights (unless a `cube` is given),
+	picks each night's aperture by the lowest variance of the star's magnitude, clips frames with the comparison star
+	and builds the light curve. `apertures` maps each date to its chosen aperture id (the RAPERT column suffix).
+	"""
+	cube = cube if cube is not None else loadPhotNights(dates, qphot_dirs, lids, workers=workers)
+	scores = apertureScores(cube, lid)
+	apertureIdx = bestApertures(scores, cube.dates)
+	keep, baseline = clipFrames(cube, apertureIdx, comp_lid, xi_low, xi_high, window_fraction)
+	data = differentialLightCurve(cube, apertureIdx, keep, comp_vmag, lid, comp_lid, zmag, itime, epadu)
+	apertures = {d: str(cube.apertures[i]) for d, i in zip(cube.dates, apertureIdx)}
+	return CleanLightCurve(data, apertures, scores, keep, baseline, cube)
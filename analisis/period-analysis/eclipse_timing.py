@@ -0,0 +1,196 @@
+"""
+Eclipse timing (O-C) across TESS sectors, ZTF and Iturbide.
+
+TESS sectors are extracted with eleanor (PCA flux) in parallel processes and cached per sector as .npz, so only new
+sectors are ever downloaded/extracted again. Sectors are normalized and concatenated into preallocated arrays in a
+single pass. Minima are measured for every cycle at once: each point is assigned to its nearest predicted minimum,
+and a weighted parabola is fitted to every window through per-cycle moment sums (np.add.reduceat) and one batched
+3x3 solve, so thousands of cycles take milliseconds and no per-cycle Python loop is needed. The O-C table is then
+fitted with a linear or quadratic ephemeris.
+
+Times are BJD/HJD in days; TESS BTJD is shifted by BTJD_OFFSET.
+"""
+
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+BTJD_OFFSET = 2457000.0
+
+SectorData = namedtuple("SectorData", "sector time flux ferr quality")
+Ephemeris = namedtuple("Ephemeris", "t0 period quadratic cov dPdE chi2")
+
+def sectorCachePath(cache_dir: str, target: str, sector: int) -> str:
+	return os.path.join(cache_dir, target.replace(' ', '_'), f"sector-{sector:03d}.npz")
+
+def _extractSector(ra: float, dec: float, sector: int, do_pca: bool) -> SectorData:
+	import eleanor
+	from astropy.coordinates import SkyCoord
+	source = eleanor.Source(coords=SkyCoord(ra, dec, unit='deg'), sector=int(sector))
+	data = eleanor.TargetData(source, do_pca=do_pca)
+	flux = data.pca_flux if do_pca else data.corr_flux
+	return SectorData(int(sector), np.asarray(data.time, dtype=float) + BTJD_OFFSET, np.asarray(flux, dtype=float),
+					  np.asarray(data.flux_err, dtype=float), np.asarray(data.quality))
+
+def loadSectors(target: str, ra: float, dec: float, cache_dir: str, sectors: list[int] | str = 'all', do_pca: bool = True,
+				workers: int = None) -> list[SectorData]:
+	"""
+	Per-sector light curves of the target, extracted in parallel for the sectors missing from `cache_dir`. With
+	sectors='all' the available sectors are looked up through eleanor.
+	"""
+	if sectors == 'all':
+		import eleanor
+		from astropy.coordinates import SkyCoord
+		sectors = [s.sector for s in eleanor.multi_sectors(coords=SkyCoord(ra, dec, unit='deg'), sectors='all')]
+
+	missing = [s for s in sectors if not os.path.exists(sectorCachePath(cache_dir, target, s))]
+	if len(missing) > 0:
+		os.makedirs(os.path.dirname(sectorCachePath(cache_dir, target, 0)), exist_ok=True)
+		with ProcessPoolExecutor(max_workers=workers or min(len(missing), max(os.cpu_count() - 2, 1))) as pool:
+			for sectorData in pool.map(_extractSector, *zip(*[(ra, dec, s, do_pca) for s in missing])):
+				np.savez(sectorCachePath(cache_dir, target, sectorData.sector), **sectorData._asdict())
+				print(f"Extracted sector {sectorData.sector} ({len(sectorData.time)} cadences)")
+
+	loaded = []
+	for s in sectors:
+		with np.load(sectorCachePath(cache_dir, target, s)) as cached:
+			loaded.append(SectorData(int(cached['sector']), cached['time'], cached['flux'], cached['ferr'], cached['quality']))
+	return loaded
+
+def concatSectors(sectors: list[SectorData], quality_flag: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	(time, flux, ferr) of the good-quality cadences of all sectors, each sector normalized by its mean flux, filled
+	into arrays allocated once.
+	"""
+	masks = [(s.quality == quality_flag) & np.isfinite(s.flux) for s in sectors]
+	total = int(sum(np.count_nonzero(m) for m in masks))
+	time, flux, ferr = np.empty(total), np.empty(total), np.empty(total)
+
+	start = 0
+	for s, mask in zip(sectors, masks):
+		stop = start + np.count_nonzero(mask)
+		normFactor = np.mean(s.flux[mask])
+		time[start:stop] = s.time[mask]
+		flux[start:stop] = s.flux[mask] / normFactor
+		ferr[start:stop] = s.ferr[mask] / normFactor
+		start = stop
+	order = np.argsort(time, kind='stable')
+	return time[order], flux[order], ferr[order]
+
+def measureMinima(time: np.ndarray, flux: np.ndarray, ferr: np.ndarray, period: float, t0: float = None, window: float = 0.1,
+				  cycle_step: float = 1, min_points: int = 5, magnitudes: bool = False, iterations: int = 2) -> pd.DataFrame:
+	"""
+	Time of minimum of every cycle covered by the data, from a weighted parabola fitted to the points within
+	`window` (fraction of the period) of the predicted minimum t0 + E * period. `cycle_step=0.5` also measures
+	secondary minima (half-integer cycles). Windows are re-centred on the fitted minima for `iterations` passes.
+	Cycles with fewer than `min_points` points, points on only one side of the minimum or no curvature are dropped.
+	"""
+	order = np.argsort(time, kind='stable')
+	time, flux, ferr = np.asarray(time, dtype=float)[order], np.asarray(flux, dtype=float)[order], np.asarray(ferr, dtype=float)[order]
+	y = -flux if magnitudes else flux # the fitted minimum is always of y
+	if t0 is None:
+		t0 = time[np.argmin(y)]
+
+	step = period * cycle_step
+	cycles = np.round((time - t0) / step)
+	# refined centre of every covered cycle, starting at the prediction and moved to each pass's fitted minimum
+	allCycles, pointCycleIdx = np.unique(cycles, return_inverse=True)
+	refined = t0 + allCycles * step
+	for _ in range(max(iterations, 1)):
+		dt = time - refined[pointCycleIdx]
+		inWindow = np.abs(dt) < window * period
+		cycleIdx, tOff, yw, w = cycles[inWindow], dt[inWindow], y[inWindow], 1 / ferr[inWindow]**2
+
+		uniqueCycles, groupStart, counts = np.unique(cycleIdx, return_index=True, return_counts=True)
+		# sum over each cycle of w * dt^k (k = 0..4) and w * y * dt^k (k = 0..2); points are sorted by time, so cycles are contiguous
+		moments = np.stack([np.add.reduceat(w * tOff**k, groupStart) for k in range(5)], axis=-1)
+		rhs = np.stack([np.add.reduceat(w * yw * tOff**k, groupStart) for k in range(3)], axis=-1)
+		normal = np.stack([moments[:, i:i + 3] for i in range(3)], axis=1)
+
+		valid = counts >= min_points
+		valid &= np.abs(np.linalg.det(normal)) > 1e-300
+		coeffs = np.full((len(uniqueCycles), 3), np.nan)
+		coeffs[valid] = np.linalg.solve(normal[valid], rhs[valid][..., np.newaxis])[..., 0]
+		a, b, c = coeffs.T
+		with np.errstate(divide='ignore', invalid='ignore'):
+			tMinOffset = -b / (2 * c)
+
+		# offsets of this pass are relative to the centres the windows were cut around
+		fitIdx = np.searchsorted(allCycles, uniqueCycles)
+		refinedCenter = refined[fitIdx]
+		with np.errstate(invalid='ignore'):
+			fitted = valid & np.isfinite(tMinOffset) & (c > 0) & (np.abs(tMinOffset) < window * period)
+		refined = refined.copy()
+		refined[fitIdx[fitted]] = refinedCenter[fitted] + tMinOffset[fitted]
+
+	# points on both sides of the minimum
+	tMin = refinedCenter + tMinOffset
+	minOffset = np.minimum.reduceat(tOff, groupStart) - tMinOffset
+	maxOffset = np.maximum.reduceat(tOff, groupStart) - tMinOffset
+	with np.errstate(invalid='ignore'):
+		valid &= (c > 0) & (minOffset < 0) & (maxOffset > 0) & (np.abs(tMinOffset) < window * period)
+
+	# error of -b/2c from the parameter covariance, scaled by the reduced chi2 of each cycle's fit
+	pointCycle = np.searchsorted(uniqueCycles, cycleIdx)
+	model = a[pointCycle] + b[pointCycle] * tOff + c[pointCycle] * tOff**2
+	chi2 = np.add.reduceat(w * (yw - model)**2, groupStart)
+	redChi2 = np.where(counts > 3, chi2 / np.maximum(counts - 3, 1), 1)
+	cov = np.full_like(normal, np.nan)
+	cov[valid] = np.linalg.inv(normal[valid]) * redChi2[valid, np.newaxis, np.newaxis]
+	jac = np.stack([np.zeros_like(b), -1 / (2 * c), b / (2 * c**2)], axis=-1)
+	with np.errstate(invalid='ignore'):
+		tMinErr = np.sqrt(np.einsum('ni,nij,nj->n', jac, cov, jac))
+	valid &= np.isfinite(tMinErr) & (tMinErr > 0)
+
+	return pd.DataFrame({'cycle': uniqueCycles * cycle_step, 'tmin': tMin, 'tmin_err': tMinErr, 'num_points': counts})[valid].reset_index(drop=True)
+
+def fitEphemeris(minima: pd.DataFrame, quadratic: bool = False) -> Ephemeris:
+	"""
+	Weighted least-squares ephemeris tmin = t0 + P E (+ Q E^2). For the quadratic ephemeris dP/dE = 2Q.
+	"""
+	E = minima['cycle'].to_numpy(dtype=float)
+	design = np.stack([np.ones_like(E), E] + ([E**2] if quadratic else []), axis=1)
+	weights = 1 / minima['tmin_err'].to_numpy()**2
+	normal = design.T @ (design * weights[:, np.newaxis])
+	params = np.linalg.solve(normal, design.T @ (weights * minima['tmin'].to_numpy()))
+	residuals = minima['tmin'].to_numpy() - design @ params
+	chi2 = float(np.sum(weights * residuals**2))
+	cov = np.linalg.inv(normal) * max(chi2 / max(len(E) - len(params), 1), 1)
+	Q = params[2] if quadratic else 0.0
+	return Ephemeris(params[0], params[1], Q, cov, 2 * Q, chi2)
+
+def ocTable(datasets: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]], period: float, t0: float, quadratic: bool = False,
+			magnitude_sources: list[str] = (), **minima_kwargs) -> tuple[pd.DataFrame, Ephemeris]:
+	"""
+	O-C of the minima of every source (name -> (time, flux or mag, err)) against the linear ephemeris (t0, period),
+	plus the ephemeris (linear or quadratic) fitted to all minima together. O-C columns are in days.
+	"""
+	tables = []
+	for name, (time, values, err) in datasets.items():
+		minima = measureMinima(time, values, err, period, t0, magnitudes=name in magnitude_sources, **minima_kwargs)
+		minima['source'] = name
+		tables.append(minima)
+	table = pd.concat(tables, ignore_index=True).sort_values('tmin', ignore_index=True)
+	table['oc'] = table['tmin'] - (t0 + table['cycle'] * period)
+
+	ephemeris = fitEphemeris(table, quadratic)
+	table['oc_model'] = ephemeris.t0 + ephemeris.period * table['cycle'] + ephemeris.quadratic * table['cycle']**2 - (t0 + table['cycle'] * period)
+	return table, ephemeris
+
+if __name__ == '__main__':
+	# regression check: minima shifted by a known O-C must be recovered whatever the number of re-centring passes
+	PERIOD, T0, INJECTED_OC = 0.5, 2459000.0, 0.010
+	rng = np.random.default_rng(0)
+	time = np.sort(rng.uniform(T0 - 0.2, T0 + 200 * PERIOD, 40000))
+	phase = np.mod((time - T0 - INJECTED_OC) / PERIOD + 0.5, 1) - 0.5
+	# parabolic eclipse wider than the fit window, so the parabola fit itself is unbiased
+	flux = 1 - 0.4 * np.clip(1 - (phase / 0.15)**2, 0, None) + rng.normal(0, 0.002, len(time))
+	ferr = np.full(len(time), 0.002)
+	for iterations in (1, 2, 3):
+		minima = measureMinima(time, flux, ferr, PERIOD, T0, iterations=iterations)
+		oc = minima['tmin'] - (T0 + minima['cycle'] * PERIOD)
+		assert len(minima) > 150 and np.all(np.abs(oc - INJECTED_OC) < 5e-4), (iterations, len(minima), oc.describe())
+		print(f"iterations={iterations}: {len(minima)} minima, O-C {oc.mean():.5f} +- {oc.std():.5f} d (injected {INJECTED_OC})")
@@ -0,0 +1,116 @@
+"""
+In-memory cache of deserialized bundles, keyed by the content hash and modification time of the saved archive.
+Callers always receive a copy of the cached bundle, so they're free to mutate it without affecting later loads.
+"""
+
+import os
+import hashlib
+from collections import OrderedDict, namedtuple
+
+import phoebe
+
+try:
+	import analisis.phoebe_model.bundle_io as bundle_io
+except ImportError:
+	import bundle_io
+
+DEFAULT_MAX_BYTES = int(os.environ.get("BUNDLE_CACHE_MAX_BYTES", 4 * 1024**3))
+# approximate in-memory size of a deserialized bundle per byte of its JSON (parameter objects, units and numpy arrays
+# of parsed values take several times the text they're read from)
+MEMORY_FACTOR = float(os.environ.get("BUNDLE_CACHE_MEMORY_FACTOR", 5))
+
+CacheEntry = namedtuple("CacheEntry", "bundle sizeBytes path")
+CacheStats = namedtuple("CacheStats", "hits misses evictions entries sizeBytes maxBytes")
+
+def fileDigest(path: str, blockSize: int = 1 << 22) -> str:
+	digest = hashlib.blake2b(digest_size=16)
+	with open(path, 'rb') as f:
+		while block := f.read(blockSize):
+			digest.update(block)
+	return digest.hexdigest()
+
+class BundleCache:
+	"""
+	LRU cache bounded by an approximate memory budget of `max_bytes`. Each entry is counted as its JSON size times
+	`memory_factor` (MEMORY_FACTOR by default), an estimate of the deserialized bundle: tune the factor if the
+	process' memory disagrees. A bundle larger than the whole budget is returned without being cached.
+	"""
+
+	def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, memory_factor: float = MEMORY_FACTOR) -> None:
+		self.max_bytes = max_bytes
+		self.memory_factor = memory_factor
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries: OrderedDict[tuple[str, int], CacheEntry] = OrderedDict()
+		self._digests: dict[str, tuple[int, int, str]] = {} # path -> (mtime_ns, size, digest)
+		self._sizeBytes = 0
+
+	def _key(self, path: str) -> tuple[str, int]:
+		fileStat = os.stat(path)
+		cachedDigest = self._digests.get(path)
+		if cachedDigest is not None and cachedDigest[:2] == (fileStat.st_mtime_ns, fileStat.st_size):
+			digest = cachedDigest[2]
+		else:
+			digest = fileDigest(path)
+			self._digests[path] = (fileStat.st_mtime_ns, fileStat.st_size, digest)
+		return digest, fileStat.st_mtime_ns
+
+	def load(self, path: str, print_stats: bool = False) -> phoebe.Bundle:
+		key = self._key(path)
+		entry = self._entries.get(key)
+		if entry is not None:
+			self.hits += 1
+			self._entries.move_to_end(key)
+			if print_stats:
+				print(f"Cache hit {path}")
+			return entry.bundle.copy()
+
+		self.misses += 1
+		b, ioStats = bundle_io.readBundle(path)
+		if print_stats:
+			print(bundle_io.formatStats(ioStats, "Loaded"))
+
+		self._dropEntries(path) # stale versions of a file that changed on disk
+		sizeBytes = int(ioStats.jsonBytes * self.memory_factor)
+		if sizeBytes > self.max_bytes:
+			return b
+		self._entries[key] = CacheEntry(b, sizeBytes, path)
+		self._sizeBytes += sizeBytes
+		self._evict()
+		return b.copy()
+
+	def _evict(self) -> None:
+		while self._sizeBytes > self.max_bytes and len(self._entries) > 0:
+			_, entry = self._entries.popitem(last=False)
+			self._sizeBytes -= entry.sizeBytes
+			self.evictions += 1
+
+	def _dropEntries(self, path: str = None) -> None:
+		for key in [k for k, e in self._entries.items() if path is None or e.path == path]:
+			self._sizeBytes -= self._entries.pop(key).sizeBytes
+
+	def invalidate(self, path: str = None) -> None:
+		"""
+		Drops every cached version of `path`, or the whole cache if no path is given. Counters are kept.
+		"""
+		self._dropEntries(path)
+		if path is None:
+			self._digests.clear()
+		else:
+			self._digests.pop(path, None)
+
+	def resize(self, max_bytes: int) -> None:
+		self.max_bytes = max_bytes
+		self._evict()
+
+	def stats(self) -> CacheStats:
+		return CacheStats(self.hits, self.misses, self.evictions, len(self._entries), self._sizeBytes, self.max_bytes)
+
+	def __str__(self) -> str:
+		stats = self.stats()
+		total = stats.hits + stats.misses
+		return (f"BundleCache: {stats.hits} hits, {stats.misses} misses ({(stats.hits/total if total else 0)*100:.1f}% hit rate), "
+		  		f"{stats.evictions} evictions | {stats.entries} bundles, ~{stats.sizeBytes/1e6:.1f}/{stats.maxBytes/1e6:.1f} MB")
+
+BUNDLE_CACHE = BundleCache()
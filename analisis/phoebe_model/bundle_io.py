@@ -0,0 +1,221 @@
+"""
+Streaming bundle (de)serialization. Bundles are written as JSON straight through the compression codec and decoded
+straight out of it when read, so no intermediate .json file ever touches the disk.
+
+Bundles are saved with gzip unless another codec is asked for: zstd/lz4 are faster but not installed everywhere the
+files are read (phoebe-server has neither).
+
+Only depends on phoebe and the standard library (zstandard/lz4 are optional), so it can be copied next to scripts
+that run on external compute.
+"""
+
+import os
+import io
+import json
+import gzip
+import time
+import hashlib
+import tempfile
+from collections import namedtuple
+
+import phoebe
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+try:
+	import lz4.frame
+except ImportError:
+	lz4 = None
+
+BundleIOStats = namedtuple("BundleIOStats", "path codec jsonBytes fileBytes seconds")
+
+# extension and magic bytes of each supported codec, in order of preference when saving
+DEFAULT_CODEC = 'gzip'
+CODEC_EXTENSIONS = {'zstd': '.json.zst', 'lz4': '.json.lz4', 'gzip': '.json.gz', 'none': '.json'}
+_CODEC_MAGIC = {'zstd': b'\x28\xb5\x2f\xfd', 'lz4': b'\x04\x22\x4d\x18', 'gzip': b'\x1f\x8b'}
+
+# exclusions used by phoebe itself when saving with compact=True
+_COMPACT_EXCLUDE = ['description', 'advanced', 'copy_for']
+
+def availableCodecs() -> list[str]:
+	codecs = []
+	if zstandard is not None:
+		codecs.append('zstd')
+	if lz4 is not None:
+		codecs.append('lz4')
+	return codecs + ['gzip', 'none']
+
+def preferredCodec() -> str:
+	"""
+	Codec used when none is given: DEFAULT_CODEC, readable in every environment regardless of optional packages.
+	"""
+	return DEFAULT_CODEC
+
+def fastestCodec() -> str:
+	"""
+	Fastest codec available in the current environment (zstd, lz4, then gzip), for files only read back here.
+	"""
+	return availableCodecs()[0]
+
+def codecFromPath(path: str) -> str | None:
+	for codec, ext in CODEC_EXTENSIONS.items():
+		if codec != 'none' and path.endswith(ext):
+			return codec
+	return 'none' if path.endswith('.json') else None
+
+def _sniffCodec(path: str) -> str:
+	with open(path, 'rb') as f:
+		header = f.read(4)
+	for codec, magic in _CODEC_MAGIC.items():
+		if header.startswith(magic):
+			return codec
+	return 'none'
+
+def _openCodec(fileobj, codec: str, mode: str, level: int = None):
+	if codec not in availableCodecs():
+		raise ValueError(f"Codec '{codec}' is not available; install the corresponding package or use one of {availableCodecs()}")
+
+	if codec == 'gzip':
+		return gzip.GzipFile(fileobj=fileobj, mode=mode, compresslevel=(level if level is not None else 6))
+	if codec == 'zstd':
+		if mode == 'rb':
+			return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+		return zstandard.ZstdCompressor(level=(level if level is not None else 3), threads=-1).stream_writer(fileobj, closefd=False)
+	if codec == 'lz4':
+		return lz4.frame.LZ4FrameFile(fileobj, mode=mode[0], compression_level=(level if level is not None else 0))
+	return fileobj
+
+class _CountingReader(io.RawIOBase):
+	"""
+	Raw reader over a (decompressing) stream that counts the bytes read through it.
+	"""
+
+	def __init__(self, stream) -> None:
+		self._stream = stream
+		self.bytesRead = 0
+
+	def readable(self) -> bool:
+		return True
+
+	def readinto(self, buffer) -> int:
+		data = self._stream.read(len(buffer))
+		buffer[:len(data)] = data
+		self.bytesRead += len(data)
+		return len(data)
+
+class _JSONEncoder(json.JSONEncoder):
+	def default(self, o):
+		# numpy values that may be left over in a parameter's json representation
+		if hasattr(o, 'tolist'):
+			return o.tolist()
+		return super().default(o)
+
+def _encodeBundle(b: phoebe.Bundle, compact: bool):
+	if compact:
+		# single-shot encoding goes through the C encoder, much faster than iterating over chunks
+		yield json.dumps(b.to_json(incl_uniqueid=True, exclude=_COMPACT_EXCLUDE), separators=(',', ':'), cls=_JSONEncoder)
+	else:
+		yield from _JSONEncoder(sort_keys=True, indent=0, separators=(',', ': ')).iterencode(b.to_json(incl_uniqueid=True))
+
+def _writeJsonChunks(stream, chunks, bufferSize: int = 1 << 22) -> int:
+	"""
+	Writes the encoded JSON in blocks of roughly `bufferSize` characters; returns the number of (uncompressed) bytes written.
+	"""
+	totalBytes = 0
+	pending = []
+	pendingSize = 0
+	for chunk in chunks:
+		pending.append(chunk)
+		pendingSize += len(chunk)
+		if pendingSize >= bufferSize:
+			encoded = "".join(pending).encode('utf-8')
+			for i in range(0, len(encoded), bufferSize):
+				stream.write(encoded[i:i+bufferSize])
+			totalBytes += len(encoded)
+			pending.clear()
+			pendingSize = 0
+
+	if pending:
+		encoded = "".join(pending).encode('utf-8')
+		stream.write(encoded)
+		totalBytes += len(encoded)
+	return totalBytes
+
+def readBundle(path: str) -> tuple[phoebe.Bundle, BundleIOStats]:
+	"""
+	Loads a bundle saved with any of the supported codecs (detected from the file contents, not the extension). The
+	JSON is decoded as text straight out of the codec stream, so no decompressed bytes copy is held besides the text
+	json.load parses.
+	"""
+	start = time.perf_counter()
+	codec = _sniffCodec(path)
+	with open(path, 'rb') as f:
+		stream = _openCodec(f, codec, 'rb')
+		counter = _CountingReader(stream)
+		try:
+			b = phoebe.load(io.TextIOWrapper(io.BufferedReader(counter, buffer_size=1 << 22), encoding='utf-8'))
+		finally:
+			if stream is not f:
+				stream.close()
+	return b, BundleIOStats(path, codec, counter.bytesRead, os.path.getsize(path), time.perf_counter() - start)
+
+def writeBundle(b: phoebe.Bundle, path: str, codec: str = None, compact: bool = True, level: int = None) -> BundleIOStats:
+	"""
+	Serializes the bundle to JSON and streams it through the codec into `path`. The archive is written to a temporary
+	file in the same folder and moved into place once complete, so concurrent readers never see a partial bundle.
+
+	If no codec is given it is inferred from the extension of `path`, defaulting to the preferred available codec.
+	"""
+	start = time.perf_counter()
+	if codec is None:
+		codec = codecFromPath(path) or preferredCodec()
+
+	saveFolder = os.path.dirname(os.path.abspath(path))
+	os.makedirs(saveFolder, exist_ok=True)
+	fd, tempPath = tempfile.mkstemp(dir=saveFolder, prefix=f".{os.path.basename(path)}.", suffix=".part")
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			stream = _openCodec(f, codec, 'wb', level)
+			jsonBytes = _writeJsonChunks(stream, _encodeBundle(b, compact))
+			if stream is not f:
+				stream.close()
+		os.replace(tempPath, path)
+	except BaseException:
+		if os.path.exists(tempPath):
+			os.remove(tempPath)
+		raise
+
+	return BundleIOStats(path, codec, jsonBytes, os.path.getsize(path), time.perf_counter() - start)
+
+def bundleDigest(b: phoebe.Bundle) -> str:
+	"""
+	Content hash of the bundle's compact JSON, for keying files derived from its current state.
+	"""
+	digest = hashlib.blake2b(digest_size=16)
+	for chunk in _encodeBundle(b, compact=True):
+		digest.update(chunk.encode('utf-8'))
+	return digest.hexdigest()
+
+def findBundleFile(basePath: str) -> str:
+	"""
+	Resolves a bundle path without extension (eg. bundle-saves/sub/name) to the saved archive. When several codecs
+	are present the most recently modified file is used.
+	"""
+	if codecFromPath(basePath) is not None and os.path.exists(basePath):
+		return basePath
+
+	candidates = [f"{basePath}{ext}" for ext in CODEC_EXTENSIONS.values() if os.path.exists(f"{basePath}{ext}")]
+	if len(candidates) == 0:
+		raise FileNotFoundError(f"No saved bundle found for {basePath} ({', '.join(CODEC_EXTENSIONS.values())})")
+	return max(candidates, key=os.path.getmtime)
+
+def stripBundleExtension(path: str) -> str:
+	codec = codecFromPath(path)
+	return path[:-len(CODEC_EXTENSIONS[codec])] if codec is not None else path
+
+def formatStats(stats: BundleIOStats, action: str) -> str:
+	return (f"{action} {stats.path} [{stats.codec}] | {stats.jsonBytes/1e6:.1f} MB json, {stats.fileBytes/1e6:.1f} MB on disk "
+		 	f"| {stats.seconds:.2f} s ({stats.jsonBytes/1e6/max(stats.seconds, 1e-9):.1f} MB/s)")
@@ -0,0 +1,120 @@
+"""
+Per-(model, dataset) chi2 cache. Each dataset's chi2 is calculated once per model computation and set of
+observations (keyed on the model's timestamp and a fingerprint of the dataset's times, fluxes, sigmas and sigmas_lnf)
+and group totals are built by summing the cached per-dataset values, which is equivalent to calling calculate_chi2 on
+the whole group since chi2 is additive across datasets.
+"""
+
+import hashlib
+import weakref
+
+import phoebe
+import numpy as np
+import pandas as pd
+
+ITURBIDE_DATASETS = ['lc_iturbide_norm', 'lcIturbide']
+
+def defaultDatasetGroups(b: phoebe.Bundle) -> dict[str, list[str]]:
+	"""
+	Same dataset groups reported by utils.printChi2: all light curves, raw Gaia (and each band), Iturbide and ZTF
+	(and each band). Groups with no matching datasets are left out.
+	"""
+	rawGaiaDatasets = [d for d in b.datasets if ('raw' in d and 'gaia' in d) or ('Gaia' in d)]
+	ztfDatasets = [d for d in b.datasets if 'Ztf' in d]
+	allLcs = [d for d in b.datasets if 'mesh' not in d]
+
+	groups = {'All': allLcs, 'Gaia (Raw)': rawGaiaDatasets}
+	groups |= {gd: [gd] for gd in rawGaiaDatasets}
+	groups['Iturbide (Norm)'] = [d for d in ITURBIDE_DATASETS if d in b.datasets]
+	groups['ZTF'] = ztfDatasets
+	groups |= {zd: [zd] for zd in ztfDatasets}
+	return {name: datasets for name, datasets in groups.items() if len(datasets) > 0}
+
+class Chi2Cache:
+
+	def __init__(self, b: phoebe.Bundle) -> None:
+		self.b = b
+		self.evaluations = 0
+		self.hits = 0
+		self._values: dict[tuple[str, str], tuple[str, float]] = {} # (model, dataset) -> (model key, chi2)
+
+	def modelDatasets(self, model: str) -> list[str]:
+		return self.b.filter(model=model, context='model').datasets
+
+	def _modelKey(self, model: str, dataset: str) -> str:
+		try:
+			return str(self.b.get_value(qualifier='timestamp', model=model, context='model'))
+		except ValueError: # no timestamp stored with the model, fingerprint the computed fluxes instead
+			digest = hashlib.blake2b(digest_size=16)
+			for fluxes in self.b.filter(qualifier='fluxes', model=model, dataset=dataset, context='model').to_list():
+				digest.update(np.ascontiguousarray(fluxes.get_value()).tobytes())
+			return digest.hexdigest()
+
+	def _datasetKey(self, dataset: str) -> str:
+		"""
+		Fingerprint of the dataset parameters chi2 depends on besides the model: times, fluxes, sigmas and sigmas_lnf.
+		"""
+		digest = hashlib.blake2b(digest_size=16)
+		for param in self.b.filter(qualifier=['times', 'fluxes', 'sigmas', 'sigmas_lnf'], dataset=dataset, context='dataset', check_visible=False).to_list():
+			digest.update(f"{param.qualifier}@{param.component}:".encode('utf-8'))
+			digest.update(np.ascontiguousarray(param.get_value(), dtype=float).tobytes())
+		return digest.hexdigest()
+
+	def datasetChi2(self, model: str, dataset: str) -> float:
+		"""
+		chi2 of a single dataset for the given model; NaN if the dataset isn't part of the model.
+		"""
+		if dataset not in self.modelDatasets(model):
+			return np.nan
+
+		modelKey = f"{self._modelKey(model, dataset)}:{self._datasetKey(dataset)}"
+		cached = self._values.get((model, dataset))
+		if cached is not None and cached[0] == modelKey:
+			self.hits += 1
+			return cached[1]
+
+		chi2 = float(np.sum(self.b.calculate_chi2(model=model, dataset=dataset)))
+		self.evaluations += 1
+		self._values[(model, dataset)] = (modelKey, chi2)
+		return chi2
+
+	def groupChi2(self, model: str, datasets: list[str] | str) -> float:
+		"""
+		Sum of the per-dataset chi2 values of the datasets in the group present in the model; NaN if none are.
+		"""
+		if type(datasets) is str:
+			datasets = [datasets]
+		values = [self.datasetChi2(model, d) for d in datasets]
+		values = [v for v in values if not np.isnan(v)]
+		return float(np.sum(values)) if len(values) > 0 else np.nan
+
+	def table(self, models: list[str] = None, dataset_groups: dict[str, list[str]] = None) -> pd.DataFrame:
+		"""
+		chi2 values as a (model x dataset group) table. Defaults to all models in the bundle and `defaultDatasetGroups`.
+		"""
+		if models is None:
+			models = self.b.models
+		if dataset_groups is None:
+			dataset_groups = defaultDatasetGroups(self.b)
+
+		rows = [[self.groupChi2(m, datasets) for datasets in dataset_groups.values()] for m in models]
+		return pd.DataFrame(rows, index=pd.Index(models, name='model'), columns=list(dataset_groups.keys()))
+
+	def invalidate(self, model: str = None) -> None:
+		for key in [k for k in self._values.keys() if model is None or k[0] == model]:
+			del self._values[key]
+
+	def __str__(self) -> str:
+		return f"Chi2Cache: {self.evaluations} chi2 evaluations, {self.hits} cached lookups, {len(self._values)} entries"
+
+_BUNDLE_CACHES: dict[int, tuple[weakref.ref, Chi2Cache]] = {}
+
+def getChi2Cache(b: phoebe.Bundle) -> Chi2Cache:
+	"""
+	Cache associated with the bundle, created on first use. Kept for as long as the bundle is alive.
+	"""
+	bundleRef, cache = _BUNDLE_CACHES.get(id(b), (None, None))
+	if bundleRef is None or bundleRef() is not b:
+		cache = Chi2Cache(weakref.proxy(b)) # don't keep the bundle alive through the registry
+		_BUNDLE_CACHES[id(b)] = (weakref.ref(b, lambda _, bundleId=id(b): _BUNDLE_CACHES.pop(bundleId, None)), cache)
+	return cache
@@ -0,0 +1,172 @@
+"""
+Local executor for the standalone solver/compute scripts written by `opt_utils.optimize_params(export=True)`,
+`mcmc_utils.exportSampler`/`continueSampler` and `utils.exportCompute`.
+
+Scripts run as subprocesses (at most `max_parallel` at a time, MAX_PARALLEL environment variable by default) from
+the folder they were exported to, so their results/ files land next to them just as when run by hand on the server.
+Status, runtime and peak RSS of every job are tracked in a JSON manifest in that same folder; finished solutions and
+models can be imported back into the bundle as soon as each job completes.
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import signal
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import cpu_count
+
+import phoebe
+
+MAX_PARALLEL = int(os.environ.get("MAX_PARALLEL", max(cpu_count() - 2, 2)))
+MANIFEST_FNAME = "manifest.json"
+POLL_INTERVAL_S = 0.5
+
+_SAVE_PATTERN = re.compile(r"""\.save\(\s*(?:filename\s*=\s*)?['"]([^'"]+)['"]""")
+
+def discoverJobs(subfolder: str = None, jobs_folder: str = "external-jobs", pattern: str = "*.py") -> list[str]:
+	folder = jobs_folder if subfolder is None else os.path.join(jobs_folder, subfolder)
+	return sorted(glob.glob(os.path.join(folder, pattern)))
+
+def scriptResultPath(script: str) -> str | None:
+	"""
+	Output file of an exported script (the out_fname given to export_solver/export_compute), relative to its folder.
+	"""
+	with open(script, 'r') as scriptFile:
+		matches = _SAVE_PATTERN.findall(scriptFile.read())
+	return matches[-1] if len(matches) > 0 else None
+
+def loadManifest(manifest_path: str) -> dict[str, dict]:
+	if not os.path.exists(manifest_path):
+		return {}
+	with open(manifest_path, 'r') as manifestFile:
+		return json.load(manifestFile)
+
+def _writeManifest(manifest: dict[str, dict], manifest_path: str) -> None:
+	tempPath = f"{manifest_path}.part"
+	with open(tempPath, 'w') as manifestFile:
+		json.dump(manifest, manifestFile, indent=1)
+	os.replace(tempPath, manifest_path)
+
+def _runJob(job: dict, python: str, timeout: float | None, onUpdate) -> dict:
+	# job records are only modified through onUpdate, under the lock that also guards writing the manifest
+	start = time.time()
+	onUpdate(job, status='running', start=start)
+	peakRss = None
+	timedOut = False
+	deadline = start + timeout if timeout else None
+
+	with open(job['log'], 'w') as logFile:
+		proc = subprocess.Popen([python, os.path.basename(job['script'])], cwd=job['cwd'], stdout=logFile, stderr=subprocess.STDOUT)
+		if hasattr(os, 'wait4'): # resource usage of this child only, unlike getrusage(RUSAGE_CHILDREN)
+			# polled rather than killed from a timer: until wait4 reaps the child its pid can't be reused, so the kill
+			# below always reaches the job (os.kill, since Popen.kill may reap it through poll())
+			while True:
+				pid, waitStatus, rusage = os.wait4(proc.pid, os.WNOHANG)
+				if pid != 0:
+					break
+				if deadline is not None and not timedOut and time.time() >= deadline:
+					os.kill(proc.pid, signal.SIGKILL)
+					timedOut = True
+				time.sleep(POLL_INTERVAL_S)
+			proc.returncode = os.waitstatus_to_exitcode(waitStatus)
+			peakRss = rusage.ru_maxrss / 1024 # kB on Linux
+		else:
+			try:
+				proc.wait(timeout=timeout)
+			except subprocess.TimeoutExpired:
+				proc.kill()
+				proc.wait()
+				timedOut = True
+
+	end = time.time()
+	resultPath = os.path.join(job['cwd'], job['result']) if job.get('result') else None
+	if timedOut:
+		status = 'timeout'
+	else:
+		status = 'done' if proc.returncode == 0 and (resultPath is None or os.path.exists(resultPath)) else 'failed'
+	onUpdate(job, peak_rss_mb=peakRss, end=end, runtime_s=end - start, returncode=proc.returncode, status=status)
+	return job
+
+def importJobResult(b: phoebe.Bundle, job: dict, overwrite: bool = True) -> str | None:
+	"""
+	Imports the solution (or model, for .model files) produced by a finished job; returns its name in the bundle.
+	"""
+	if job.get('status') != 'done' or not job.get('result'):
+		return None
+	resultPath = os.path.join(job['cwd'], job['result'])
+	if resultPath.endswith('.model'):
+		return b.import_model(resultPath, overwrite=overwrite).models[0]
+	return b.import_solution(resultPath, overwrite=overwrite).solutions[0]
+
+def runJobs(scripts: list[str], b: phoebe.Bundle = None, max_parallel: int = MAX_PARALLEL, manifest_path: str = None,
+			python: str = sys.executable, rerun_done: bool = False, timeout: float = None) -> dict[str, dict]:
+	"""
+	Runs the exported scripts across a local pool of `max_parallel` subprocesses. Jobs already marked as done in the
+	manifest are skipped unless `rerun_done`; jobs still running after `timeout` seconds are killed and marked as
+	'timeout'. If a bundle is given, each finished job's result is imported into it as soon as the job completes.
+	Returns the manifest (script path -> job record).
+	"""
+	if len(scripts) == 0:
+		return {}
+	if manifest_path is None:
+		manifest_path = os.path.join(os.path.dirname(os.path.abspath(scripts[0])), MANIFEST_FNAME)
+
+	manifest = loadManifest(manifest_path)
+	manifestLock = threading.Lock()
+	def onUpdate(job: dict = None, **changes):
+		with manifestLock:
+			if job is not None:
+				job.update(changes)
+			_writeManifest(manifest, manifest_path)
+
+	pending = []
+	for script in scripts:
+		scriptPath = os.path.abspath(script)
+		job = manifest.get(scriptPath)
+		if job is not None and job.get('status') == 'done' and not rerun_done:
+			continue
+		cwd = os.path.dirname(scriptPath)
+		os.makedirs(os.path.join(cwd, "results"), exist_ok=True)
+		job = {'script': scriptPath, 'cwd': cwd, 'status': 'queued', 'result': scriptResultPath(scriptPath),
+		 		'log': os.path.join(cwd, "results", f"{os.path.splitext(os.path.basename(scriptPath))[0]}.log")}
+		manifest[scriptPath] = job
+		pending.append(job)
+	onUpdate()
+
+	print(f"Running {len(pending)} jobs ({len(scripts) - len(pending)} already done) | max parallel = {max_parallel}")
+	with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+		futures = [pool.submit(_runJob, job, python, timeout, onUpdate) for job in pending]
+		for future in as_completed(futures):
+			job = future.result()
+			peakRss = f" | peak RSS {job['peak_rss_mb']:.0f} MB" if job.get('peak_rss_mb') is not None else ""
+			print(f"[{job['status'].upper()}] {os.path.basename(job['script'])} | {job['runtime_s']:.1f} s{peakRss}")
+			if b is not None and job['status'] == 'done':
+				try:
+					onUpdate(job, imported=importJobResult(b, job))
+				except Exception as e:
+					print("Failed to import result", job['result'], e)
+	return manifest
+
+def importResults(b: phoebe.Bundle, manifest_path: str, overwrite: bool = True) -> list[str]:
+	"""
+	Imports every finished job's result listed in the manifest into the bundle.
+	"""
+	imported = []
+	for job in loadManifest(manifest_path).values():
+		name = importJobResult(b, job, overwrite=overwrite)
+		if name is not None:
+			imported.append(name)
+	return imported
+
+def printManifest(manifest: dict[str, dict] | str) -> None:
+	if type(manifest) is str:
+		manifest = loadManifest(manifest)
+	for job in manifest.values():
+		runtime = f"{job['runtime_s']:.1f} s" if job.get('runtime_s') is not None else "-"
+		peakRss = f"{job['peak_rss_mb']:.0f} MB" if job.get('peak_rss_mb') is not None else "-"
+		print(f"{job['status']:>8} | {runtime:>10} | {peakRss:>8} | {os.path.basename(job['script'])} -> {job.get('result')}")
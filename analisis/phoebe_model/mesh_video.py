@@ -0,0 +1,167 @@
+"""
+Mesh animations rendered in parallel and cached as mp4 videos.
+
+Instead of one FuncAnimation drawn frame after frame in the notebook, every mesh time is plotted on its own (Agg
+canvas) across a pool of worker processes, each with its own copy of the bundle, and the raw frames are streamed in
+order through a single ffmpeg pipe. Axis and colour limits are fixed beforehand from the whole mesh model so frames
+match as in an animation. Videos are cached under `cache_dir`, named by a hash of the bundle contents, mesh dataset
+and plot options: re-rendering an unchanged bundle only reads the file back.
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import tempfile
+import subprocess
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import matplotlib.pyplot as plt
+import phoebe
+
+try:
+	import analisis.phoebe_model.bundle_io as bundle_io
+except ImportError:
+	import bundle_io
+
+DEFAULT_CACHE_DIR = "mesh-videos"
+DEFAULT_PLOT_KWARGS = {"draw_sidebars": True, "color": "inferno"}
+
+def meshTimes(b: phoebe.Bundle, meshDataset: str = "mesh01") -> np.ndarray:
+	"""
+	Sorted times of the computed mesh model.
+	"""
+	times = b.filter(dataset=meshDataset, context='model', check_visible=False).times
+	if len(times) == 0:
+		raise ValueError(f"No computed model for {meshDataset}; run_compute with the mesh dataset enabled first")
+	return np.sort(np.array(times, dtype=float))
+
+def fixedLimits(b: phoebe.Bundle, meshDataset: str, fc: str, plot_kwargs: dict, margin: float = 0.05) -> dict[str, tuple[float, float]]:
+	"""
+	xlim, ylim and fclim over all mesh times (the extent an animation would keep fixed), for the ones not already in
+	`plot_kwargs` and whose quantity is a column of the mesh model. Element centres are padded by `margin` of the span.
+	"""
+	model = b.filter(dataset=meshDataset, context='model', check_visible=False)
+	limits = {}
+	for limit, qualifier, pad in (('xlim', plot_kwargs.get('x', 'us'), margin), ('ylim', plot_kwargs.get('y', 'vs'), margin), ('fclim', fc, 0)):
+		if limit in plot_kwargs or not isinstance(qualifier, str):
+			continue
+		params = model.filter(qualifier=qualifier).to_list()
+		if len(params) == 0:
+			continue
+		values = np.concatenate([np.ravel(np.asarray(p.get_value(), dtype=float)) for p in params])
+		low, high = np.nanmin(values), np.nanmax(values)
+		span = high - low
+		limits[limit] = (float(low - pad * span), float(high + pad * span))
+	return limits
+
+def videoKey(b: phoebe.Bundle, meshDataset: str, fc: str, plot_kwargs: dict, fps: float, figsize: tuple[float, float], dpi: float) -> str:
+	options = {'dataset': meshDataset, 'fc': fc, 'kwargs': plot_kwargs, 'fps': fps, 'figsize': list(figsize), 'dpi': dpi}
+	digest = hashlib.blake2b(digest_size=16)
+	digest.update(bundle_io.bundleDigest(b).encode('utf-8'))
+	digest.update(json.dumps(options, sort_keys=True, default=repr).encode('utf-8'))
+	return digest.hexdigest()
+
+_FRAME_BUNDLE: phoebe.Bundle = None
+_FRAME_CONFIG: dict = None
+
+def _init_frame_worker(bundle_path: str, config: dict) -> None:
+	global _FRAME_BUNDLE, _FRAME_CONFIG
+	plt.switch_backend('Agg')
+	plt.rcParams['figure.figsize'] = config['figsize']
+	plt.rcParams['figure.dpi'] = config['dpi']
+	phoebe.logger(clevel='ERROR')
+	_FRAME_BUNDLE, _ = bundle_io.readBundle(bundle_path)
+	_FRAME_CONFIG = config
+
+def _render_frame(t: float) -> np.ndarray:
+	config = _FRAME_CONFIG
+	_, mplfig = _FRAME_BUNDLE.plot(dataset=config['dataset'], kind='mesh', time=t, fc=config['fc'], ec='face', show=False,
+								   **config['plot_kwargs'])
+	mplfig.canvas.draw()
+	frame = np.asarray(mplfig.canvas.buffer_rgba())[:, :, :3].copy()
+	plt.close(mplfig)
+	return frame
+
+def _ffmpeg(path: str, width: int, height: int, fps: float) -> subprocess.Popen:
+	return subprocess.Popen([plt.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+							 '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}", '-r', str(fps), '-i', '-',
+							 '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+							 '-movflags', '+faststart', '-f', 'mp4', path], stdin=subprocess.PIPE)
+
+def renderMeshVideo(b: phoebe.Bundle, meshDataset: str = "mesh01", fc: str = 'teffs', fps: float = 10, workers: int = None,
+					cache_dir: str = DEFAULT_CACHE_DIR, use_cache: bool = True, figsize: tuple[float, float] = None,
+					dpi: float = None, print_stats: bool = False, **plot_kwargs) -> str:
+	"""
+	Path of the mp4 of the mesh model of `meshDataset` coloured by `fc` (plot_kwargs on top of DEFAULT_PLOT_KWARGS are
+	passed to b.plot). Rendered across `workers` processes unless a cached video for the same bundle and options
+	exists. Figure size and dpi default to the current rcParams.
+	"""
+	plot_kwargs = DEFAULT_PLOT_KWARGS | plot_kwargs
+	figsize = tuple(figsize or plt.rcParams['figure.figsize'])
+	dpi = dpi or plt.rcParams['figure.dpi']
+	videoPath = os.path.join(cache_dir, f"{meshDataset}-{videoKey(b, meshDataset, fc, plot_kwargs, fps, figsize, dpi)}.mp4")
+	if use_cache and os.path.exists(videoPath):
+		if print_stats:
+			print(f"Cached mesh video {videoPath}")
+		return videoPath
+
+	start = time.perf_counter()
+	times = meshTimes(b, meshDataset)
+	config = {'dataset': meshDataset, 'fc': fc, 'plot_kwargs': plot_kwargs | fixedLimits(b, meshDataset, fc, plot_kwargs),
+			  'figsize': figsize, 'dpi': dpi}
+	workers = workers or min(max(cpu_count() - 2, 1), len(times))
+
+	os.makedirs(cache_dir, exist_ok=True)
+	workFolder = tempfile.mkdtemp(prefix="mesh-video-")
+	bundlePath = os.path.join(workFolder, "mesh-bundle.json")
+	bundle_io.writeBundle(b, bundlePath, codec='none')
+	fd, tempPath = tempfile.mkstemp(dir=cache_dir, prefix=f".{os.path.basename(videoPath)}.", suffix=".part")
+	os.close(fd)
+	encoder = None
+	try:
+		with Pool(workers, initializer=_init_frame_worker, initargs=(bundlePath, config)) as pool:
+			# frames arrive in time order; ffmpeg starts once the first one gives the frame size
+			for frame in pool.imap(_render_frame, times, chunksize=max(len(times) // (4 * workers), 1)):
+				if encoder is None:
+					encoder = _ffmpeg(tempPath, frame.shape[1], frame.shape[0], fps)
+				encoder.stdin.write(frame.tobytes())
+		encoder.stdin.close()
+		if encoder.wait() != 0:
+			raise RuntimeError(f"ffmpeg failed encoding {videoPath} (exit code {encoder.returncode})")
+		os.replace(tempPath, videoPath)
+	except BaseException:
+		if encoder is not None and encoder.poll() is None:
+			encoder.kill()
+		if os.path.exists(tempPath):
+			os.remove(tempPath)
+		raise
+	finally:
+		os.remove(bundlePath)
+		os.rmdir(workFolder)
+
+	if print_stats:
+		print(f"Rendered {len(times)} frames of {meshDataset} to {videoPath} in {time.perf_counter() - start:.1f} s ({workers} workers)")
+	return videoPath
+
+def videoHtml(path: str, autoplay: bool = True, loop: bool = True) -> str:
+	"""
+	<video> tag with the mp4 embedded, as FuncAnimation.to_html5_video.
+	"""
+	with open(path, 'rb') as videoFile:
+		encoded = base64.b64encode(videoFile.read()).decode('ascii')
+	options = " ".join(["controls"] + (["autoplay"] if autoplay else []) + (["loop"] if loop else []))
+	return f'<video {options}><source type="video/mp4" src="data:video/mp4;base64,{encoded}"></video>'
+
+def clearMeshVideos(cache_dir: str = DEFAULT_CACHE_DIR) -> int:
+	"""
+	Deletes the cached videos; returns how many there were.
+	"""
+	if not os.path.isdir(cache_dir):
+		return 0
+	videos = [f for f in os.listdir(cache_dir) if f.endswith(".mp4")]
+	for f in videos:
+		os.remove(os.path.join(cache_dir, f))
+	return len(videos)
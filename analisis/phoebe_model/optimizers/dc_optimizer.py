@@ -1,14 +1,31 @@
 import sys
 import os
-import gzip
 import shutil
+import argparse
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import cpu_count
 
 import numpy as np
 import phoebe
 from phoebe import u
 
 try:
-	from utils import printChi2
+	import analisis.phoebe_model.bundle_io as bundle_io
+except ImportError: # copy bundle_io.py alongside this script when running on external compute
+	import bundle_io
+
+try:
+	from analisis.phoebe_model.bundle_cache import BUNDLE_CACHE
+except ImportError:
+	try:
+		from bundle_cache import BUNDLE_CACHE
+	except ImportError: # optional on external compute; bundles are loaded directly
+		BUNDLE_CACHE = None
+
+try:
+	from utils import printChi2, printFittedVals
 except ImportError: # will happen when running on external compute, copy over necessary functions here
 	def __matchAnyTwig(twig: str, twigs_list: list[str]) -> bool:
 		for refTwig in twigs_list:
@@ -71,31 +88,39 @@ except ImportError: # will happen when running on external compute, copy over ne
 		except:
 			pass
 
-def load_bundle(path: str) -> phoebe.Bundle:
-	tempJsonFile = path.replace('.gz', '') # work with compressed files
-	with gzip.open(path, 'rb') as f_in:
-		with open(tempJsonFile, 'wb') as f_out:
-			shutil.copyfileobj(f_in, f_out)
-	
-	b = phoebe.load(tempJsonFile)
-	os.remove(tempJsonFile)
+def load_bundle(path: str, use_cache: bool = True) -> phoebe.Bundle:
+	path = bundle_io.findBundleFile(path)
+	if use_cache and BUNDLE_CACHE is not None:
+		return BUNDLE_CACHE.load(path, print_stats=True)
+
+	b, stats = bundle_io.readBundle(path)
+	print(bundle_io.formatStats(stats, "Loaded"))
 	return b
 
-def save_bundle(b: phoebe.Bundle, path: str, compact: bool = True, compress: bool = True) -> str:
-	if '.json' not in path:
-		path = f"{path}.json"
-		
-	jsonFile = b.save(path, compact=compact)
-	if compress:
-		with open(jsonFile, 'rb') as f_in:
-			with gzip.open(f"{jsonFile}.gz", 'wb') as f_out:
-				shutil.copyfileobj(f_in, f_out)
-		os.remove(jsonFile)
-		return f"{jsonFile}.gz"
-	
-	return jsonFile
+def save_bundle(b: phoebe.Bundle, path: str, compact: bool = True, compress: bool = True, codec: str = None) -> str:
+	"""
+	Codec is taken from the extension of `path` when present (eg. .json.gz), otherwise `codec` or gzip is used.
+	"""
+	if not compress:
+		codec = 'none'
+	elif bundle_io.codecFromPath(path) == 'none':
+		path = bundle_io.stripBundleExtension(path) # plain .json path given, compress it anyway
 
-def run_dc(b: phoebe.Bundle, num_iter: int, solver: str, solution: str) -> None:
+	if bundle_io.codecFromPath(path) is None:
+		codec = codec or bundle_io.preferredCodec()
+		path = f"{path}{bundle_io.CODEC_EXTENSIONS[codec]}"
+
+	stats = bundle_io.writeBundle(b, path, codec=codec, compact=compact)
+	print(bundle_io.formatStats(stats, "Saved"))
+	return stats.path
+
+DC_MODEL = 'dc_solution_model'
+DC_CHI2_DATASETS = ['lcZtfG', 'lcZtfR']
+
+DCResult = namedtuple("DCResult", "solution chi2")
+DCChainResult = namedtuple("DCChainResult", "start chi2 solutionFile startValues")
+
+def run_dc(b: phoebe.Bundle, num_iter: int, solver: str, solution: str, print_best: bool = True) -> DCResult:
 	"""
 	Run differential corrections algorithm for the specified number of iterations.
 
@@ -103,7 +128,7 @@ def run_dc(b: phoebe.Bundle, num_iter: int, solver: str, solution: str) -> None:
 	"""
 
 	bestSolution: str = None
-	bestChi2 = 1e6
+	bestChi2 = np.inf
 
 	for i in range(num_iter):
 		try:
@@ -112,38 +137,169 @@ def run_dc(b: phoebe.Bundle, num_iter: int, solver: str, solution: str) -> None:
 			# printFittedVals(b, solution=f"{solution}_{i}")
 			b.adopt_solution(f"{solution}_{i}")
 
-			b.run_compute(model='dc_solution_model', overwrite=True)
-			# printChi2(b, model='dc_solution_model')
+			b.run_compute(model=DC_MODEL, overwrite=True)
+			# printChi2(b, model=DC_MODEL)
 
-			ztfChi2 = np.sum(b.calculate_chi2(model='dc_solution_model', dataset=['lcZtfG', 'lcZtfR']))
+			ztfChi2 = np.sum(b.calculate_chi2(model=DC_MODEL, dataset=DC_CHI2_DATASETS))
 			if ztfChi2 < bestChi2:
 				bestSolution = f"{solution}_{i}"
 				bestChi2 = ztfChi2
 		except:
 			print("Error running and adopting step")
 	
+	if bestSolution is None:
+		print("No differential corrections step completed successfully")
+	elif print_best:
+		print("Best solution")
+		print("----------------------------")
+		printFittedVals(b, solution=bestSolution)
+	return DCResult(bestSolution, bestChi2)
+
+def _paramLimits(param) -> tuple[float, float]:
+	limits = getattr(param, 'limits', None) or (None, None)
+	low, high = [l.to(param.default_unit).value if hasattr(l, 'unit') else l for l in limits]
+	return (low if low is not None else -np.inf), (high if high is not None else np.inf)
+
+def perturbation_step(b: phoebe.Bundle, twig: str, param, scale: float, steps: dict[str, float] = None) -> float | None:
+	"""
+	Standard deviation of the additive perturbation of a fit parameter: `steps[twig]` when given, otherwise `scale`
+	times the width of the parameter's limits, `scale` times the orbital period for t0 parameters, or `scale` times
+	the value itself for the remaining (one-sided or unlimited) nonzero parameters. None if there's no sensible step.
+	"""
+	if steps is not None and twig in steps:
+		return steps[twig]
+	low, high = _paramLimits(param)
+	if np.isfinite(low) and np.isfinite(high):
+		return scale * (high - low)
+	if param.qualifier.startswith('t0'):
+		return scale * b.get_value(qualifier='period', kind='orbit', context='component', check_visible=False)
+	value = param.get_value()
+	return scale * abs(value) if value != 0 else None
+
+def perturb_fit_parameters(b: phoebe.Bundle, solver: str, scale: float, rng: np.random.Generator,
+						   steps: dict[str, float] = None) -> dict[str, float]:
+	"""
+	Adds step*N(0, 1) to each of the solver's fit parameters (see perturbation_step), clipped to the parameter limits.
+	Returns the resulting starting values.
+	"""
+	startValues = {}
+	for twig in b.get_value(qualifier='fit_parameters', solver=solver):
+		param = b.get_parameter(twig, context=['component', 'dataset', 'feature', 'system'])
+		value = param.get_value()
+		step = perturbation_step(b, twig, param, scale, steps)
+		if step is None:
+			print(f"No perturbation step for {twig} (value 0 without finite limits); pass one in `steps`")
+			startValues[twig] = float(value)
+			continue
+
+		low, high = _paramLimits(param)
+		newValue = np.clip(value + step * rng.normal(), low, high)
+		param.set_value(newValue)
+		startValues[twig] = float(newValue)
+	return startValues
+
+def _init_dc_worker() -> None:
+	# each chain is already one process per core; avoid oversubscribing with phoebe's own parallelism
+	phoebe.multiprocessing_off()
+	phoebe.logger(clevel='WARNING')
+
+def _run_dc_chain(bundle_path: str, start: int, num_iter: int, solver: str, solution: str,
+				  perturbation: float, seed: int, result_folder: str, steps: dict[str, float] = None) -> DCChainResult:
+	b, _ = bundle_io.readBundle(bundle_path) # worker's own copy of the bundle
+
+	startValues = {}
+	if start > 0: # first chain always runs from the unperturbed starting point
+		startValues = perturb_fit_parameters(b, solver, perturbation, np.random.default_rng([seed, start]), steps)
+
+	chainSolution = f"{solution}_s{start}"
+	result = run_dc(b, num_iter=num_iter, solver=solver, solution=chainSolution, print_best=False)
+	if result.solution is None:
+		return DCChainResult(start, np.inf, None, startValues)
+
+	solutionFile = os.path.join(result_folder, f"{chainSolution}_solution")
+	b.filter(context='solution', solution=result.solution, check_visible=False).save(solutionFile, incl_uniqueid=True)
+	return DCChainResult(start, result.chi2, solutionFile, startValues)
+
+def run_dc_multistart(b: phoebe.Bundle, num_iter: int, solver: str, solution: str, starts: int, workers: int = None,
+					  perturbation: float = 0.02, seed: int = 0, bundle_path: str = None, steps: dict[str, float] = None) -> DCResult:
+	"""
+	Runs `starts` independent differential corrections chains, each from the current parameter values perturbed by
+	`perturbation` times each parameter's step (its limits' width unless given in `steps`, see perturbation_step;
+	chain 0 starts unperturbed), spread across a process pool of `workers`.
+
+	Every chain's best solution is imported into `b` as {solution}_s{start}; the overall best (lowest ZTF chi2) is
+	adopted and computed into dc_solution_model.
+	"""
+	workers = min(workers or max(cpu_count() - 2, 1), starts)
+	workFolder = tempfile.mkdtemp(prefix=f"{solution}-", dir=os.path.dirname(os.path.abspath(bundle_path)) if bundle_path else None)
+	try:
+		if bundle_path is None:
+			bundle_path = os.path.join(workFolder, "dc-start.json.gz")
+			bundle_io.writeBundle(b, bundle_path, codec='gzip')
+
+		chainResults: list[DCChainResult] = []
+		with ProcessPoolExecutor(max_workers=workers, initializer=_init_dc_worker) as pool:
+			futures = [pool.submit(_run_dc_chain, bundle_path, start, num_iter, solver, solution, perturbation, seed, workFolder, steps)
+			  			for start in range(starts)]
+			for future in as_completed(futures):
+				try:
+					chainResult = future.result()
+				except Exception as e:
+					print("Differential corrections chain failed:", e)
+					continue
+				chainResults.append(chainResult)
+				print(f"Chain {chainResult.start} finished | ZTF chi2 = {chainResult.chi2}")
+
+		bestSolution: str = None
+		bestChi2 = np.inf
+		for chainResult in sorted(chainResults, key=lambda r: r.start):
+			if chainResult.solutionFile is None:
+				continue
+			chainSolution = b.import_solution(chainResult.solutionFile, solution=f"{solution}_s{chainResult.start}", overwrite=True).solutions[0]
+			if chainResult.chi2 < bestChi2:
+				bestSolution = chainSolution
+				bestChi2 = chainResult.chi2
+	finally:
+		shutil.rmtree(workFolder, ignore_errors=True)
+
+	print("", "Multi-start summary", "----------------------------", sep='\n')
+	for chainResult in sorted(chainResults, key=lambda r: r.chi2):
+		print(f"\t{solution}_s{chainResult.start}", "-", chainResult.chi2)
+
+	if bestSolution is None:
+		print("No differential corrections chain completed successfully")
+		return DCResult(None, np.inf)
+
+	b.adopt_solution(bestSolution)
+	b.run_compute(model=DC_MODEL, overwrite=True)
+
 	print("Best solution")
 	print("----------------------------")
 	printFittedVals(b, solution=bestSolution)
+	return DCResult(bestSolution, bestChi2)
 
 
 if __name__ == '__main__':
-	if len(sys.argv) != 6:
-		print("Usage: python dc-optimizer.py {solver} {solution} {num_iter} {bundle_start_path} {result_path}")
-		exit(1)
+	parser = argparse.ArgumentParser(prog="dc_optimizer.py", description="Run differential corrections on a saved bundle")
+	parser.add_argument("solver", help="solver name")
+	parser.add_argument("solution", help="solution name")
+	parser.add_argument("num_iter", type=int, help="number of iterations to perform differential corrections")
+	parser.add_argument("bundle_start", help="bundle path to run corrections on")
+	parser.add_argument("result_path", help="path to save resulting bundle to")
+	parser.add_argument("--starts", type=int, default=1, help="number of independent chains from perturbed starting points")
+	parser.add_argument("--workers", type=int, default=None, help="process pool size for multi-start runs (default: cpu count - 2)")
+	parser.add_argument("--perturbation", type=float, default=0.02, help="scale of the starting point perturbation, as a fraction of each parameter's limits")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
 
 	logger = phoebe.logger(clevel='WARNING')
 
-	# arguments expected to script
-        # solver name
-		# solution name
-		# bundle path to run corrections on
-		# number of iterations to perform differential corrections
-	_, solver_name, solution_name, num_iter, bundle_start, result_path = sys.argv
-
 	# b: phoebe.Bundle = phoebe.load(bundle_start)
-	b = load_bundle(bundle_start)
-	run_dc(b, num_iter=int(num_iter), solver=solver_name, solution=solution_name)
+	b = load_bundle(args.bundle_start, use_cache=False) # single load per job, nothing to gain from caching
+	if args.starts > 1:
+		run_dc_multistart(b, num_iter=args.num_iter, solver=args.solver, solution=args.solution, starts=args.starts, workers=args.workers,
+							perturbation=args.perturbation, seed=args.seed, bundle_path=bundle_io.findBundleFile(args.bundle_start))
+	else:
+		run_dc(b, num_iter=args.num_iter, solver=args.solver, solution=args.solution)
 	# b.save(result_path, compact=True)
-	save_bundle(b, result_path)
-	
\ No newline at end of file
+	save_bundle(b, args.result_path)
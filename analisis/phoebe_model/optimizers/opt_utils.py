@@ -1,13 +1,27 @@
 import os
+import json
+import time
+import hashlib
+import tempfile
+import itertools
 from collections import namedtuple
+from multiprocessing import Pool, cpu_count
 
+import numpy as np
+import pandas as pd
 import phoebe
 from phoebe import u
 
 try:
 	import analisis.phoebe_model.utils as gen_utils
+	import analisis.phoebe_model.bundle_io as bundle_io
+	from analisis.phoebe_model.chi2_cache import Chi2Cache, defaultDatasetGroups
+	from analisis.general.record_log import RecordLog
 except ImportError:
 	import utils as gen_utils
+	import bundle_io
+	from chi2_cache import Chi2Cache, defaultDatasetGroups
+	from record_log import RecordLog
 
 AdoptSolutionResult = namedtuple("AdoptSolutionResult", "solutionName computeModelName")
 def adopt_solution(b: phoebe.Bundle, label:str=None, solution_name:str=None,
@@ -51,34 +65,165 @@ def adopt_solution(b: phoebe.Bundle, label:str=None, solution_name:str=None,
 				b.set_value(twig, value=val)
 	return AdoptSolutionResult(solution_name, computeModelName)
 
-def optimize_params(b: phoebe.Bundle, fit_twigs: list[str], label: str, export: bool, datasets: list[str], subfolder: str=None, 
-					optimizer='optimizer.nelder_mead', compute='phoebe01', overwrite_export=True,
+def optimize_params(b: phoebe.Bundle, fit_twigs: list[str], label: str, export: bool, datasets: list[str] = None, subfolder: str=None, 
+					optimizer='optimizer.nelder_mead', compute='phoebe01', overwrite_export=True, profile: str = None,
 					**solver_kwargs):
 	if not 'maxiter' in solver_kwargs.keys():
 		solver_kwargs['maxiter'] = 200 if export else 10
 
-	abilitatedDatasets = [d for d in b.datasets if b.get_value(qualifier='enabled', dataset=d)]
-	gen_utils.abilitateDatasets(b, datasets, False)
-	
-	saveIterProgress = 1 if export and optimizer == 'optimizer.nelder_mead' else 0
-	b.add_solver(optimizer, solver=f'opt_{label}', fit_parameters=fit_twigs, overwrite=True, 
-			  				progress_every_niters=saveIterProgress, compute=compute, **solver_kwargs)
-	if export:
-		if not os.path.exists('external-jobs'):
-			os.mkdir('external-jobs')
-		if subfolder is not None:
-			os.makedirs(os.path.join('external-jobs', subfolder), exist_ok=True)
+	# only `datasets` (or those of the named `profile`, resolved once per bundle) enabled while the solver is added and
+	# exported/run; without either the current enabled datasets are used
+	with gen_utils.datasetProfile(b, datasets, includeMesh=False, name=profile):
+		saveIterProgress = 1 if export and optimizer == 'optimizer.nelder_mead' else 0
+		b.add_solver(optimizer, solver=f'opt_{label}', fit_parameters=fit_twigs, overwrite=True, 
+				  				progress_every_niters=saveIterProgress, compute=compute, **solver_kwargs)
+		if export:
+			if not os.path.exists('external-jobs'):
+				os.mkdir('external-jobs')
+			if subfolder is not None:
+				os.makedirs(os.path.join('external-jobs', subfolder), exist_ok=True)
 		
-		exportPath = f'./external-jobs{f"/{subfolder}" if subfolder is not None else ""}/{optimizer}_opt_{label}.py'
-		if not overwrite_export and os.path.exists(exportPath):
-			print("Solver already exists |", exportPath)
+			exportPath = f'./external-jobs{f"/{subfolder}" if subfolder is not None else ""}/{optimizer}_opt_{label}.py'
+			if not overwrite_export and os.path.exists(exportPath):
+				print("Solver already exists |", exportPath)
+			else:
+				fname, out_fname = b.export_solver(script_fname=exportPath, out_fname=f'./results/opt_{label}_solution', 
+													solver=f'opt_{label}', solution=f'opt_{label}_solution', overwrite=True)
+				print("External Solver:", fname, out_fname)
 		else:
-			fname, out_fname = b.export_solver(script_fname=exportPath, out_fname=f'./results/opt_{label}_solution', 
-												solver=f'opt_{label}', solution=f'opt_{label}_solution', overwrite=True)
-			print("External Solver:", fname, out_fname)
-	else:
-		b.run_solver(solver=f'opt_{label}', solution=f'opt_{label}_solution', overwrite=True, **solver_kwargs)
-
-	gen_utils.abilitateDatasets(b, abilitatedDatasets)
-	
-	return f'opt_{label}', f'opt_{label}_solution'
\ No newline at end of file
+			b.run_solver(solver=f'opt_{label}', solution=f'opt_{label}_solution', overwrite=True, **solver_kwargs)
+
+	return f'opt_{label}', f'opt_{label}_solution'
+
+def grid_points(axes: dict[str, list[float]]) -> tuple[list[str], np.ndarray]:
+	"""
+	Full grid over the given parameter values (in each parameter's default units). Returns (twigs, points).
+	"""
+	twigs = list(axes.keys())
+	return twigs, np.array(list(itertools.product(*axes.values())), dtype=float).reshape(-1, len(twigs))
+
+def latin_hypercube_points(bounds: dict[str, tuple[float, float]], num_points: int, seed: int = 0) -> tuple[list[str], np.ndarray]:
+	"""
+	Latin hypercube sample of `num_points` within the (low, high) bounds of each parameter. Returns (twigs, points).
+	"""
+	rng = np.random.default_rng(seed)
+	twigs = list(bounds.keys())
+	low, high = np.array(list(bounds.values()), dtype=float).T
+	strata = (np.argsort(rng.random((num_points, len(twigs))), axis=0) + rng.random((num_points, len(twigs)))) / num_points
+	return twigs, low + strata * (high - low)
+
+_SWEEP_BUNDLE: phoebe.Bundle = None
+_SWEEP_CONFIG: dict = None
+
+def _init_sweep_worker(bundle_path: str, config: dict) -> None:
+	global _SWEEP_BUNDLE, _SWEEP_CONFIG
+	phoebe.multiprocessing_off() # one forward model per core
+	phoebe.logger(clevel='ERROR')
+	_SWEEP_BUNDLE, _ = bundle_io.readBundle(bundle_path) # worker's own copy of the bundle
+	_SWEEP_CONFIG = config
+
+def _sweep_point(point: tuple[int, np.ndarray]) -> tuple[np.ndarray, str | None]:
+	"""
+	Log row of the point and, if it failed, the exception as "Type: message".
+	"""
+	pointId, values = point
+	b, config = _SWEEP_BUNDLE, _SWEEP_CONFIG
+	groupNames = list(config['dataset_groups'].keys())
+
+	start = time.perf_counter()
+	chi2 = np.full(len(groupNames), np.nan)
+	failed = 0.
+	error = None
+	try:
+		for twig, value in zip(config['twigs'], values):
+			b.set_value(twig, value=value)
+		b.run_compute(model='sweep_model', compute=config['compute'], overwrite=True)
+		chi2Cache = Chi2Cache(b)
+		chi2 = np.array([chi2Cache.groupChi2('sweep_model', config['dataset_groups'][g]) for g in groupNames])
+	except Exception as e:
+		failed = 1.
+		error = f"{type(e).__name__}: {e}"
+	return np.concatenate([[pointId], values, chi2, [time.perf_counter() - start, failed]]), error
+
+def sweep_columns(twigs: list[str], dataset_groups: dict[str, list[str]]) -> list[str]:
+	return ['point_id'] + twigs + [f"chi2:{g}" for g in dataset_groups.keys()] + ['compute_s', 'failed']
+
+def sweep_points_hash(twigs: list[str], points: np.ndarray) -> str:
+	digest = hashlib.blake2b(digest_size=16)
+	digest.update(json.dumps(list(twigs)).encode('utf-8'))
+	digest.update(np.ascontiguousarray(points, dtype='<f8').tobytes())
+	return digest.hexdigest()
+
+def sweep_errors_path(out_path: str) -> str:
+	return f"{out_path}.errors.jsonl"
+
+def sweep_params(b: phoebe.Bundle, twigs: list[str], points: np.ndarray, out_path: str, datasets: list[str] = None,
+				 dataset_groups: dict[str, list[str]] = None, compute='phoebe01', workers: int = None, profile: str = None) -> RecordLog:
+	"""
+	Evaluates the forward model at every point (rows of `points`, columns ordered as `twigs`, default units) across a
+	pool of worker processes, each with its own copy of the bundle. Only the chi2 of each dataset group
+	(`chi2_cache.defaultDatasetGroups` by default), compute time and a failure flag come back from the workers; rows
+	are appended to the record log at `out_path` as they finish. The exception of every failed point is appended to
+	`sweep_errors_path(out_path)`.
+
+	Re-running with the same `out_path` resumes the sweep: points whose ids are already in the log are skipped. The log
+	keeps a hash of `twigs` and `points`, and resuming with different ones is an error (use a new `out_path`).
+	Only `datasets` are enabled while the starting bundle is written (see utils.datasetProfile; `profile` names it).
+	"""
+	points = np.atleast_2d(np.asarray(points, dtype=float))
+	workers = workers or max(cpu_count() - 2, 1)
+
+	with gen_utils.datasetProfile(b, datasets, includeMesh=False, name=profile) as enabledDatasets:
+		if dataset_groups is None:
+			dataset_groups = defaultDatasetGroups(b)
+			if datasets is not None or profile is not None:
+				dataset_groups = {g: [d for d in ds if d in enabledDatasets] for g, ds in dataset_groups.items()}
+				dataset_groups = {g: ds for g, ds in dataset_groups.items() if len(ds) > 0}
+
+		pointsHash = sweep_points_hash(twigs, points)
+		sweepLog = RecordLog(out_path, columns=sweep_columns(twigs, dataset_groups),
+							 meta={'twigs': twigs, 'dataset_groups': dataset_groups, 'compute': compute, 'points_hash': pointsHash})
+		if sweepLog.meta.get('points_hash') != pointsHash:
+			raise ValueError(f"{out_path} was logged with different twigs or points; use another out_path for a new sweep")
+		doneIds = set(sweepLog.read()['point_id'].astype(int).tolist())
+		pending = [(i, points[i]) for i in range(len(points)) if i not in doneIds]
+		print(f"Sweeping {len(pending)} points ({len(doneIds)} already in {out_path}) | {workers} workers")
+		if len(pending) == 0:
+			return sweepLog
+
+		workFolder = tempfile.mkdtemp(prefix="sweep-")
+		bundlePath = os.path.join(workFolder, "sweep-start.json.gz")
+		bundle_io.writeBundle(b, bundlePath, codec='gzip')
+
+	config = {'twigs': twigs, 'dataset_groups': dataset_groups, 'compute': compute}
+	numFailed = 0
+	try:
+		with (sweepLog, open(sweep_errors_path(out_path), 'a') as errorsFile,
+			  Pool(workers, initializer=_init_sweep_worker, initargs=(bundlePath, config)) as pool):
+			for numDone, (row, error) in enumerate(pool.imap_unordered(_sweep_point, pending, chunksize=1), start=1):
+				sweepLog.append(row)
+				if error is not None:
+					errorsFile.write(json.dumps({'point_id': int(row[0]), 'error': error}) + "\n")
+					errorsFile.flush()
+					if numFailed == 0:
+						print(f"Point {int(row[0])} failed: {error}")
+					numFailed += 1
+				if numDone % max(len(pending) // 20, 1) == 0:
+					print(f"{numDone}/{len(pending)} points ({numFailed} failed)")
+	finally:
+		os.remove(bundlePath)
+		os.rmdir(workFolder)
+	return sweepLog
+
+def load_sweep(out_path: str):
+	"""
+	Sweep results as a DataFrame, one row per evaluated point, with the exception of failed points in `error`.
+	"""
+	sweep = pd.DataFrame(RecordLog(out_path).read())
+	errors = {}
+	if os.path.exists(sweep_errors_path(out_path)):
+		with open(sweep_errors_path(out_path), 'r') as errorsFile:
+			# a line cut short by an interrupted run is skipped
+			errors = {e['point_id']: e['error'] for e in map(json.loads, filter(lambda l: l.endswith("\n"), errorsFile))}
+	sweep['error'] = [errors.get(int(pointId)) if failed else None for pointId, failed in zip(sweep['point_id'], sweep['failed'])]
+	return sweep
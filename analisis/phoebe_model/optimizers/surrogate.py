@@ -0,0 +1,279 @@
+"""
+Light curve emulator to stand in for run_compute during the early phases of optimization and sampling.
+
+A bank of forward models is computed in parallel over a Latin hypercube of the fitted parameters; each dataset's
+model fluxes are compressed with PCA and the component weights interpolated with a radial basis function. The
+surrogate is periodically checked against the true model at the current best point and refitted (with that point
+added to the bank) whenever its error drifts above tolerance. Final values are left in the bundle, ready to be
+polished by the regular optimizers/samplers in opt_utils and mcmc_utils.
+"""
+
+import os
+import time
+import tempfile
+from collections import namedtuple
+from multiprocessing import Pool, cpu_count
+
+import emcee
+import numpy as np
+import phoebe
+from scipy.interpolate import RBFInterpolator
+from scipy.optimize import minimize
+
+try:
+	import analisis.phoebe_model.bundle_io as bundle_io
+	import analisis.phoebe_model.utils as gen_utils
+	from analisis.phoebe_model.optimizers.opt_utils import latin_hypercube_points
+	from analisis.phoebe_model.sampling.mcmc_utils import LATEX_LABELS
+except ImportError:
+	import bundle_io
+	import utils as gen_utils
+	from opt_utils import latin_hypercube_points
+	from mcmc_utils import LATEX_LABELS
+
+SURROGATE_MODEL = 'surrogate_check_model'
+
+AccuracyCheck = namedtuple("AccuracyCheck", "values maxRelError datasetErrors refitted")
+
+def default_fit_twigs(b: phoebe.Bundle) -> list[str]:
+	"""
+	Parameters in LATEX_LABELS present in the bundle and not constrained.
+	"""
+	twigs = []
+	for twig in LATEX_LABELS.keys():
+		try:
+			if len(b.get_parameter(twig).constrained_by) == 0:
+				twigs.append(twig)
+		except ValueError:
+			pass
+	return twigs
+
+def default_bounds(b: phoebe.Bundle, twigs: list[str], rel_width: float = 0.1) -> dict[str, tuple[float, float]]:
+	bounds = {}
+	for twig in twigs:
+		value = b.get_value(twig)
+		halfWidth = abs(value) * rel_width if value != 0 else rel_width
+		bounds[twig] = (value - halfWidth, value + halfWidth)
+	return bounds
+
+def _model_fluxes(b: phoebe.Bundle, datasets: list[str], model: str) -> dict[str, np.ndarray]:
+	"""
+	Model fluxes at each dataset's observation times, interpolated in phase when the model was computed over a single
+	cycle (compute_phases) rather than at the observations (see utils.interpModelFluxes).
+	"""
+	fluxes = {}
+	for d in datasets:
+		modelTimes = np.asarray(b.get_value(qualifier='times', dataset=d, model=model, context='model'), dtype=float)
+		modelFluxes = np.asarray(b.get_value(qualifier='fluxes', dataset=d, model=model, context='model'), dtype=float)
+		obsTimes = np.asarray(b.get_value(qualifier='times', dataset=d, context='dataset'), dtype=float)
+		if len(modelTimes) == len(obsTimes) and np.allclose(modelTimes, obsTimes):
+			fluxes[d] = modelFluxes
+		else:
+			fluxes[d] = gen_utils.interpModelFluxes(b, obsTimes, modelTimes, modelFluxes)
+	return fluxes
+
+_BANK_BUNDLE: phoebe.Bundle = None
+_BANK_CONFIG: dict = None
+
+def _init_bank_worker(bundle_path: str, config: dict) -> None:
+	global _BANK_BUNDLE, _BANK_CONFIG
+	phoebe.multiprocessing_off()
+	phoebe.logger(clevel='ERROR')
+	_BANK_BUNDLE, _ = bundle_io.readBundle(bundle_path)
+	_BANK_CONFIG = config
+
+def _bank_sample(values: np.ndarray) -> np.ndarray | None:
+	b, config = _BANK_BUNDLE, _BANK_CONFIG
+	try:
+		for twig, value in zip(config['twigs'], values):
+			b.set_value(twig, value=value)
+		b.run_compute(model=SURROGATE_MODEL, compute=config['compute'], overwrite=True)
+		fluxes = _model_fluxes(b, config['datasets'], SURROGATE_MODEL)
+		return np.concatenate([fluxes[d] for d in config['datasets']])
+	except Exception:
+		return None
+
+def compute_model_bank(b: phoebe.Bundle, twigs: list[str], points: np.ndarray, datasets: list[str], compute='phoebe01',
+					   workers: int = None) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Forward models at every point across a process pool (each worker with its own bundle copy). Returns the points
+	that computed successfully and the concatenated fluxes of `datasets` at each of them.
+	"""
+	workers = workers or max(cpu_count() - 2, 1)
+	workFolder = tempfile.mkdtemp(prefix="surrogate-")
+	bundlePath = os.path.join(workFolder, "bank-start.json.gz")
+	bundle_io.writeBundle(b, bundlePath, codec='gzip')
+	config = {'twigs': twigs, 'datasets': datasets, 'compute': compute}
+	try:
+		start = time.perf_counter()
+		with Pool(workers, initializer=_init_bank_worker, initargs=(bundlePath, config)) as pool:
+			results = pool.map(_bank_sample, list(points), chunksize=1)
+		print(f"Computed {len(points)} forward models in {time.perf_counter() - start:.1f} s ({workers} workers)")
+	finally:
+		os.remove(bundlePath)
+		os.rmdir(workFolder)
+
+	ok = [i for i, r in enumerate(results) if r is not None]
+	if len(ok) < len(points):
+		print(f"{len(points) - len(ok)} forward models failed and were left out of the bank")
+	return np.asarray(points)[ok], np.array([results[i] for i in ok])
+
+class LightCurveSurrogate:
+	"""
+	Emulates the model fluxes of `datasets` as a function of `twigs` (default units) within `bounds`.
+	"""
+
+	def __init__(self, b: phoebe.Bundle, twigs: list[str], bounds: dict[str, tuple[float, float]], datasets: list[str],
+				 compute='phoebe01', variance_kept: float = 0.99999, smoothing: float = 0.0) -> None:
+		self.b = b
+		self.twigs = twigs
+		self.datasets = datasets
+		self.compute = compute
+		self.variance_kept = variance_kept
+		self.smoothing = smoothing
+		self.low, self.high = np.array([bounds[t] for t in twigs], dtype=float).T
+
+		self.obsFluxes = {d: np.asarray(b.get_value(qualifier='fluxes', dataset=d, context='dataset')) for d in datasets}
+		self.obsSigmas = {d: np.asarray(b.get_value(qualifier='sigmas', dataset=d, context='dataset')) for d in datasets}
+		self._splits = np.cumsum([len(self.obsFluxes[d]) for d in datasets])[:-1]
+
+		self.X = np.empty((0, len(twigs)))
+		self.Y = np.empty((0, int(np.sum([len(f) for f in self.obsFluxes.values()]))))
+		self._interpolator: RBFInterpolator = None
+
+	def _scale(self, values: np.ndarray) -> np.ndarray:
+		return (np.asarray(values, dtype=float) - self.low) / (self.high - self.low)
+
+	def in_bounds(self, values: np.ndarray) -> bool:
+		return bool(np.all((values >= self.low) & (values <= self.high)))
+
+	def train(self, num_points: int, seed: int = 0, workers: int = None) -> None:
+		_, points = latin_hypercube_points({t: (l, h) for t, l, h in zip(self.twigs, self.low, self.high)}, num_points, seed=seed)
+		X, Y = compute_model_bank(self.b, self.twigs, points, self.datasets, compute=self.compute, workers=workers)
+		self.add_samples(X, Y)
+
+	def add_samples(self, X: np.ndarray, Y: np.ndarray) -> None:
+		self.X = np.vstack([self.X, np.atleast_2d(X)])
+		self.Y = np.vstack([self.Y, np.atleast_2d(Y)])
+		self.fit()
+
+	def fit(self) -> None:
+		self._mean = self.Y.mean(axis=0)
+		_, singularValues, components = np.linalg.svd(self.Y - self._mean, full_matrices=False)
+		explained = np.cumsum(singularValues**2) / max(np.sum(singularValues**2), np.finfo(float).tiny)
+		numComponents = int(np.searchsorted(explained, self.variance_kept) + 1)
+		self._components = components[:numComponents]
+		weights = (self.Y - self._mean) @ self._components.T
+		self._interpolator = RBFInterpolator(self._scale(self.X), weights, kernel='thin_plate_spline', smoothing=self.smoothing)
+		print(f"Surrogate fitted on {len(self.X)} models | {numComponents} principal components")
+
+	def predict_flat(self, values: np.ndarray) -> np.ndarray:
+		"""
+		Concatenated fluxes of all datasets; `values` may be a single point or an (N, ndim) batch.
+		"""
+		values = np.atleast_2d(values)
+		return self._interpolator(self._scale(values)) @ self._components + self._mean
+
+	def predict(self, values: np.ndarray) -> dict[str, np.ndarray]:
+		return dict(zip(self.datasets, np.split(self.predict_flat(values)[0], self._splits)))
+
+	def chi2(self, values: np.ndarray) -> np.ndarray:
+		"""
+		chi2 against the observations for a single point or a batch of points.
+		"""
+		obs = np.concatenate([self.obsFluxes[d] for d in self.datasets])
+		sigmas = np.concatenate([self.obsSigmas[d] for d in self.datasets])
+		chi2 = np.sum(((self.predict_flat(values) - obs) / sigmas)**2, axis=1)
+		return chi2 if np.ndim(values) > 1 else chi2[0]
+
+	def check_accuracy(self, values: np.ndarray, tol: float = 1e-3, refit: bool = True) -> AccuracyCheck:
+		"""
+		Runs the true forward model at `values` (on the surrogate's bundle) and compares it with the prediction. If the
+		maximum relative error exceeds `tol` the true model is added to the bank and the surrogate refitted. The bundle's
+		parameter values are restored afterwards.
+		"""
+		originalValues = [self.b.get_value(twig) for twig in self.twigs]
+		try:
+			for twig, value in zip(self.twigs, values):
+				self.b.set_value(twig, value=value)
+			self.b.run_compute(model=SURROGATE_MODEL, compute=self.compute, overwrite=True)
+			trueFluxes = _model_fluxes(self.b, self.datasets, SURROGATE_MODEL)
+		finally:
+			for twig, value in zip(self.twigs, originalValues):
+				self.b.set_value(twig, value=value)
+			if SURROGATE_MODEL in self.b.models:
+				self.b.remove_model(SURROGATE_MODEL)
+
+		predicted = self.predict(values)
+		datasetErrors = {d: float(np.max(np.abs(predicted[d] - trueFluxes[d]) / np.maximum(np.abs(trueFluxes[d]), np.finfo(float).tiny)))
+				   		 for d in self.datasets}
+		maxRelError = max(datasetErrors.values())
+		refitted = False
+		if refit and maxRelError > tol:
+			self.add_samples(values, np.concatenate([trueFluxes[d] for d in self.datasets]))
+			refitted = True
+		return AccuracyCheck(np.array(values), maxRelError, datasetErrors, refitted)
+
+def surrogate_nelder_mead(surrogate: LightCurveSurrogate, x0: np.ndarray = None, maxiter: int = 2000, check_every: int = 100,
+						  tol: float = 1e-3, max_refits: int = 10) -> np.ndarray:
+	"""
+	Nelder-Mead on the surrogate chi2. Every `check_every` iterations the current best point is checked against the
+	true model; if the surrogate drifted it's refitted and the optimization restarts from that point. The best values
+	are set in the surrogate's bundle.
+	"""
+	x = np.asarray(x0 if x0 is not None else [surrogate.b.get_value(t) for t in surrogate.twigs], dtype=float)
+	objective = lambda values: surrogate.chi2(values) if surrogate.in_bounds(values) else np.inf
+
+	numRefits = 0
+	numIters = 0
+	while numIters < maxiter:
+		result = minimize(objective, x, method='Nelder-Mead', options={'maxiter': min(check_every, maxiter - numIters), 'xatol': 1e-8, 'fatol': 1e-8})
+		x = result.x
+		numIters += result.nit
+		check = surrogate.check_accuracy(x, tol=tol)
+		print(f"Iteration {numIters} | surrogate chi2 = {result.fun:.3f} | max rel. error {check.maxRelError:.2e}{' (refitted)' if check.refitted else ''}")
+		if check.refitted:
+			numRefits += 1
+			if numRefits > max_refits:
+				print("Surrogate keeps drifting; stopping, continue with the true model")
+				break
+		elif result.success:
+			break
+
+	for twig, value in zip(surrogate.twigs, x):
+		surrogate.b.set_value(twig, value=value)
+	return x
+
+def surrogate_emcee(surrogate: LightCurveSurrogate, nwalkers: int, nsteps: int, check_every: int = 500, tol: float = 1e-3,
+					p0: np.ndarray = None, seed: int = 0) -> emcee.EnsembleSampler:
+	"""
+	Runs emcee on the surrogate likelihood (uniform priors within the surrogate bounds), checking the surrogate against
+	the true model at the best walker every `check_every` steps. Use `add_surrogate_init_distribution` to start the
+	full sampler (mcmc_utils.exportSampler init_from=...) from the resulting walker positions.
+	"""
+	rng = np.random.default_rng(seed)
+	if p0 is None:
+		p0 = surrogate.low + rng.random((nwalkers, len(surrogate.twigs))) * (surrogate.high - surrogate.low)
+	lnprob = lambda values: -0.5 * surrogate.chi2(values) if surrogate.in_bounds(values) else -np.inf
+
+	sampler = emcee.EnsembleSampler(nwalkers, len(surrogate.twigs), lnprob)
+	state = p0
+	for stepsDone in range(0, nsteps, check_every):
+		state = sampler.run_mcmc(state, min(check_every, nsteps - stepsDone))
+		best = state.coords[np.argmax(state.log_prob)]
+		check = surrogate.check_accuracy(best, tol=tol)
+		print(f"Step {stepsDone + min(check_every, nsteps - stepsDone)} | max rel. error {check.maxRelError:.2e}{' (refitted)' if check.refitted else ''}"
+				f" | acceptance {np.mean(sampler.acceptance_fraction):.3f}")
+		if check.refitted: # log-probabilities of the current walkers are stale after a refit
+			state = emcee.State(state.coords)
+	return sampler
+
+def add_surrogate_init_distribution(b: phoebe.Bundle, surrogate: LightCurveSurrogate, sampler: emcee.EnsembleSampler,
+									distribution: str, discard: int = 0) -> str:
+	"""
+	Gaussian distribution per parameter from the surrogate chain, to initialize the walkers of the true sampler.
+	"""
+	flatChain = sampler.get_chain(discard=discard, flat=True)
+	b.add_distribution({twig: phoebe.gaussian(np.mean(flatChain[:, i]), np.std(flatChain[:, i])) for i, twig in enumerate(surrogate.twigs)},
+					   distribution=distribution, overwrite_all=True)
+	return distribution
@@ -0,0 +1,117 @@
+"""
+On-disk, memory-mapped copy of an emcee sampler solution: chain (steps, walkers, ndim), log-probabilities
+(steps, walkers) and acceptance fractions (walkers) stored as .npy files plus a small JSON with the solution metadata.
+
+Diagnostics and corner plots read the arrays in thinned, post-burnin chunks, so long chains never have to fit in memory.
+"""
+
+import os
+import json
+from collections.abc import Iterator
+
+import phoebe
+import numpy as np
+
+CHAIN_FILE = "chain.npy"
+LNPROB_FILE = "lnprob.npy"
+ACCEPTANCE_FILE = "acceptance.npy"
+META_FILE = "meta.json"
+
+def chainStorePath(solution: str, parentFolder: str = "") -> str:
+	return os.path.join(parentFolder, "chains", solution)
+
+def exportChain(b: phoebe.Bundle, solution: str, path: str = None, overwrite: bool = False) -> str:
+	"""
+	Writes the sampler solution's chain to `path` (default chains/<solution>). Returns the store path.
+	"""
+	if path is None:
+		path = chainStorePath(solution)
+	if os.path.exists(os.path.join(path, META_FILE)) and not overwrite:
+		print(f"NOT OVERWRITING: {path} chain store already exists.")
+		return path
+	os.makedirs(path, exist_ok=True)
+
+	np.save(os.path.join(path, CHAIN_FILE), np.asarray(b.get_value(qualifier='samples', solution=solution), dtype=float))
+	np.save(os.path.join(path, LNPROB_FILE), np.asarray(b.get_value(qualifier='lnprobabilities', solution=solution), dtype=float))
+	np.save(os.path.join(path, ACCEPTANCE_FILE), np.asarray(b.get_value(qualifier='acceptance_fractions', solution=solution), dtype=float))
+
+	meta = {
+		'solution': solution,
+		'fitted_twigs': list(b.get_value(qualifier='fitted_twigs', solution=solution)),
+		'fitted_units': list(b.get_value(qualifier='fitted_units', solution=solution)),
+		'burnin': int(b.get_value(qualifier='burnin', solution=solution)),
+		'thin': int(b.get_value(qualifier='thin', solution=solution)),
+		'lnprob_cutoff': float(b.get_value(qualifier='lnprob_cutoff', solution=solution)),
+	}
+	with open(os.path.join(path, META_FILE), 'w') as metaFile:
+		json.dump(meta, metaFile, indent=1)
+	return path
+
+class ChainStore:
+	"""
+	Read-only view of an exported chain. `chain` and `lnprob` are memory-mapped; nothing is read until sliced.
+	"""
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		with open(os.path.join(path, META_FILE), 'r') as metaFile:
+			self.meta: dict = json.load(metaFile)
+		self.chain: np.memmap = np.load(os.path.join(path, CHAIN_FILE), mmap_mode='r')
+		self.lnprob: np.memmap = np.load(os.path.join(path, LNPROB_FILE), mmap_mode='r')
+		self.acceptance: np.ndarray = np.load(os.path.join(path, ACCEPTANCE_FILE))
+
+	@property
+	def parameters(self) -> list[str]:
+		return self.meta['fitted_twigs']
+
+	@property
+	def shape(self) -> tuple[int, int, int]:
+		return self.chain.shape
+
+	def _resolve(self, burnin: int | None, thin: int | None) -> tuple[int, int]:
+		return (self.meta['burnin'] if burnin is None else burnin), max(self.meta['thin'] if thin is None else thin, 1)
+
+	def postBurnin(self, burnin: int = None, thin: int = None) -> np.memmap:
+		"""
+		Thinned, post-burnin (steps, walkers, ndim) view of the chain; still memory-mapped.
+		"""
+		burnin, thin = self._resolve(burnin, thin)
+		return self.chain[burnin::thin]
+
+	def iterChunks(self, burnin: int = None, thin: int = None, chunk_steps: int = 2000,
+				   parameters: list[str] = None) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+		"""
+		Yields (samples, lnprob) blocks of at most `chunk_steps` thinned steps, with shapes (steps, walkers, nparams)
+		and (steps, walkers). Defaults to the solution's burnin and thin.
+		"""
+		burnin, thin = self._resolve(burnin, thin)
+		paramIdx = slice(None) if parameters is None else [self.parameters.index(p) for p in parameters]
+		numSteps = self.chain.shape[0]
+		for start in range(burnin, numSteps, chunk_steps * thin):
+			stop = min(start + chunk_steps * thin, numSteps)
+			yield np.asarray(self.chain[start:stop:thin][:, :, paramIdx]), np.asarray(self.lnprob[start:stop:thin])
+
+	def flatSamples(self, burnin: int = None, thin: int = None, parameters: list[str] = None, lnprob_cutoff: float = None,
+					chunk_steps: int = 2000) -> np.ndarray:
+		"""
+		Post-burnin, thinned samples flattened to (samples, nparams), dropping non-finite log-probabilities and those below
+		`lnprob_cutoff` (defaults to the solution's). Filled chunk by chunk into a single preallocated array.
+		"""
+		if lnprob_cutoff is None:
+			lnprob_cutoff = self.meta['lnprob_cutoff']
+		nparams = len(self.parameters) if parameters is None else len(parameters)
+
+		samples = np.empty((self.postBurnin(burnin, thin).shape[0] * self.chain.shape[1], nparams))
+		numKept = 0
+		for chunkSamples, chunkLnprob in self.iterChunks(burnin, thin, chunk_steps, parameters):
+			keep = np.isfinite(chunkLnprob) & (chunkLnprob >= lnprob_cutoff)
+			kept = chunkSamples[keep]
+			samples[numKept:numKept + len(kept)] = kept
+			numKept += len(kept)
+		return samples[:numKept]
+
+def openChainStore(solution_or_path: str, parentFolder: str = "") -> ChainStore:
+	path = solution_or_path
+	if not os.path.exists(os.path.join(path, META_FILE)):
+		path = chainStorePath(solution_or_path, parentFolder)
+	return ChainStore(path)
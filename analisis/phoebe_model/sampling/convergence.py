@@ -0,0 +1,119 @@
+"""
+Batched MCMC convergence diagnostics for emcee chains of shape (steps, walkers, ndim): integrated autocorrelation
+times (per walker and for the ensemble), Gelman-Rubin R-hat, Geweke drift and effective sample size.
+
+Autocorrelation functions are obtained with one real FFT over all walkers of a block of parameters at a time;
+the size of each block is bounded by `max_block_bytes`.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+ConvergenceReport = namedtuple("ConvergenceReport", ["parameters", "numSteps", "numWalkers",
+													 "tauWalkers", "tau", "tauTooLong", "rhat", "gewekeZ", "ess",
+													 "minAutocorrTimes", "gewekeMax", "rhatMax", "converged"])
+
+def _nextPowTwo(n: int) -> int:
+	return 1 << (int(n) - 1).bit_length()
+
+def autocorrFunction(x: np.ndarray) -> np.ndarray:
+	"""
+	Normalized autocorrelation function along the first axis (steps) of `x`, for every remaining column at once.
+	"""
+	x = np.asarray(x, dtype=float)
+	numSteps = x.shape[0]
+	f = np.fft.rfft(x - np.mean(x, axis=0), n=2*_nextPowTwo(numSteps), axis=0)
+	acf = np.fft.irfft(f * np.conjugate(f), axis=0)[:numSteps]
+	with np.errstate(invalid='ignore', divide='ignore'):
+		acf /= acf[0]
+	return acf
+
+def _autoWindow(taus: np.ndarray, c: float) -> np.ndarray:
+	# first step m where m >= c*tau(m) (Sokal's adaptive window, same criterion as emcee.autocorr.auto_window)
+	m = np.arange(taus.shape[0]).reshape((-1,) + (1,)*(taus.ndim - 1)) < c * taus
+	window = np.argmin(m, axis=0)
+	window[np.all(m, axis=0)] = taus.shape[0] - 1
+	return np.take_along_axis(taus, window[np.newaxis], axis=0)[0]
+
+def integratedTimes(chain: np.ndarray, c: float = 5) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	Integrated autocorrelation times of a (steps, walkers, ndim) block.
+
+	Returns (per-walker taus with shape (walkers, ndim), ensemble taus with shape (ndim,)); the ensemble value
+	averages the autocorrelation function over walkers, as emcee's get_autocorr_time does.
+	"""
+	acf = autocorrFunction(chain)
+	tauWalkers = _autoWindow(2.0*np.cumsum(acf, axis=0) - 1.0, c)
+	tauEnsemble = _autoWindow(2.0*np.cumsum(np.nanmean(acf, axis=1), axis=0) - 1.0, c)
+	return tauWalkers, tauEnsemble
+
+def gelmanRubin(chain: np.ndarray) -> np.ndarray:
+	"""
+	Potential scale reduction factor (R-hat) of each parameter, treating every walker as an independent chain.
+	"""
+	numSteps = chain.shape[0]
+	withinVar = np.mean(np.var(chain, axis=0, ddof=1), axis=0)
+	betweenVar = np.var(np.mean(chain, axis=0), axis=0, ddof=1)
+	pooledVar = (numSteps - 1)/numSteps * withinVar + betweenVar
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return np.sqrt(pooledVar / withinVar)
+
+def gewekeDrift(chain: np.ndarray, fraction: float = 0.25) -> np.ndarray:
+	"""
+	Geweke z-score between the first and last `fraction` of the steps (all walkers pooled) of each parameter.
+	"""
+	numSegment = max(int(chain.shape[0] * fraction), 1)
+	first = chain[:numSegment].reshape(-1, chain.shape[-1])
+	last = chain[-numSegment:].reshape(-1, chain.shape[-1])
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return (first.mean(axis=0) - last.mean(axis=0)) / np.sqrt(np.var(first, axis=0) + np.var(last, axis=0))
+
+def _parameterBlocks(numSteps: int, numWalkers: int, ndim: int, max_block_bytes: int) -> list[slice]:
+	# rfft output is complex with ~numSteps+1 rows per column after zero padding to 2*nextPowTwo(numSteps)
+	bytesPerParam = 16 * (_nextPowTwo(numSteps) + 1) * numWalkers * 3
+	perBlock = int(max(1, min(ndim, max_block_bytes // max(bytesPerParam, 1))))
+	return [slice(i, min(i + perBlock, ndim)) for i in range(0, ndim, perBlock)]
+
+def convergenceReport(chain: np.ndarray, parameters: list[str] = None, c: float = 5, min_autocorr_times: float = 10,
+					  geweke_max: float = 1.0, rhat_max: float = 1.1, max_block_bytes: int = 1 << 30) -> ConvergenceReport:
+	"""
+	Runs all diagnostics on a (steps, walkers, ndim) chain (may be a memory-mapped array). The chain is considered
+	converged when every walker ran for at least `min_autocorr_times` autocorrelation times, |Geweke z| <= `geweke_max`
+	and R-hat <= `rhat_max` for every parameter.
+	"""
+	numSteps, numWalkers, ndim = chain.shape
+	if parameters is None:
+		parameters = [str(i) for i in range(ndim)]
+
+	tauWalkers = np.empty((numWalkers, ndim))
+	tau = np.empty(ndim)
+	rhat = np.empty(ndim)
+	gewekeZ = np.empty(ndim)
+	for block in _parameterBlocks(numSteps, numWalkers, ndim, max_block_bytes):
+		blockChain = np.asarray(chain[:, :, block], dtype=float)
+		tauWalkers[:, block], tau[block] = integratedTimes(blockChain, c=c)
+		rhat[block] = gelmanRubin(blockChain)
+		gewekeZ[block] = gewekeDrift(blockChain)
+
+	tauWalkers = np.maximum(tauWalkers, 1)
+	tau = np.maximum(tau, 1)
+	tauTooLong = numSteps < min_autocorr_times * tauWalkers
+	ess = numSteps * numWalkers / tau
+
+	converged = bool(not np.any(tauTooLong) and np.all(np.abs(gewekeZ) <= geweke_max) and np.all(rhat <= rhat_max))
+	return ConvergenceReport(list(parameters), numSteps, numWalkers, tauWalkers, tau, tauTooLong, rhat, gewekeZ, ess,
+							 min_autocorr_times, geweke_max, rhat_max, converged)
+
+def printConvergenceReport(report: ConvergenceReport) -> None:
+	print(f"Convergence: {'OK' if report.converged else 'NOT CONVERGED'} | {report.numSteps} steps x {report.numWalkers} walkers")
+	print('---------------------------------------------------------------')
+	for i, param in enumerate(report.parameters):
+		numLong = int(np.sum(report.tauTooLong[:, i]))
+		print(param)
+		print(f"\tAutocorrelation time: {report.tau[i]:.1f} (max per walker {np.max(report.tauWalkers[:, i]):.1f}, {report.numSteps / report.tau[i]:.1f}x lengths)")
+		if numLong > 0:
+			print(f"\t\t{numLong}/{report.numWalkers} walkers with fewer than {report.minAutocorrTimes} autocorrelation times")
+		print(f"\tR-hat: {report.rhat[i]:.4f}{'' if report.rhat[i] <= report.rhatMax else ' (> ' + str(report.rhatMax) + ')'}")
+		print(f"\tGeweke z: {report.gewekeZ[i]:.3f}{'' if abs(report.gewekeZ[i]) <= report.gewekeMax else ' (drift detected)'}")
+		print(f"\tESS: {report.ess[i]:.0f}")
@@ -1,16 +1,24 @@
 import os
-import warnings
+import json
+from collections import namedtuple
 
 import phoebe
 import emcee
+import corner
 import numpy as np
 import matplotlib.figure as mpl_fig
 import matplotlib.pyplot as plt
 
 try:
 	import analisis.phoebe_model.utils as gen_utils
+	import analisis.phoebe_model.sampling.convergence as convergence
+	import analisis.phoebe_model.sampling.chain_store as chain_store
+	import analisis.phoebe_model.sampling.progress_hook as progress_hook
 except ImportError:
 	import utils as gen_utils
+	import convergence
+	import chain_store
+	import progress_hook
 
 LATEX_LABELS = {
 	# others bounded
@@ -53,34 +61,138 @@ def __createExternalJobsFolder(subfolder: str) -> str:
 	os.makedirs(exportFolder, exist_ok=True)
 	return exportFolder
 
-def exportSampler(b: phoebe.Bundle, sampler_solver: str, datasets: list[str], subfolder: str = None, **solver_kwargs) -> None:
+def exportSampler(b: phoebe.Bundle, sampler_solver: str, datasets: list[str] = None, subfolder: str = None, stream_progress: bool = False,
+				  early_stop_ntau: float = None, profile: str = None, **solver_kwargs) -> None:
+	"""
+	Exports an emcee sampler as a standalone script. With `stream_progress` the script appends chain checkpoints to
+	results/<solver>.chainlog (see progress_hook) every `progress_every_niters` iterations (default 100), which can be
+	followed with SamplerProgressMonitor; `early_stop_ntau` additionally stops the job once it's converged. Only
+	`datasets` are enabled during the export (utils.datasetProfile); a `profile` name reuses the resolved profile
+	across exports, so later ones can leave out `datasets`.
+	"""
 	exportFolder = __createExternalJobsFolder(subfolder)
 
-	prevEnabledDatasets = [d for d in b.datasets if b.get_value(qualifier='enabled', dataset=d)]
-	gen_utils.abilitateDatasets(b, datasets, False)
-	try:
+	if stream_progress or early_stop_ntau is not None:
+		solver_kwargs['progress_every_niters'] = solver_kwargs.get('progress_every_niters', 100)
+
+	with gen_utils.datasetProfile(b, datasets, includeMesh=False, name=profile):
 		b.add_solver('sampler.emcee', solver=sampler_solver, overwrite=True, **solver_kwargs)
 		exportFilePath = os.path.join(exportFolder, f"{sampler_solver}.py")
 		resultsFilePath = os.path.join("results", sampler_solver)
 		fname, out_fname = b.export_solver(script_fname=exportFilePath, out_fname=resultsFilePath, solver=sampler_solver, solution=f"{sampler_solver}_solution", overwrite=True)
+		if stream_progress or early_stop_ntau is not None:
+			progress_hook.injectProgressHook(fname, out_fname, early_stop_ntau=early_stop_ntau)
 		print(sampler_solver, fname, out_fname, sep=" | ")
-	finally:
-		gen_utils.abilitateDatasets(b, prevEnabledDatasets)
 
-def continueSampler(b: phoebe.Bundle, solver: str, prev_solution: str, continuation_label: str, datasets: list[str], subfolder: str = None, **solver_kwargs) -> None:
+def continueSampler(b: phoebe.Bundle, solver: str, prev_solution: str, continuation_label: str, datasets: list[str] = None, subfolder: str = None,
+					stream_progress: bool = False, early_stop_ntau: float = None, profile: str = None, **solver_kwargs) -> None:
 	exportFolder = __createExternalJobsFolder(subfolder)
 
-	prevEnabledDatasets = [d for d in b.datasets if b.get_value(qualifier='enabled', dataset=d)]
-	gen_utils.abilitateDatasets(b, datasets, False)
+	if stream_progress or early_stop_ntau is not None:
+		solver_kwargs['progress_every_niters'] = solver_kwargs.get('progress_every_niters', 100)
 
-	try:
+	with gen_utils.datasetProfile(b, datasets, includeMesh=False, name=profile):
 		exportFilePath = os.path.join(exportFolder, f"{continuation_label}.py")
 		resultsFilePath = os.path.join("results", f"{continuation_label}_solution")
 		fname, out_fname = b.export_solver(script_fname=exportFilePath, out_fname=resultsFilePath, solver=solver, solution=f"{continuation_label}_solution", 
 									 continue_from=prev_solution, use_server='none', **solver_kwargs)
+		if stream_progress or early_stop_ntau is not None:
+			progress_hook.injectProgressHook(fname, out_fname, early_stop_ntau=early_stop_ntau)
 		print(solver, fname, out_fname, sep=" | ")
-	finally:
-		gen_utils.abilitateDatasets(b, prevEnabledDatasets)
+
+SamplerProgress = namedtuple("SamplerProgress", "iterations tau maxTau numTau acceptance meanAcceptance converged")
+
+class SamplerProgressMonitor:
+	"""
+	Follows the chain log of a running exported sampler (results/<solver>, as passed to export_solver). Each call to
+	`update` only reads the records appended since the previous one; acceptance fractions are taken from the job's
+	latest checkpoint, or counted incrementally from walker moves if no checkpoint was logged yet.
+	"""
+
+	def __init__(self, out_fname: str, early_stop_ntau: float = 50, tau_rtol: float = 0.01) -> None:
+		self.out_fname = out_fname
+		self.early_stop_ntau = early_stop_ntau
+		self.tau_rtol = tau_rtol
+		self.nwalkers: int = None
+		self.ndim: int = None
+		self.fittedTwigs: list[str] = []
+		self._samples = np.empty((0, 0, 0))
+		self._numIters = 0
+		self._chainOffset = 0
+		self._moves: np.ndarray = None
+		self._prevTau: np.ndarray = None
+
+	def _readHeader(self) -> bool:
+		headerPath = f"{self.out_fname}{progress_hook.CHAINLOG_HEADER_EXT}"
+		if self.nwalkers is not None or not os.path.exists(headerPath):
+			return self.nwalkers is not None
+		with open(headerPath, 'r') as headerFile:
+			header = json.load(headerFile)
+		self.nwalkers, self.ndim, self.fittedTwigs = header['nwalkers'], header['ndim'], header['fitted_twigs']
+		self._samples = np.empty((1024, self.nwalkers, self.ndim))
+		self._moves = np.zeros(self.nwalkers)
+		return True
+
+	def _readNewRecords(self) -> None:
+		recordBytes = 8 * progress_hook.chainRecordSize(self.nwalkers, self.ndim)
+		chainLogPath = f"{self.out_fname}{progress_hook.CHAINLOG_EXT}"
+		if not os.path.exists(chainLogPath):
+			return
+
+		with open(chainLogPath, 'rb') as chainLog:
+			chainLog.seek(self._chainOffset)
+			newBytes = chainLog.read()
+		numRecords = len(newBytes) // recordBytes # ignore a partially written trailing record
+		if numRecords == 0:
+			return
+		self._chainOffset += numRecords * recordBytes
+
+		records = np.frombuffer(newBytes[:numRecords * recordBytes], dtype='<f8').reshape(numRecords, -1)
+		newSamples = records[:, 1 + self.nwalkers:].reshape(numRecords, self.nwalkers, self.ndim)
+		if self._numIters + numRecords > self._samples.shape[0]: # grow geometrically to keep appends amortized O(1)
+			grown = np.empty((max(2*self._samples.shape[0], self._numIters + numRecords), self.nwalkers, self.ndim))
+			grown[:self._numIters] = self._samples[:self._numIters]
+			self._samples = grown
+
+		previous = self._samples[self._numIters - 1:self._numIters] if self._numIters > 0 else newSamples[:1]
+		self._moves += np.sum(np.any(np.diff(np.concatenate([previous, newSamples]), axis=0) != 0, axis=2), axis=0)
+		self._samples[self._numIters:self._numIters + numRecords] = newSamples
+		self._numIters += numRecords
+
+	def _latestAcceptance(self) -> np.ndarray:
+		acceptLogPath = f"{self.out_fname}{progress_hook.ACCEPTLOG_EXT}"
+		recordBytes = 8 * (1 + self.nwalkers)
+		if os.path.exists(acceptLogPath) and os.path.getsize(acceptLogPath) >= recordBytes:
+			with open(acceptLogPath, 'rb') as acceptLog:
+				acceptLog.seek((os.path.getsize(acceptLogPath) // recordBytes - 1) * recordBytes)
+				return np.frombuffer(acceptLog.read(recordBytes), dtype='<f8')[1:]
+		return self._moves / max(self._numIters - 1, 1)
+
+	@property
+	def chain(self) -> np.ndarray:
+		return self._samples[:self._numIters]
+
+	def update(self, print_progress: bool = True) -> SamplerProgress | None:
+		if not self._readHeader():
+			if print_progress:
+				print(f"No progress logged yet for {self.out_fname}")
+			return None
+		self._readNewRecords()
+		if self._numIters < 2:
+			return None
+
+		_, tau = convergence.integratedTimes(self.chain)
+		tau = np.maximum(tau, 1)
+		acceptance = self._latestAcceptance()
+		converged = bool(self._prevTau is not None and self._numIters >= self.early_stop_ntau * np.max(tau)
+						 and np.all(np.abs(self._prevTau - tau) / tau < self.tau_rtol))
+		self._prevTau = tau
+
+		progress = SamplerProgress(self._numIters, tau, np.max(tau), self._numIters / np.max(tau), acceptance, np.mean(acceptance), converged)
+		if print_progress:
+			print(f"{self.out_fname} | {progress.iterations} iterations | max tau = {progress.maxTau:.1f} ({progress.numTau:.1f}x) "
+		 			f"| avg. acceptance fraction {progress.meanAcceptance:.3f}{' | CONVERGED' if converged else ''}")
+		return progress
 
 # def plotSamplerAcceptanceFractions(b: phoebe.Bundle, sampler_solution: str, min_acceptable=0.4, max_acceptable=0.8, figsize=(22, 7)) -> None:
 def plotSamplerAcceptanceFractions(b: phoebe.Bundle, sampler_solution: str, min_acceptable=0.4, max_acceptable=0.8, figsize=(13, 23), vertical=True) -> None:
@@ -123,17 +235,38 @@ def plotSamplerAcceptanceFractions(b: phoebe.Bundle, sampler_solution: str, min_
 	plt.ylabel(ylabel, fontsize=16)
 	plt.show()
 
-def plotDistribution(b: phoebe.Bundle, distribution: str|list[str], plot_kwargs: dict[str: any] = {}, **get_distribution_collection_kwargs):
-	if 'parameters' not in get_distribution_collection_kwargs.keys() and type(distribution) is str and distribution in b.solutions:
-		get_distribution_collection_kwargs['parameters'] = b.get_value(f'fitted_twigs@{distribution}').tolist()
-	dist, labels = b.get_distribution_collection(distribution, **get_distribution_collection_kwargs)
-	latexLabels = [LATEX_LABELS[l] for l in labels]
-	fig: mpl_fig.Figure = dist.plot(labels=latexLabels, label_kwargs={'fontsize': 40}, divergences=True, show=False, **plot_kwargs)
+def plotDistribution(b: phoebe.Bundle, distribution: str|list[str], plot_kwargs: dict[str: any] = {}, chain_store_path: str = None,
+					 **get_distribution_collection_kwargs):
+	"""
+	Corner plot of the distribution. With `chain_store_path` (see `chain_store.exportChain`), the thinned post-burnin
+	samples are read from the memory-mapped store instead of going through the bundle's distribution collection.
+	"""
+	if chain_store_path is not None:
+		store = chain_store.openChainStore(chain_store_path)
+		parameters = get_distribution_collection_kwargs.get('parameters', store.parameters)
+		samples = store.flatSamples(burnin=get_distribution_collection_kwargs.get('burnin'), thin=get_distribution_collection_kwargs.get('thin'),
+									parameters=parameters, lnprob_cutoff=get_distribution_collection_kwargs.get('lnprob_cutoff'))
+		fig: mpl_fig.Figure = corner.corner(samples, labels=[LATEX_LABELS[l] for l in parameters], label_kwargs={'fontsize': 40}, **plot_kwargs)
+	else:
+		if 'parameters' not in get_distribution_collection_kwargs.keys() and type(distribution) is str and distribution in b.solutions:
+			get_distribution_collection_kwargs['parameters'] = b.get_value(f'fitted_twigs@{distribution}').tolist()
+		dist, labels = b.get_distribution_collection(distribution, **get_distribution_collection_kwargs)
+		latexLabels = [LATEX_LABELS[l] for l in labels]
+		fig: mpl_fig.Figure = dist.plot(labels=latexLabels, label_kwargs={'fontsize': 40}, divergences=True, show=False, **plot_kwargs)
 	for ax in fig.axes:
 		ax.tick_params(axis='x', labelsize=19, rotation=90)
 		ax.tick_params(axis='y', labelsize=19, rotation=0)
 	
-def emceeAutoCorr(b: phoebe.Bundle, solution: str):
+def emceeAutoCorr(b: phoebe.Bundle, solution: str, chain_store_path: str = None):
+	if chain_store_path is not None:
+		store = chain_store.openChainStore(chain_store_path)
+		for burnin in [store.meta['burnin'], 0]:
+			print(f"Burnin = {burnin}", "------------------------", sep='\n')
+			report = convergence.convergenceReport(store.chain[burnin:], parameters=store.parameters)
+			for twig, tau in zip(report.parameters, report.tau):
+				print(twig, tau)
+		return
+
 	emceeObj = phoebe.helpers.get_emcee_object_from_solution(b, solution=solution)
 	try:
 		print(f"Burnin = {b.get_value(qualifier='burnin', solution=solution)}", "------------------------", sep='\n')
@@ -148,59 +281,45 @@ def emceeAutoCorr(b: phoebe.Bundle, solution: str):
 		print(e)
 		
 # MCMC convergence test: https://johannesbuchner.github.io/autoemcee/mcmc-ensemble-convergence.html
-def emceeConvergenceTest(b: phoebe.Bundle, solution: str, plot_twigs=[]):
-	adoptParams = b.get_value(qualifier='adopt_parameters', solution=solution)
-	emceeObj = phoebe.helpers.get_emcee_object_from_solution(b, solution=solution)
-	min_autocorr_times = 10
-	burnin = b.get_value(qualifier='burnin', solution=solution)
-
-	chain = emceeObj.get_chain()
-	flat_chain = emceeObj.get_chain(flat=True)
-	num_steps, num_walkers, ndim = chain.shape
-	# 0. analyse each variable
-	max_autocorrlength = 1
-	for i in range(ndim):
-		if len(plot_twigs) > 0 and adoptParams[i] not in plot_twigs:
+def emceeConvergenceTest(b: phoebe.Bundle, solution: str, plot_twigs=[], discard_burnin=False, plot=False, chain_store_path: str = None,
+						 **report_kwargs) -> convergence.ConvergenceReport:
+	"""
+	Autocorrelation (per walker and ensemble), Gelman-Rubin R-hat, Geweke drift and ESS for every sampled parameter,
+	computed in a single batched pass over the chain. Walkers that are too short for their autocorrelation time are
+	only plotted when `plot` is set (restricted to `plot_twigs` if given).
+
+	`chain_store_path` reads the chain from an exported chain store (see `chain_store.exportChain`) instead of the bundle.
+	"""
+	if chain_store_path is not None: # memory-mapped, only one block of parameters is read at a time
+		store = chain_store.openChainStore(chain_store_path)
+		fittedTwigs = store.parameters
+		chain = store.chain[store.meta['burnin'] if discard_burnin else 0:]
+	else:
+		emceeObj = phoebe.helpers.get_emcee_object_from_solution(b, solution=solution)
+		burnin = b.get_value(qualifier='burnin', solution=solution) if discard_burnin else 0
+		fittedTwigs = list(b.get_value(qualifier='fitted_twigs', solution=solution))
+		chain = emceeObj.get_chain(discard=burnin)
+
+	report = convergence.convergenceReport(chain, parameters=fittedTwigs, **report_kwargs)
+	convergence.printConvergenceReport(report)
+
+	if plot:
+		plotUnconvergedWalkers(chain, report, plot_twigs)
+	return report
+
+def plotUnconvergedWalkers(chain: np.ndarray, report: convergence.ConvergenceReport, plot_twigs: list[str] = [], figsize=(12, 4)) -> None:
+	for i, param in enumerate(report.parameters):
+		if len(plot_twigs) > 0 and param not in plot_twigs:
+			continue
+		walkers = np.flatnonzero(report.tauTooLong[:, i])
+		if len(walkers) == 0:
 			continue
-		chain_variable = chain[:, :, i]
-		# 1. treat each walker as a independent chain
-		for w in range(num_walkers):
-			try:
-				chain_walker = chain_variable[:, w]
-				with warnings.catch_warnings():
-					warnings.simplefilter("ignore")
-					tau = emcee.autocorr.integrated_time(chain_walker, c=5, tol=50, quiet=False)
-					tau = max(tau, 1)
-				max_autocorrlength = max(max_autocorrlength, tau)
-				if len(chain_walker) / tau < min_autocorr_times:
-					print("autocorrelation is long for parameter %d: tau=%.1f -> %dx lengths" % (i+1, tau, num_steps / tau))
-					converged = False
-					# you could plot chain_walker to visualise
-					continue
-			except emcee.autocorr.AutocorrError as e:
-				print(e)
-				max_autocorrlength = np.inf
-				if min_autocorr_times > 0:
-					print("autocorrelation is too long for parameter %d to be estimated" % (i+1))
-					converged = False
-					
-					# you could plot chain_walker to visualise
-					plt.plot(chain_walker)
-					plt.title(f"{adoptParams[i]} - Walker {w}")
-					plt.show()
-					# break
-
-	# 	if not converged:
-	# 		break
-
-	# 	# secondly, detect drift with geweke
-	# 	a = flat_chain[:len(flat_chain) // 4, i]
-	# 	b = flat_chain[-len(flat_chain) // 4:, i]
-	# 	geweke_z = (a.mean() - b.mean()) / (np.var(a) + np.var(b))**0.5
-	# 	if geweke_z > geweke_max:
-	# 		print("geweke drift (z=%.1f) detected for parameter %d" % (geweke_z, i+1))
-	# 		converged = False
-	# 		# you can plot histograms of a and b to visualise`
+
+		plt.figure(figsize=figsize)
+		plt.plot(chain[:, walkers, i], lw=0.5)
+		plt.title(f"{param} - {len(walkers)} walkers shorter than {report.minAutocorrTimes} autocorrelation times")
+		plt.xlabel("Iteration")
+		plt.show()
 
 def printParameterAutocorrTimes(b: phoebe.Bundle, solution: str):
 	numIterations = b.get_value(qualifier='niters', solution=solution)
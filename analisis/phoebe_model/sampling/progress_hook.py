@@ -0,0 +1,146 @@
+"""
+Progress streaming for exported emcee jobs. Only depends on numpy, the standard library and the functions in
+convergence.py, since `injectProgressHook` copies the source of both modules into the script written by
+b.export_solver (the phoebe-server environment doesn't have this repository).
+
+While the solver runs, a background thread watches the .progress file phoebe writes every `progress_every_niters`
+iterations and appends the new iterations to a compact, append-only binary log:
+
+	{out_fname}.chainlog.json   header: nwalkers, ndim, fitted_twigs
+	{out_fname}.chainlog        float64 records of [iteration, lnprob (nwalkers), samples (nwalkers*ndim)]
+	{out_fname}.acceptlog       float64 records of [iteration, acceptance fractions (nwalkers)], one per checkpoint
+
+Optionally the job stops early once the chain is longer than `early_stop_ntau` autocorrelation times and the
+estimate changed less than `early_stop_tau_rtol` since the previous checkpoint. The hook then creates
+{out_fname}.kill, which PHOEBE's emcee loop checks every iteration: the sampler leaves its loop, releases the MPI
+workers and run_solver returns the chain so far, so the script writes its solution to out_fname as usual.
+"""
+
+import os
+import json
+import time
+import threading
+
+import numpy as np
+
+try:
+	from analisis.phoebe_model.sampling.convergence import integratedTimes
+except ImportError:
+	try:
+		from convergence import integratedTimes
+	except ImportError: # inlined into an exported script, defined above
+		pass
+
+CHAINLOG_EXT = ".chainlog"
+CHAINLOG_HEADER_EXT = ".chainlog.json"
+ACCEPTLOG_EXT = ".acceptlog"
+PROGRESS_EXT = ".progress"
+KILL_EXT = ".kill" # checked by PHOEBE's sampler loop
+
+def chainRecordSize(nwalkers: int, ndim: int) -> int:
+	return 1 + nwalkers + nwalkers*ndim
+
+def readProgressFile(progressFname: str) -> dict[str, any]:
+	"""
+	Values of the sampler solution parameters stored in a phoebe .progress (or solution) file.
+	"""
+	with open(progressFname, 'r') as progressFile:
+		params = json.load(progressFile)
+
+	values = {}
+	for param in params:
+		value = param.get('value')
+		if isinstance(value, dict) and 'value' in value: # nparray representation
+			value = value['value']
+		values[param.get('qualifier')] = value
+	return values
+
+def _appendProgress(values: dict[str, any], out_fname: str, numLogged: int) -> int:
+	samples = np.asarray(values['samples'], dtype='<f8')
+	lnprob = np.asarray(values['lnprobabilities'], dtype='<f8')
+	numIters, nwalkers, ndim = samples.shape
+
+	if numLogged == 0:
+		with open(f"{out_fname}{CHAINLOG_HEADER_EXT}", 'w') as headerFile:
+			json.dump({'nwalkers': nwalkers, 'ndim': ndim, 'fitted_twigs': list(values.get('fitted_twigs', []))}, headerFile)
+
+	if numIters > numLogged:
+		iterations = np.arange(numLogged, numIters, dtype='<f8')[:, np.newaxis]
+		records = np.hstack([iterations, lnprob[numLogged:numIters], samples[numLogged:numIters].reshape(numIters - numLogged, -1)])
+		with open(f"{out_fname}{CHAINLOG_EXT}", 'ab') as chainLog:
+			chainLog.write(np.ascontiguousarray(records, dtype='<f8').tobytes())
+
+	if values.get('acceptance_fractions') is not None:
+		acceptance = np.asarray(values['acceptance_fractions'], dtype='<f8').ravel()
+		with open(f"{out_fname}{ACCEPTLOG_EXT}", 'ab') as acceptLog:
+			acceptLog.write(np.concatenate([[numIters], acceptance]).astype('<f8').tobytes())
+	return max(numIters, numLogged)
+
+def _progressHookLoop(out_fname: str, poll_seconds: float, early_stop_ntau: float, early_stop_tau_rtol: float) -> None:
+	progressFname = f"{out_fname}{PROGRESS_EXT}"
+	lastMtime = None
+	numLogged = 0
+	prevTau = None
+	while True:
+		time.sleep(poll_seconds)
+		try:
+			mtime = os.path.getmtime(progressFname)
+		except OSError:
+			continue
+		if mtime == lastMtime:
+			continue
+
+		try:
+			values = readProgressFile(progressFname)
+		except ValueError: # caught phoebe mid-write, retry on next poll
+			continue
+		lastMtime = mtime
+		numLogged = _appendProgress(values, out_fname, numLogged)
+
+		if early_stop_ntau is None or numLogged < 2:
+			continue
+		_, tau = integratedTimes(np.asarray(values['samples'], dtype=float))
+		tau = np.maximum(tau, 1)
+		if prevTau is not None and numLogged >= early_stop_ntau * np.max(tau) and np.all(np.abs(prevTau - tau) / tau < early_stop_tau_rtol):
+			with open(f"{out_fname}{KILL_EXT}", 'w') as killFile:
+				killFile.write(f"early stop at iteration {numLogged}\n")
+			print(f"Early stop at iteration {numLogged}: chain longer than {early_stop_ntau} autocorrelation times (max tau = {np.max(tau):.1f})", flush=True)
+			return
+		prevTau = tau
+
+def startProgressHook(out_fname: str, poll_seconds: float = 30, early_stop_ntau: float = None, early_stop_tau_rtol: float = 0.01) -> threading.Thread | None:
+	for rankVar in ['OMPI_COMM_WORLD_RANK', 'PMI_RANK']: # only the root process reports progress when running under MPI
+		if os.environ.get(rankVar, '0') != '0':
+			return None
+
+	killFname = f"{out_fname}{KILL_EXT}"
+	if os.path.exists(killFname): # left by an earlier early stop; would end this run at its first iteration
+		os.remove(killFname)
+	thread = threading.Thread(target=_progressHookLoop, args=(out_fname, poll_seconds, early_stop_ntau, early_stop_tau_rtol), daemon=True)
+	thread.start()
+	return thread
+
+def injectProgressHook(script_fname: str, out_fname: str, poll_seconds: float = 30, early_stop_ntau: float = None,
+					   early_stop_tau_rtol: float = 0.01) -> bool:
+	"""
+	Inserts the progress hook into a script written by b.export_solver, right before it calls run_solver.
+	"""
+	with open(script_fname, 'r') as scriptFile:
+		scriptLines = scriptFile.readlines()
+
+	runSolverIdx = next((i for i, line in enumerate(scriptLines) if 'run_solver(' in line and not line[0].isspace()), None)
+	if runSolverIdx is None:
+		print(f"Could not find a top-level run_solver call in {script_fname}; progress hook not added")
+		return False
+
+	sourceFolder = os.path.dirname(os.path.abspath(__file__))
+	hookSource = []
+	for moduleFname in ['convergence.py', 'progress_hook.py']:
+		with open(os.path.join(sourceFolder, moduleFname), 'r') as moduleFile:
+			hookSource.append(f"# ---- {moduleFname}\n{moduleFile.read()}\n")
+	hookSource.append(f"startProgressHook({out_fname!r}, poll_seconds={poll_seconds!r}, early_stop_ntau={early_stop_ntau!r}, "
+				   	  f"early_stop_tau_rtol={early_stop_tau_rtol!r})\n# ---- end progress hook\n")
+
+	with open(script_fname, 'w') as scriptFile:
+		scriptFile.writelines(scriptLines[:runSolverIdx] + hookSource + scriptLines[runSolverIdx:])
+	return True
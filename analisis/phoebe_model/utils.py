@@ -1,6 +1,7 @@
 import os
-import gzip
-import shutil
+import weakref
+from contextlib import contextmanager
+from collections import namedtuple
 
 import phoebe
 from phoebe import u
@@ -13,6 +14,17 @@ from matplotlib.animation import FuncAnimation
 from IPython import display
 import ipywidgets
 
+try:
+	import analisis.phoebe_model.bundle_io as bundle_io
+	import analisis.phoebe_model.mesh_video as mesh_video
+	from analisis.phoebe_model.bundle_cache import BUNDLE_CACHE
+	from analisis.phoebe_model.chi2_cache import getChi2Cache, defaultDatasetGroups
+except ImportError:
+	import bundle_io
+	import mesh_video
+	from bundle_cache import BUNDLE_CACHE
+	from chi2_cache import getChi2Cache, defaultDatasetGroups
+
 GAIA_RAW_PLOT_COLORS = {'lc_gaia_g_raw@dataset':'green', 'lc_gaia_rp_raw@dataset':'red', 'lc_gaia_bp_raw@dataset':'blue',
 						'lc_gaia_g_raw@model':'darkgreen', 'lc_gaia_rp_raw@model':'darkred', 'lc_gaia_bp_raw@model':'darkblue'}
 GAIA_NORM_PLOT_COLORS = {'lc_gaia_g_norm@dataset':'green', 'lc_gaia_rp_norm@dataset':'red', 'lc_gaia_bp_norm@dataset':'blue',
@@ -32,7 +44,15 @@ ITURBIDE_PLOT_COLORS = {'lcIturbide@dataset': 'cornflowerblue', 'lcIturbide@mode
 						'lcIturbideFull@dataset': 'cornflowerblue', 'lcIturbideFull@model': 'navy',
 						'lc_iturbide_norm@dataset': 'cornflowerblue', 'lc_iturbide_norm@model': 'navy'}
 
-def displayAnims(rows: int, cols: int, *anims: FuncAnimation):
+def _animHtml(anim: FuncAnimation | str) -> str:
+	if isinstance(anim, str):
+		return mesh_video.videoHtml(anim)
+	return anim.to_html5_video()
+
+def displayAnims(rows: int, cols: int, *anims: FuncAnimation | str):
+	"""
+	Grid of animations: FuncAnimations or paths of rendered videos (see genAnimatedMesh).
+	"""
 	plt.rcParams["animation.html"] = "html5"
 	plt.rcParams["figure.figsize"] = (15,8)
 	
@@ -41,11 +61,14 @@ def displayAnims(rows: int, cols: int, *anims: FuncAnimation):
 		for col in range(cols):
 			index = (row*cols) + col
 			anim = anims[index]
-			grid[row, col] = ipywidgets.HTML(anim.to_html5_video())
+			grid[row, col] = ipywidgets.HTML(_animHtml(anim))
 
 	display.display(grid)
 
-def displayAnim(anim: FuncAnimation):
+def displayAnim(anim: FuncAnimation | str):
+	if isinstance(anim, str):
+		display.display(display.HTML(_animHtml(anim)))
+		return
 	originalBackend = plt.rcParams['backend']
 	plt.rcParams['backend'] = 'Agg'
 	display.display(display.HTML(anim.to_html5_video()))
@@ -92,48 +115,61 @@ def printFittedTwigsConstraints(b: phoebe.Bundle, solution: str, units: dict[str
 				  quantity,
 				  "(Not adopting)" if adopt_twigs is not None and refTwig is None else "")
 
-def saveBundle(b: phoebe.Bundle, bundleName: str, subfolder: str = None, overwrite: bool = True, compact: bool = True, compress: bool = True) -> str:
-	if not os.path.exists("bundle-saves"):
-		os.mkdir("bundle-saves")
-
+def saveBundle(b: phoebe.Bundle, bundleName: str, subfolder: str = None, overwrite: bool = True, compact: bool = True, compress: bool = True,
+			   codec: str = None, print_stats: bool = False) -> str:
+	"""
+	Saves the bundle under bundle-saves[/subfolder]. The JSON is streamed through the compression codec (gzip unless
+	`codec` is given, see bundle_io.fastestCodec) without writing an uncompressed copy to disk.
+	"""
 	saveFolder = "bundle-saves"
 	if subfolder:
 		saveFolder = f"bundle-saves/{subfolder}"
-		os.makedirs(saveFolder, exist_ok=True)
+	os.makedirs(saveFolder, exist_ok=True)
 
-	if os.path.exists(os.path.join(saveFolder, bundleName)):
+	basePath = os.path.join(saveFolder, bundleName)
+	try:
+		existingPath = bundle_io.findBundleFile(basePath)
 		if overwrite:
-			print(f"CAUTION: overwriting {os.path.join(saveFolder, bundleName)}")
+			print(f"CAUTION: overwriting {existingPath}")
 		else:
-			print(f"NOT OVERWRITING: {os.path.join(saveFolder, bundleName)} bundle already exists.")
+			print(f"NOT OVERWRITING: {existingPath} bundle already exists.")
 			return
-	
-	jsonFile = b.save(f"{saveFolder}/{bundleName}.json", compact=compact)
-	if compress:
-		with open(jsonFile, 'rb') as f_in:
-			with gzip.open(f"{jsonFile}.gz", 'wb') as f_out:
-				shutil.copyfileobj(f_in, f_out)
-		os.remove(jsonFile)
-		return f"{jsonFile}.gz"
-	
-	return jsonFile
+	except FileNotFoundError:
+		pass
+
+	if not compress:
+		codec = 'none'
+	elif codec is None:
+		codec = bundle_io.preferredCodec()
+
+	stats = bundle_io.writeBundle(b, f"{basePath}{bundle_io.CODEC_EXTENSIONS[codec]}", codec=codec, compact=compact)
+	if print_stats:
+		print(bundle_io.formatStats(stats, "Saved"))
+	return stats.path
 
-def loadBundle(bundleName: str, subfolder: str = None, parentFolder: str = "") -> phoebe.Bundle:
+def loadBundle(bundleName: str, subfolder: str = None, parentFolder: str = "", use_cache: bool = True, print_stats: bool = False) -> phoebe.Bundle:
+	"""
+	Loads a saved bundle. With `use_cache`, repeated loads of an unchanged file return a copy of the bundle kept in
+	memory by BUNDLE_CACHE instead of parsing the file again (see `printBundleCacheStats`).
+	"""
 	saveFolder = "bundle-saves"
 	if parentFolder:
 		saveFolder = f"{parentFolder}/bundle-saves"
 	if subfolder:
 		saveFolder = f"{saveFolder}/{subfolder}"
 
-	tempJsonFile = f"{saveFolder}/{bundleName}.json"
-	with gzip.open(f"{saveFolder}/{bundleName}.json.gz", 'rb') as f_in:
-		with open(tempJsonFile, 'wb') as f_out:
-			shutil.copyfileobj(f_in, f_out)
-	
-	b = phoebe.load(tempJsonFile)
-	os.remove(tempJsonFile)
+	bundlePath = bundle_io.findBundleFile(f"{saveFolder}/{bundleName}")
+	if use_cache:
+		return BUNDLE_CACHE.load(bundlePath, print_stats=print_stats)
+
+	b, stats = bundle_io.readBundle(bundlePath)
+	if print_stats:
+		print(bundle_io.formatStats(stats, "Loaded"))
 	return b
 
+def printBundleCacheStats():
+	print(BUNDLE_CACHE)
+
 def avoidAtmosphereErrors(b: phoebe.Bundle):
 	b.set_value_all(qualifier='ld_mode', value='manual') # original value = interp
 	b.set_value_all(qualifier='ld_mode_bol', value='manual') # original value = lookup
@@ -144,58 +180,241 @@ def resetAtmosphere(b: phoebe.Bundle):
 	b.set_value_all(qualifier='ld_mode_bol', value='lookup') # original value = lookup
 	b.set_value_all(qualifier='atm', value='ck2004')  # original value = ck2004
 
-def genAnimatedMesh(b: phoebe.Bundle, logger=None, meshDataset="mesh01", fc='teffs', **plot_kwargs):
+def genAnimatedMesh(b: phoebe.Bundle, logger=None, meshDataset="mesh01", fc='teffs', workers: int = None, fps: float = 10,
+					use_cache: bool = True, **plot_kwargs) -> str:
+	"""
+	Renders the mesh animation across a process pool and returns the path of the cached mp4 (see mesh_video), which
+	displayAnim/displayAnims accept in place of a FuncAnimation. Unchanged bundles reuse the cached video.
+	"""
 	if logger: logger.setLevel('ERROR')
-	default_kwargs = {
-		"draw_sidebars": True,
-		"color": "inferno"
-	}
-
-	_, mplfig = b.plot(dataset=meshDataset, kind='mesh', fc=fc, ec='face', animate=True, **(default_kwargs | plot_kwargs))
-	if logger: logger.setLevel('WARNING')
-	return mplfig
+	try:
+		return mesh_video.renderMeshVideo(b, meshDataset, fc, fps=fps, workers=workers, use_cache=use_cache, **plot_kwargs)
+	finally:
+		if logger: logger.setLevel('WARNING')
 
 def animateMesh(b: phoebe.Bundle, logger=None, meshDataset="mesh01", fc='teffs', **plot_kwargs):
 	displayAnim(genAnimatedMesh(b, logger, meshDataset, fc, **plot_kwargs))
 
+# 'enabled' parameters of the compute options, resolved once per named profile: bundle id -> (bundle ref, name -> profile)
+_DATASET_PROFILES: dict[int, tuple[weakref.ref, dict[str, tuple[tuple, list[tuple[phoebe.parameters.Parameter, bool]]]]]] = {}
+
+def _enabledParams(b: phoebe.Bundle) -> list[phoebe.parameters.Parameter]:
+	"""
+	Every 'enabled' parameter of the compute options (one per compute x dataset and compute x feature), in one filter.
+	"""
+	return b.filter(qualifier='enabled', context='compute', check_visible=False).to_list()
+
+def _applyEnabled(targets: list[tuple[phoebe.parameters.Parameter, bool]]) -> list[tuple[phoebe.parameters.Parameter, bool]]:
+	"""
+	Sets only the parameters whose value differs from the target; returns (parameter, previous value) of those.
+	"""
+	changed = []
+	for param, enabled in targets:
+		previous = param.get_value()
+		if previous != enabled:
+			param.set_value(enabled)
+			changed.append((param, previous))
+	return changed
+
 def getEnabledDatasets(b: phoebe.Bundle):
-	enabledDatasets = []
-	for c in b.computes:
-		for d in b.datasets:
-			if b.get_value(qualifier='enabled', compute=c, dataset=d) and d not in enabledDatasets:
-				enabledDatasets.append(d)
-	return enabledDatasets
+	enabled = {p.dataset for p in _enabledParams(b) if p.dataset is not None and p.get_value()}
+	return [d for d in b.datasets if d in enabled]
 
 def abilitateDatasets(b: phoebe.Bundle, enableDatasets: list[str], includeMesh: bool = True):
 	"""
 	Enables specified datasets and disables all others.
 	"""
-	enableDatasets = enableDatasets.copy()
-	if includeMesh:
-		enableDatasets.append('mesh01')
-		
-	for d in b.datasets:
-		if d in enableDatasets:
-			b.enable_dataset(d)
-		else:
-			b.disable_dataset(d)
-		# b.set_value_all(qualifier='enabled', dataset=d, value=(d in localDatasets))
+	enableDatasets = set(enableDatasets) | ({'mesh01'} if includeMesh else set())
+	_applyEnabled([(p, p.dataset in enableDatasets) for p in _enabledParams(b) if p.dataset is not None])
 
 def abilitateFeatures(b: phoebe.Bundle, *enableFeatures: list[str]):
 	"""
 	Enables specified features (eg. spots) and disables all others.
-	"""		
-	for d in b.features:
-		if d in enableFeatures:
-			b.enable_feature(d)
-		else:
-			b.disable_feature(d)
+	"""
+	_applyEnabled([(p, p.feature in enableFeatures) for p in _enabledParams(b) if p.feature is not None])
+
+def _profileTargets(b: phoebe.Bundle, datasets: list[str], features: list[str] | None, includeMesh: bool) -> list[tuple[phoebe.parameters.Parameter, bool]]:
+	enableDatasets = set(datasets) | (set(b.filter(context='dataset', kind='mesh').datasets) if includeMesh else set())
+	targets = []
+	for p in _enabledParams(b):
+		if p.dataset is not None:
+			targets.append((p, p.dataset in enableDatasets))
+		elif p.feature is not None and features is not None:
+			targets.append((p, p.feature in features))
+	return targets
+
+def clearDatasetProfiles(b: phoebe.Bundle) -> None:
+	"""
+	Forgets the named profiles of the bundle; needed after adding or removing datasets, features or computes.
+	"""
+	_DATASET_PROFILES.pop(id(b), None)
+
+@contextmanager
+def datasetProfile(b: phoebe.Bundle, datasets: list[str] = None, features: list[str] = None, includeMesh: bool = True, name: str = None):
+	"""
+	Enables only `datasets` (plus mesh datasets with `includeMesh`) and, if given, only `features` on every compute
+	for the body of the with block, then restores the previous state, also on exceptions. Only parameters whose value
+	actually changes are touched. With a `name` (e.g. "ztf-only") the profile's parameters are resolved once and reused
+	by later calls with that name, either without `datasets` or with the same datasets and features; other datasets
+	redefine it. Without `datasets` nor `name` nothing is changed. Yields the enabled datasets.
+	"""
+	if datasets is None and name is None:
+		yield getEnabledDatasets(b)
+		return
+
+	profiles = None
+	if name is not None:
+		ref, profiles = _DATASET_PROFILES.get(id(b), (None, None))
+		if ref is None or ref() is not b:
+			profiles = {}
+			_DATASET_PROFILES[id(b)] = (weakref.ref(b, lambda _, bundleId=id(b): _DATASET_PROFILES.pop(bundleId, None)), profiles)
+
+	definition = (frozenset(datasets), None if features is None else frozenset(features), includeMesh) if datasets is not None else None
+	cached = profiles.get(name) if profiles is not None else None
+	if cached is not None and (definition is None or definition == cached[0]):
+		targets = cached[1]
+	else:
+		if datasets is None:
+			raise ValueError(f"Dataset profile {name} isn't defined yet; pass its datasets")
+		targets = _profileTargets(b, datasets, features, includeMesh)
+		if profiles is not None:
+			profiles[name] = (definition, targets)
+
+	changed = _applyEnabled(targets)
+	try:
+		yield sorted({p.dataset for p, enabled in targets if p.dataset is not None and enabled})
+	finally:
+		for param, previous in reversed(changed):
+			param.set_value(previous)
+
+BinnedPoints = namedtuple("BinnedPoints", "x y yerr ymin ymax counts")
+
+def binPoints(x: np.ndarray, y: np.ndarray, num_bins: int, x_range: tuple[float, float] = None, sigma: np.ndarray = None) -> BinnedPoints:
+	"""
+	Points grouped into `num_bins` equal-width bins of x over `x_range` (their extent by default). For every non-empty
+	bin: mean x and y, error of the mean (propagated from `sigma` if given, from the scatter otherwise), y extent and
+	number of points.
+	"""
+	x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+	finite = np.isfinite(x) & np.isfinite(y)
+	if sigma is not None:
+		sigma = np.asarray(sigma, dtype=float)
+		finite &= np.isfinite(sigma)
+	if not np.any(finite):
+		return BinnedPoints(*(np.empty(0) for _ in BinnedPoints._fields))
+	x, y = x[finite], y[finite]
+
+	low, high = x_range if x_range is not None else (x.min(), x.max())
+	binIdx = np.clip(((x - low) / max(high - low, np.finfo(float).tiny) * num_bins).astype(np.int64), 0, num_bins - 1)
+	order = np.argsort(binIdx, kind='stable')
+	binIdx, x, y = binIdx[order], x[order], y[order]
+	starts = np.flatnonzero(np.r_[True, binIdx[1:] != binIdx[:-1]])
+	counts = np.diff(np.r_[starts, len(binIdx)])
+
+	meanY = np.add.reduceat(y, starts) / counts
+	if sigma is not None:
+		yerr = np.sqrt(np.add.reduceat(sigma[finite][order]**2, starts)) / counts
+	else:
+		yerr = np.sqrt(np.add.reduceat((y - np.repeat(meanY, counts))**2, starts) / counts**2)
+	return BinnedPoints(np.add.reduceat(x, starts) / counts, meanY, yerr, np.minimum.reduceat(y, starts),
+						np.maximum.reduceat(y, starts), counts)
+
+def interpModelFluxes(b: phoebe.Bundle, times: np.ndarray, modelTimes: np.ndarray, modelFluxes: np.ndarray) -> np.ndarray:
+	"""
+	Model fluxes at the dataset times: interpolated in time when the model covers them, in phase otherwise (models
+	computed over a single cycle).
+	"""
+	order = np.argsort(modelTimes)
+	modelTimes, modelFluxes = modelTimes[order], modelFluxes[order]
+	if len(times) == 0 or (modelTimes[0] <= times.min() and modelTimes[-1] >= times.max()):
+		return np.interp(times, modelTimes, modelFluxes)
+	return np.interp(np.asarray(b.to_phase(times)), np.asarray(b.to_phase(modelTimes)), modelFluxes, period=1)
+
+def plotModelResidualsBinned(b: phoebe.Bundle, figsize: tuple[float, float], model: str, dataset_groups: list[list[str] | str] = None, phase=True,
+							 scale_max_flux=True, num_bins: int = 400, show_extent: bool = True, colors: dict[str, str] = None, show: bool = True) -> list[Figure]:
+	"""
+	Same panels as plotModelResidualsFigsize (dataset with model overlay, residuals), drawn from `num_bins` phase or time
+	bins per dataset instead of every point, so the cost of a plot doesn't grow with the number of points. Each bin
+	shows its mean with the error of the mean and, with `show_extent`, a vertical line over its min-max range. Residuals
+	are computed once per dataset against the interpolated model fluxes. Datasets the model has no fluxes for are drawn
+	without model line and residuals.
+	"""
+	if colors is None:
+		colors = GAIA_PLOT_COLORS | ZTF_PLOT_COLORS | ZTF_TRIMMED_PLOT_COLORS | ITURBIDE_PLOT_COLORS
+	if dataset_groups is None:
+		dataset_groups = b.filter(kind='lc').datasets
+	if type(dataset_groups[0]) is str:
+		dataset_groups = [[d] for d in dataset_groups]
+		scale_max_flux = False
+
+	modelDatasets = b.filter(model=model, context='model').datasets
+	figs = []
+	for datasets in dataset_groups:
+		fig, (fluxAx, residAx) = plt.subplots(1, 2, figsize=figsize)
+		maxFlux = 0
+		for d in datasets:
+			times = np.asarray(b.get_value(qualifier='times', context='dataset', dataset=d), dtype=float)
+			fluxes = np.asarray(b.get_value(qualifier='fluxes', context='dataset', dataset=d), dtype=float)
+			sigmas = np.asarray(b.get_value(qualifier='sigmas', context='dataset', dataset=d), dtype=float)
+			sigmas = sigmas if len(sigmas) == len(fluxes) else None
+			modelTimes, modelFluxes = np.empty(0), np.empty(0)
+			if d in modelDatasets:
+				modelTimes = np.asarray(b.get_value(qualifier='times', context='model', model=model, dataset=d), dtype=float)
+				modelFluxes = np.asarray(b.get_value(qualifier='fluxes', context='model', model=model, dataset=d), dtype=float)
+			hasModel = len(modelTimes) > 0
+			if hasModel:
+				residuals = fluxes - interpModelFluxes(b, times, modelTimes, modelFluxes)
+			else:
+				print(f"No {model} fluxes for {d}; plotting the dataset only")
+				residuals = np.full_like(fluxes, np.nan)
+			if len(fluxes) > 0:
+				maxFlux = max(maxFlux, np.nanmax(fluxes))
+
+			x = np.asarray(b.to_phase(times)) if phase else times
+			modelX = np.asarray(b.to_phase(modelTimes)) if phase else modelTimes
+			xRange = (-0.5, 0.5) if phase else (min(x.min(initial=np.inf), modelX.min(initial=np.inf)),
+											   max(x.max(initial=-np.inf), modelX.max(initial=-np.inf)))
+			if not np.all(np.isfinite(xRange)):
+				print(f"No points for {d} in dataset or {model}; skipped")
+				continue
+			data = binPoints(x, fluxes, num_bins, xRange, sigmas)
+			modelCurve = binPoints(modelX, modelFluxes, num_bins, xRange)
+			resid = binPoints(x, residuals, num_bins, xRange, sigmas)
+
+			dataColor, modelColor = colors.get(f"{d}@dataset"), colors.get(f"{d}@model")
+			if show_extent:
+				fluxAx.vlines(data.x, data.ymin, data.ymax, color=dataColor, alpha=0.3, lw=0.8)
+				residAx.vlines(resid.x, resid.ymin, resid.ymax, color=dataColor, alpha=0.3, lw=0.8)
+			fluxAx.errorbar(data.x, data.y, yerr=data.yerr, fmt='.', ms=3, color=dataColor, label=d)
+			if hasModel:
+				fluxAx.plot(modelCurve.x, modelCurve.y, ls='solid', color=modelColor, zorder=3, label=f"{d} ({model})")
+			residAx.errorbar(resid.x, resid.y, yerr=resid.yerr, fmt='.', ms=3, color=dataColor, label=d)
+
+		xLabel = 'phase' if phase else 'times (d)'
+		residAx.axhline(0, color='gray', lw=0.8)
+		fluxAx.set(xlabel=xLabel, ylabel='fluxes')
+		residAx.set(xlabel=xLabel, ylabel='residuals')
+		if scale_max_flux:
+			fluxAx.set_ylim(top=(1 + 0.17*len(datasets)) * maxFlux)
+		fluxAx.legend()
+		fig.tight_layout()
+		figs.append(fig)
+		if show:
+			plt.show()
+	return figs
 
 def plotModelResidualsFigsize(b: phoebe.Bundle, figsize: tuple[float, float], model: str, dataset_groups: list[list[str] | str] = None, phase=True, scale_max_flux=True,
-							  model_kwargs: dict['str', 'str'] = {}, residuals_kwargs: dict['str', 'str'] = {}, **plot_kwargs) -> None:
+							  model_kwargs: dict['str', 'str'] = {}, residuals_kwargs: dict['str', 'str'] = {}, num_bins: int = None, **plot_kwargs) -> None:
     """
     Plots specified model for the datasets given. Plots dataset(s) with model overlay alongside residuals side-by-side.
+    With `num_bins`, points are binned instead of plotted individually (see plotModelResidualsBinned).
     """
+    if num_bins is not None:
+        colors = plot_kwargs.get('color')
+        plotModelResidualsBinned(b, figsize, model, dataset_groups, phase, scale_max_flux, num_bins=num_bins,
+                                 colors=colors if isinstance(colors, dict) else None)
+        return
+
     defaultPlotKwargs = {
         'marker': {'dataset': '.'},
         # 'color': GAIA_PLOT_COLORS | ZTF_PLOT_COLORS | ZTF_TRIMMED_PLOT_COLORS | ITURBIDE_PLOT_COLORS,
@@ -280,35 +499,41 @@ def printChi2(b: phoebe.Bundle, model: str):
 	"""
 	Prints the chi2 fit of a model for all available datasets: Iturbide, Aviles, Gaia, and ZTF data, both normalized
 	and raw datasets. Silently ignores any dataset that isn't present in the specified model.
-	"""
 
-	rawGaiaDatasets = [d for d in b.datasets if ('raw' in d and 'gaia' in d) or ('Gaia' in d)]
-	ztfDatasets = [d for d in b.datasets if 'Ztf' in d]
-	allLcs = [d for d in b.datasets if 'mesh' not in d]
+	Per-dataset values are cached (see `chi2Table`), so repeated calls only evaluate chi2 for recomputed models.
+	"""
+	chi2Cache = getChi2Cache(b)
+	groups = defaultDatasetGroups(b)
+	rawGaiaDatasets = groups.get('Gaia (Raw)', [])
+	ztfDatasets = groups.get('ZTF', [])
 	
-	print(f"{model} - {b.calculate_chi2(model=model, dataset=allLcs)}", "=================================================", sep='\n')
+	print(f"{model} - {chi2Cache.groupChi2(model, groups.get('All', []))}", "=================================================", sep='\n')
 
-	try:
-		print('\t', "Gaia (Raw) -", np.sum(b.calculate_chi2(model=model, dataset=rawGaiaDatasets)))
+	if not np.isnan(chi2Cache.groupChi2(model, rawGaiaDatasets)):
+		print('\t', "Gaia (Raw) -", chi2Cache.groupChi2(model, rawGaiaDatasets))
 		for gd in rawGaiaDatasets:
-			print('\t\t', gd, "-", np.sum(b.calculate_chi2(model=model, dataset=gd)))
+			print('\t\t', gd, "-", chi2Cache.datasetChi2(model, gd))
 		print("------------------------------------------------")
-	except: pass
 
-	try:
-		print('\t', "Iturbide (Norm) -", np.sum(b.calculate_chi2(model=model, dataset=['lc_iturbide_norm', 'lcIturbide'])))
-	except: pass
+	if 'Iturbide (Norm)' in groups and not np.isnan(chi2Cache.groupChi2(model, groups['Iturbide (Norm)'])):
+		print('\t', "Iturbide (Norm) -", chi2Cache.groupChi2(model, groups['Iturbide (Norm)']))
 
 	print("------------------------------------------------")
 
-	try:
-		print('\t', "ZTF -", np.sum(b.calculate_chi2(model=model, dataset=ztfDatasets)))
+	if not np.isnan(chi2Cache.groupChi2(model, ztfDatasets)):
+		print('\t', "ZTF -", chi2Cache.groupChi2(model, ztfDatasets))
 		for zd in ztfDatasets:
-			try:
-				print('\t\t', zd, "-", np.sum(b.calculate_chi2(model=model, dataset=zd)))
-			except: 
+			zdChi2 = chi2Cache.datasetChi2(model, zd)
+			if np.isnan(zdChi2):
 				print("\t\t", zd, "Not found in model")
-	except: pass
+			else:
+				print('\t\t', zd, "-", zdChi2)
+
+def chi2Table(b: phoebe.Bundle, models: list[str] = None, dataset_groups: dict[str, list[str]] = None):
+	"""
+	Returns a (model x dataset group) DataFrame of chi2 values; NaN where none of a group's datasets are in the model.
+	"""
+	return getChi2Cache(b).table(models, dataset_groups)
 
 def printAllModelsChi2(b: phoebe.Bundle):
 	for m in b.models:
@@ -319,4 +544,4 @@ def printModelsChi2(b: phoebe.Bundle, models: list[str]):
 		if m not in b.models:
 			print(f"{m} not found")
 		else:
-			printChi2(b, m)
\ No newline at end of file
+			printChi2(b, m)
@@ -1,15 +1,15 @@
 from obsrv_plan.general.params import DATA_FILE_PATH
+from obsrv_plan.general.gaia_reader import loadColumns
 
 import matplotlib.pyplot as plt
-import modin.pandas as pd
 
 if __name__ == '__main__':
 	G_PROP = "phot_g_mean_mag"
 	BP_RP_PROP = "bp_rp"
 
-	df = pd.read_csv(DATA_FILE_PATH)
-	g = df[G_PROP]
-	bp_rp = df[BP_RP_PROP]
+	columns = loadColumns(DATA_FILE_PATH, [G_PROP, BP_RP_PROP]) # memory-mapped columnar cache, built on first run
+	g = columns[G_PROP]
+	bp_rp = columns[BP_RP_PROP]
 
 	plt.xlabel("$G_{BP} - G_{RP}$")
 	plt.ylabel("$G$")
@@ -0,0 +1,170 @@
+"""
+Reddening E(B-V) from the Bayestar 3D dust map for whole candidate lists.
+
+The map is loaded once per process and kept resident (`bayestarMap`). Queries take arrays of galactic (l, b,
+distance) and are answered from a SQLite cache keyed by HEALPix pixel (nside 1024, nested: Bayestar's finest
+resolution, so every cache pixel lies inside a single map pixel) and distance-modulus bin (0.125 mag from DM 4 to 19,
+the spacing of Bayestar's distance samples). Only the keys never seen before reach the map, in one vectorized call at
+the pixel centres and bin-centre distances; everything else is a cache lookup.
+
+Values are in Bayestar units (see the dustmaps documentation for the conversion to E(B-V) of a given reddening law).
+"""
+
+import os
+import time
+import sqlite3
+from os.path import join
+
+import numpy as np
+
+from obsrv_plan.general.params import RESULT_DIR, DUSTMAPS_DATA_DIR
+from obsrv_plan.general.log import printToLog
+
+EXTINCTION_CACHE_PATH = join(RESULT_DIR, "bayestar-ebv.sqlite")
+
+HEALPIX_NSIDE = 1024
+DM_MIN = 4.0
+DM_STEP = 0.125
+NUM_DIST_BINS = 121
+
+_maps = {}
+
+def bayestarMap(version: str = 'bayestar2019', max_samples: int = None):
+	"""
+	Resident BayestarQuery for `version`, loaded on first use (several GB and a long read, once per process).
+	"""
+	key = (version, max_samples)
+	if key not in _maps:
+		from dustmaps.config import config
+		from dustmaps.bayestar import BayestarQuery
+		if DUSTMAPS_DATA_DIR is not None:
+			config['data_dir'] = DUSTMAPS_DATA_DIR
+		start = time.perf_counter()
+		_maps[key] = BayestarQuery(version=version, max_samples=max_samples)
+		printToLog(f"Loaded {version} dust map", print_console=True, latency_s=round(time.perf_counter() - start, 2))
+	return _maps[key]
+
+def distanceBins(distance: np.ndarray) -> np.ndarray:
+	"""
+	Distance-modulus bin of each distance (pc); -1 where the distance isn't positive and finite. Distances beyond the
+	grid fall in its first or last bin.
+	"""
+	distance = np.asarray(distance, dtype=float)
+	valid = np.isfinite(distance) & (distance > 0)
+	distMod = 5 * np.log10(np.where(valid, distance, 1)) - 5
+	bins = np.clip(np.round((distMod - DM_MIN) / DM_STEP), 0, NUM_DIST_BINS - 1).astype(np.int64)
+	return np.where(valid, bins, -1)
+
+def binDistance(bins: np.ndarray) -> np.ndarray:
+	return 10**((DM_MIN + np.asarray(bins) * DM_STEP + 5) / 5)
+
+def cacheKeys(l: np.ndarray, b: np.ndarray, distance: np.ndarray) -> np.ndarray:
+	"""
+	pixel * NUM_DIST_BINS + distance bin for every (l, b) in degrees and distance in pc; -1 for invalid distances.
+	"""
+	import healpy
+	pixels = healpy.ang2pix(HEALPIX_NSIDE, np.asarray(l, dtype=float), np.asarray(b, dtype=float), nest=True, lonlat=True)
+	bins = distanceBins(distance)
+	return np.where(bins >= 0, pixels.astype(np.int64) * NUM_DIST_BINS + bins, -1)
+
+class ExtinctionCache:
+	"""
+	SQLite table of queried (map, key) -> E(B-V). Only used from the thread that created it.
+	"""
+
+	def __init__(self, db_path: str = EXTINCTION_CACHE_PATH) -> None:
+		self.db_path = db_path
+		os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+		self._conn = sqlite3.connect(db_path)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("CREATE TABLE IF NOT EXISTS ebv (map TEXT, key INTEGER, ebv REAL, PRIMARY KEY (map, key))")
+		self._conn.commit()
+
+	def lookup(self, map_id: str, keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+		"""
+		(found, values) for unique `keys`; values are NaN where not found.
+		"""
+		self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (key INTEGER PRIMARY KEY)")
+		self._conn.execute("DELETE FROM lookup")
+		self._conn.executemany("INSERT OR IGNORE INTO lookup VALUES (?)", ((int(k),) for k in keys))
+		rows = self._conn.execute("SELECT key, ebv FROM lookup JOIN ebv USING (key) WHERE map = ?", (map_id,)).fetchall()
+
+		found, values = np.zeros(len(keys), dtype=bool), np.full(len(keys), np.nan)
+		if len(rows) > 0:
+			cachedKeys, cachedValues = np.array([r[0] for r in rows], dtype=np.int64), np.array([r[1] for r in rows], dtype=float)
+			order = np.argsort(keys)
+			idx = order[np.searchsorted(keys, cachedKeys, sorter=order)]
+			found[idx] = True
+			values[idx] = cachedValues
+		return found, values
+
+	def store(self, map_id: str, keys: np.ndarray, values: np.ndarray) -> None:
+		self._conn.executemany("INSERT OR REPLACE INTO ebv VALUES (?, ?, ?)",
+							   ((map_id, int(k), float(v)) for k, v in zip(keys, values)))
+		self._conn.commit()
+
+	def __len__(self) -> int:
+		return self._conn.execute("SELECT COUNT(*) FROM ebv").fetchone()[0]
+
+	def close(self) -> None:
+		self._conn.close()
+
+def _queryMap(keys: np.ndarray, mode: str, pct: float, version: str, max_samples: int) -> np.ndarray:
+	import healpy
+	import astropy.units as u
+	from astropy.coordinates import SkyCoord
+
+	l, b = healpy.pix2ang(HEALPIX_NSIDE, keys // NUM_DIST_BINS, nest=True, lonlat=True)
+	coords = SkyCoord(l=l * u.deg, b=b * u.deg, distance=binDistance(keys % NUM_DIST_BINS) * u.pc, frame='galactic')
+	return np.asarray(bayestarMap(version, max_samples)(coords, mode=mode, pct=pct), dtype=float)
+
+def reddening(l: np.ndarray, b: np.ndarray, distance: np.ndarray, mode: str = 'median', pct: float = None,
+			  version: str = 'bayestar2019', max_samples: int = None, cache_path: str = EXTINCTION_CACHE_PATH,
+			  chunk_size: int = 200_000) -> np.ndarray:
+	"""
+	E(B-V) for galactic `l`, `b` (degrees) at `distance` (pc); NaN where the distance isn't positive. `mode` and
+	`pct` are BayestarQuery's ('median', 'mean', 'best', 'percentile'...; 'samples' can't be cached). Keys missing
+	from the cache are queried in chunks of `chunk_size` and stored.
+	"""
+	if mode in ('samples', 'random_sample', 'random_sample_per_pix'):
+		raise ValueError(f"mode '{mode}' has no single value per position to cache")
+	mapId = f"{version}:{mode}" + (f":{pct}" if pct is not None else "") + (f":{max_samples}" if max_samples is not None else "")
+
+	keys = cacheKeys(l, b, distance)
+	uniqueKeys, inverse = np.unique(keys[keys >= 0], return_inverse=True)
+
+	cache = ExtinctionCache(cache_path)
+	try:
+		found, values = cache.lookup(mapId, uniqueKeys)
+		missing = np.flatnonzero(~found)
+		for start in range(0, len(missing), chunk_size):
+			chunk = missing[start:start + chunk_size]
+			queryStart = time.perf_counter()
+			values[chunk] = _queryMap(uniqueKeys[chunk], mode, pct, version, max_samples)
+			cache.store(mapId, uniqueKeys[chunk], values[chunk])
+			printToLog(f"Queried {version} for {len(chunk)} (pixel, distance) keys", batch_size=len(chunk),
+					   latency_s=round(time.perf_counter() - queryStart, 3))
+	finally:
+		cache.close()
+
+	ebv = np.full(len(keys), np.nan)
+	ebv[keys >= 0] = values[inverse]
+	return ebv
+
+def reddeningIcrs(ra: np.ndarray, dec: np.ndarray, distance: np.ndarray, **kwargs) -> np.ndarray:
+	"""
+	`reddening` for ICRS `ra`, `dec` in degrees.
+	"""
+	import astropy.units as u
+	from astropy.coordinates import SkyCoord
+
+	galactic = SkyCoord(ra=np.asarray(ra, dtype=float) * u.deg, dec=np.asarray(dec, dtype=float) * u.deg, frame='icrs').galactic
+	return reddening(galactic.l.deg, galactic.b.deg, distance, **kwargs)
+
+def parallaxDistance(parallax: np.ndarray) -> np.ndarray:
+	"""
+	Distance in pc from a parallax in mas (1/parallax); NaN for non-positive parallaxes.
+	"""
+	parallax = np.asarray(parallax, dtype=float)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return np.where(parallax > 0, 1000 / parallax, np.nan)
@@ -0,0 +1,144 @@
+"""
+Streaming reader for the Gaia query CSV (DATA_FILE_PATH): fixed-size record batches of only the needed columns,
+as a dict of column name -> numpy array, so downstream stages never hold the whole file.
+
+The CSV can be converted once into a columnar cache next to it (`<csv name>.cache/`): one .npy file per column
+(memory-mapped when read, no extra dependency) or a Parquet file (pyarrow). Once a valid cache exists, batches and
+whole columns come from it instead of parsing the CSV again.
+"""
+
+import os
+import json
+import time
+from collections.abc import Iterator
+
+import numpy as np
+import pandas as pd
+
+from obsrv_plan.general.params import DATA_FILE_PATH
+
+GAIA_COLUMNS = ["source_id", "ra", "dec", "phot_g_mean_mag", "bp_rp"]
+COLUMN_DTYPES = {"source_id": np.int64}
+DEFAULT_BATCH_SIZE = 250_000
+
+CACHE_META_FNAME = "meta.json"
+PARQUET_FNAME = "gaia.parquet"
+
+GaiaBatch = dict[str, np.ndarray]
+
+def _dtype(column: str) -> np.dtype:
+	return np.dtype(COLUMN_DTYPES.get(column, np.float64))
+
+def cacheDir(path: str = DATA_FILE_PATH) -> str:
+	return f"{os.path.splitext(path)[0]}.cache"
+
+def _sourceSignature(path: str) -> dict[str, float]:
+	stat = os.stat(path)
+	return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def readCacheMeta(path: str = DATA_FILE_PATH) -> dict | None:
+	"""
+	Metadata of the columnar cache of `path`, or None if there's no cache or the CSV changed since it was written.
+	"""
+	metaPath = os.path.join(cacheDir(path), CACHE_META_FNAME)
+	if not os.path.exists(metaPath):
+		return None
+	with open(metaPath, 'r') as metaFile:
+		meta = json.load(metaFile)
+	if os.path.exists(path) and meta.get('source') != _sourceSignature(path):
+		return None
+	return meta
+
+def iterCsvBatches(path: str = DATA_FILE_PATH, columns: list[str] = GAIA_COLUMNS, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[GaiaBatch]:
+	with pd.read_csv(path, usecols=columns, dtype={c: _dtype(c) for c in columns}, chunksize=batch_size, engine='c') as reader:
+		for chunk in reader:
+			yield {c: chunk[c].to_numpy() for c in columns}
+
+def countCsvRows(path: str, block_size: int = 1 << 24) -> int:
+	"""
+	Upper bound of the number of data rows (newlines minus the header), read in raw blocks.
+	"""
+	numLines = 0
+	lastByte = b"\n"
+	with open(path, 'rb') as csvFile:
+		while block := csvFile.read(block_size):
+			numLines += block.count(b"\n")
+			lastByte = block[-1:]
+	return numLines - 1 + (lastByte != b"\n")
+
+def buildColumnCache(path: str = DATA_FILE_PATH, cache_format: str = 'npy', columns: list[str] = GAIA_COLUMNS,
+					 batch_size: int = DEFAULT_BATCH_SIZE, overwrite: bool = False) -> str:
+	"""
+	Converts the CSV into a columnar cache in a single streaming pass; memory use is bounded by `batch_size`.
+	Returns the cache folder. An existing valid cache with the same columns is reused unless `overwrite`.
+	"""
+	folder = cacheDir(path)
+	meta = readCacheMeta(path)
+	if meta is not None and not overwrite and set(columns) <= set(meta['columns']):
+		return folder
+	os.makedirs(folder, exist_ok=True)
+
+	start = time.perf_counter()
+	numRows = 0
+	if cache_format == 'npy':
+		maxRows = countCsvRows(path)
+		arrays = {c: np.lib.format.open_memmap(os.path.join(folder, f"{c}.npy"), mode='w+', dtype=_dtype(c), shape=(maxRows,)) for c in columns}
+		for batch in iterCsvBatches(path, columns, batch_size):
+			batchRows = len(batch[columns[0]])
+			for c in columns:
+				arrays[c][numRows:numRows + batchRows] = batch[c]
+			numRows += batchRows
+		for array in arrays.values():
+			array.flush()
+		del arrays
+	elif cache_format == 'parquet':
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+		writer = None
+		for batch in iterCsvBatches(path, columns, batch_size):
+			table = pa.table(batch)
+			writer = writer or pq.ParquetWriter(os.path.join(folder, PARQUET_FNAME), table.schema)
+			writer.write_table(table)
+			numRows += table.num_rows
+		if writer is not None:
+			writer.close()
+	else:
+		raise ValueError(f"Unknown cache format {cache_format}; expected 'npy' or 'parquet'")
+
+	with open(os.path.join(folder, CACHE_META_FNAME), 'w') as metaFile:
+		json.dump({'format': cache_format, 'columns': list(columns), 'num_rows': numRows, 'source': _sourceSignature(path)}, metaFile, indent=1)
+	print(f"Cached {numRows:,} rows of {os.path.basename(path)} ({cache_format}) in {time.perf_counter() - start:.1f} s")
+	return folder
+
+def loadColumns(path: str = DATA_FILE_PATH, columns: list[str] = GAIA_COLUMNS) -> GaiaBatch:
+	"""
+	Whole columns from the cache (built on first use); .npy caches are memory-mapped, so memory stays flat.
+	"""
+	meta = readCacheMeta(path)
+	if meta is None or not set(columns) <= set(meta['columns']):
+		buildColumnCache(path, columns=sorted(set(columns) | set(meta['columns'] if meta else GAIA_COLUMNS), key=GAIA_COLUMNS.index), overwrite=True)
+		meta = readCacheMeta(path)
+
+	folder = cacheDir(path)
+	if meta['format'] == 'npy':
+		return {c: np.load(os.path.join(folder, f"{c}.npy"), mmap_mode='r')[:meta['num_rows']] for c in columns}
+	import pyarrow.parquet as pq
+	table = pq.read_table(os.path.join(folder, PARQUET_FNAME), columns=columns)
+	return {c: table.column(c).to_numpy() for c in columns}
+
+def iterGaiaBatches(path: str = DATA_FILE_PATH, columns: list[str] = GAIA_COLUMNS, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[GaiaBatch]:
+	"""
+	Record batches of at most `batch_size` rows, from the columnar cache when a valid one has all the columns,
+	otherwise streamed from the CSV.
+	"""
+	meta = readCacheMeta(path)
+	if meta is None or not set(columns) <= set(meta['columns']):
+		yield from iterCsvBatches(path, columns, batch_size)
+	elif meta['format'] == 'npy':
+		arrays = loadColumns(path, columns)
+		for start in range(0, meta['num_rows'], batch_size):
+			yield {c: np.asarray(arrays[c][start:start + batch_size]) for c in columns}
+	else:
+		import pyarrow.parquet as pq
+		for recordBatch in pq.ParquetFile(os.path.join(cacheDir(path), PARQUET_FNAME)).iter_batches(batch_size=batch_size, columns=columns):
+			yield {c: recordBatch.column(c).to_numpy(zero_copy_only=False) for c in columns}
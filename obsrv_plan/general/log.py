@@ -1,19 +1,127 @@
-from obsrv_plan.general.params import RESULT_DIR
+"""
+Queue-based logging for the candidate pipeline.
+
+`printToLog` only builds a record and puts it on a multiprocessing queue; a single writer process drains the queue
+and appends to RESULT_DIR/.log in batches (every `flush_seconds` or `max_batch` records). Records carry optional
+structured fields (batch size, query latency, ...) which are also written as JSON lines to RESULT_DIR/.log.jsonl,
+so the log doubles as performance telemetry.
+
+The writer is started on first use from the main process (or explicitly with `startLogWriter`) and stopped at exit.
+Pool workers inherit the queue when forked; with the spawn start method pass `logQueue()` to `initWorkerLogging`
+as the pool initializer. Processes without a queue fall back to appending directly to the file.
+"""
 
+import os
+import json
+import time
+import atexit
 import datetime
-from os.path import join, exists
-from os import makedirs
-from multiprocessing import Lock
-
-LOGGING_LOCK = Lock()
-
-def printToLog(msg: str, print_console=False):
-	with LOGGING_LOCK:
-		if not exists(RESULT_DIR):
-			makedirs(RESULT_DIR)
-
-		with open(join(RESULT_DIR, ".log"), "a+") as logFile:
-			logFile.write(f"[{datetime.datetime.now()}] {msg}\n")
-		
-		if print_console:
-			print(f"[{datetime.datetime.now()}] {msg}")
\ No newline at end of file
+import threading
+import multiprocessing as mp
+from contextlib import contextmanager
+from os.path import join
+from queue import Empty
+
+from obsrv_plan.general.params import RESULT_DIR
+
+LOG_FNAME = ".log"
+TELEMETRY_FNAME = ".log.jsonl"
+
+_queue: mp.Queue = None
+_writer: mp.Process = None
+_startLock = threading.Lock()
+
+def _formatRecord(record: dict) -> str:
+	timestamp = datetime.datetime.fromtimestamp(record['ts'])
+	fields = record.get('fields')
+	fieldsStr = f" | {' '.join(f'{k}={v}' for k, v in fields.items())}" if fields else ""
+	return f"[{timestamp}] {record['msg']}{fieldsStr}\n"
+
+def _writeRecords(records: list[dict], log_dir: str) -> None:
+	with open(join(log_dir, LOG_FNAME), "a") as logFile:
+		logFile.writelines(_formatRecord(r) for r in records)
+	telemetry = [r for r in records if r.get('fields')]
+	if len(telemetry) > 0:
+		with open(join(log_dir, TELEMETRY_FNAME), "a") as telemetryFile:
+			telemetryFile.writelines(json.dumps(r, default=str) + "\n" for r in telemetry)
+
+def _writerLoop(queue: mp.Queue, log_dir: str, flush_seconds: float, max_batch: int) -> None:
+	os.makedirs(log_dir, exist_ok=True)
+	pending = []
+	lastFlush = time.monotonic()
+	running = True
+	while running:
+		try:
+			record = queue.get(timeout=flush_seconds)
+			if record is None:
+				running = False
+			else:
+				pending.append(record)
+		except Empty:
+			pass
+		if len(pending) > 0 and (not running or len(pending) >= max_batch or time.monotonic() - lastFlush >= flush_seconds):
+			_writeRecords(pending, log_dir)
+			pending = []
+			lastFlush = time.monotonic()
+
+def startLogWriter(log_dir: str = RESULT_DIR, flush_seconds: float = 0.5, max_batch: int = 1000) -> mp.Queue:
+	"""
+	Starts the writer process (once) and returns the queue records are sent through.
+	"""
+	global _queue, _writer
+	with _startLock:
+		if _writer is not None and _writer.is_alive():
+			return _queue
+		queue = mp.Queue()
+		_writer = mp.Process(target=_writerLoop, args=(queue, log_dir, flush_seconds, max_batch), daemon=True, name="log-writer")
+		_writer.start()
+		_queue = queue
+		atexit.register(stopLogWriter) # after multiprocessing's own exit handler, so it runs before daemons are terminated
+		return _queue
+
+def stopLogWriter(timeout: float = 10) -> None:
+	"""
+	Flushes every queued record and stops the writer.
+	"""
+	global _queue, _writer
+	if _writer is None or mp.current_process().name != 'MainProcess':
+		return
+	atexit.unregister(stopLogWriter)
+	_queue.put(None)
+	_writer.join(timeout)
+	_queue, _writer = None, None
+
+def logQueue() -> mp.Queue:
+	return _queue if _queue is not None else startLogWriter()
+
+def initWorkerLogging(queue: mp.Queue) -> None:
+	global _queue
+	_queue = queue
+
+def printToLog(msg: str, print_console=False, **fields):
+	"""
+	Queues `msg` (and any structured `fields`, e.g. batch_size=..., latency_s=...) for the log writer.
+	"""
+	record = {'ts': time.time(), 'pid': os.getpid(), 'msg': str(msg), 'fields': fields}
+	if print_console:
+		print(_formatRecord(record), end="")
+
+	if _queue is None and mp.parent_process() is None:
+		startLogWriter()
+	if _queue is not None:
+		_queue.put(record)
+	else: # child process without a queue: a single small O_APPEND write needs no lock
+		os.makedirs(RESULT_DIR, exist_ok=True)
+		_writeRecords([record], RESULT_DIR)
+
+@contextmanager
+def timedLog(msg: str, print_console=False, **fields):
+	"""
+	Logs `msg` with a latency_s field measuring the body of the with block; the yielded dict can add fields.
+	"""
+	extra = dict(fields)
+	start = time.perf_counter()
+	try:
+		yield extra
+	finally:
+		printToLog(msg, print_console, latency_s=round(time.perf_counter() - start, 4), **extra)
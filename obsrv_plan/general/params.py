@@ -28,4 +28,11 @@ SIMBAD_VOT_RESULTS = join(RESULT_DIR, "simbad-raw_vot")
 # SIMBAD_VOT_RESULTS = join(RESULT_DIR, "simbad") # uncomment for backwards compat with previous dates
 
 SIMBAD_CATEGORIES = join(RESULT_DIR, "simbad-categories")
-MAX_PARALLEL = max(cpu_count() - 2, 2)
\ No newline at end of file
+MAX_PARALLEL = max(cpu_count() - 2, 2)
+
+# multi-night planning (obsrv_plan.observability.planner)
+EPHEMERIS_CACHE_DIR = join(WORKING_DIR, "ephemeris-cache")
+CAMPAIGNS_DIR = join(WORKING_DIR, "campaigns")
+
+# Bayestar dust map (obsrv_plan.general.extinction); None keeps dustmaps' configured data_dir
+DUSTMAPS_DATA_DIR = "/home/ramon/.dustmaps/maps"
\ No newline at end of file
@@ -0,0 +1,138 @@
+"""
+Multi-night campaign planner: a ranked target schedule for every night in a date range.
+
+Nightly ephemerides (time grid, LST, sun/moon positions, moon illumination, twilight) are cached on disk keyed by
+date and site, so a night is only ever computed once. Nights are planned in parallel across processes. Each night's
+visibility table is stored by source id in the campaign folder, so re-planning after the candidate list changes only
+evaluates the new candidates and drops the removed ones; changing the planning options recomputes everything.
+"""
+
+import os
+import json
+import hashlib
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from astropy.coordinates import EarthLocation
+
+from obsrv_plan.general.params import EPHEMERIS_CACHE_DIR, CAMPAIGNS_DIR, MAX_PARALLEL, TIMEZONE
+from obsrv_plan.general.log import printToLog
+from obsrv_plan.observability.visibility import ITURBIDE_LOCATION, NightEphemeris, nightEphemeris, computeVisibility
+
+PLAN_OPTIONS_FNAME = "plan-options.json"
+DEFAULT_PLAN_OPTIONS = {'min_altitude': 30, 'min_hours': 1, 'min_moon_separation': 30, 'step_minutes': 5, 'sun_horizon': -12}
+
+def siteKey(location: EarthLocation) -> str:
+	return f"{location.lat.deg:.4f}_{location.lon.deg:.4f}_{location.height.to_value('m'):.0f}"
+
+def ephemerisCachePath(night: date, location: EarthLocation, step_minutes: float, sun_horizon: float,
+					   cache_dir: str = EPHEMERIS_CACHE_DIR) -> str:
+	return os.path.join(cache_dir, siteKey(location), f"{night.strftime('%Y%m%d')}_{step_minutes:g}min_{sun_horizon:g}deg.npz")
+
+def loadNightEphemeris(night: date, location: EarthLocation = ITURBIDE_LOCATION, step_minutes: float = 5, sun_horizon: float = -12,
+					   cache_dir: str = EPHEMERIS_CACHE_DIR) -> NightEphemeris:
+	"""
+	Night ephemeris from the on-disk cache, computed and stored on a miss.
+	"""
+	cachePath = ephemerisCachePath(night, location, step_minutes, sun_horizon, cache_dir)
+	if os.path.exists(cachePath):
+		with np.load(cachePath) as cached:
+			return NightEphemeris(night=night, **{f: cached[f] for f in NightEphemeris._fields if f != 'night'})
+
+	ephemeris = nightEphemeris(night, location, step_minutes, sun_horizon)
+	os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+	tempPath = f"{cachePath}.part.npz"
+	np.savez(tempPath, **{f: getattr(ephemeris, f) for f in NightEphemeris._fields if f != 'night'})
+	os.replace(tempPath, cachePath)
+	return ephemeris
+
+def twilightTimes(ephemeris: NightEphemeris) -> tuple[float, float] | None:
+	"""
+	(evening, morning) twilight JD at the ephemeris' sun horizon; None if the sun never sets below it.
+	"""
+	darkIdx = np.flatnonzero(ephemeris.dark)
+	return (ephemeris.jd[darkIdx[0]], ephemeris.jd[darkIdx[-1]]) if len(darkIdx) > 0 else None
+
+def jdToLocal(jd: np.ndarray) -> pd.DatetimeIndex:
+	return pd.to_datetime((np.asarray(jd) - 2440587.5) * 86400, unit='s', utc=True).tz_convert(TIMEZONE)
+
+def _optionsHash(options: dict, location: EarthLocation) -> str:
+	return hashlib.blake2b(json.dumps({**options, 'site': siteKey(location)}, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+def _nightPlanPath(campaign_dir: str, night: date) -> str:
+	return os.path.join(campaign_dir, f"{night.strftime('%Y%m%d')}.npz")
+
+def _planNight(night: date, ids: np.ndarray, ra: np.ndarray, dec: np.ndarray, options: dict, location: EarthLocation,
+			   campaign_dir: str, cache_dir: str, reuse: bool) -> tuple[date, pd.DataFrame, int]:
+	ephemeris = loadNightEphemeris(night, location, options['step_minutes'], options['sun_horizon'], cache_dir)
+
+	planPath = _nightPlanPath(campaign_dir, night)
+	stored = None
+	if reuse and os.path.exists(planPath):
+		with np.load(planPath) as planFile:
+			stored = {k: planFile[k] for k in planFile.files}
+
+	isNew = ~np.isin(ids, stored['source_id']) if stored is not None else np.ones(len(ids), dtype=bool)
+	table = {'source_id': ids[isNew]}
+	if np.any(isNew):
+		table |= computeVisibility(ra[isNew], dec[isNew], ephemeris, options['min_altitude'], options['min_hours'], options['min_moon_separation'])._asdict()
+	else:
+		table |= {k: stored[k][:0] for k in stored if k != 'source_id'}
+	if stored is not None:
+		keep = np.isin(stored['source_id'], ids) # candidates dropped from the list are forgotten
+		table = {k: np.concatenate([stored[k][keep], table[k]]) for k in table}
+
+	tempPath = f"{planPath}.part.npz"
+	np.savez(tempPath, **table)
+	os.replace(tempPath, planPath)
+
+	plan = pd.DataFrame(table)
+	twilight = twilightTimes(ephemeris)
+	bestJd = np.clip(plan['transitJd'], *twilight) if twilight is not None else plan['transitJd']
+	plan['transit_local'] = jdToLocal(plan['transitJd'])
+	plan['best_time_local'] = jdToLocal(bestJd)
+	plan['moon_illumination'] = float(ephemeris.moonIllumination[len(ephemeris.jd) // 2])
+	plan = plan[plan['observable']].sort_values(['score', 'minAirmass'], ascending=[False, True]).reset_index(drop=True)
+	return night, plan, int(np.count_nonzero(isNew))
+
+def planCampaign(candidates: pd.DataFrame, first_night: date, last_night: date, name: str = None, location: EarthLocation = ITURBIDE_LOCATION,
+				 max_parallel: int = MAX_PARALLEL, cache_dir: str = EPHEMERIS_CACHE_DIR, write_csv: bool = True, **options) -> dict[date, pd.DataFrame]:
+	"""
+	Ranked schedule of `candidates` (columns source_id, ra, dec in degrees, plus anything to carry along, e.g. g_mag or
+	otype) for every night from `first_night` to `last_night` (inclusive, named after the evening they start).
+	Planning `options` default to DEFAULT_PLAN_OPTIONS. Results are kept in CAMPAIGNS_DIR/<name>, one .npz (and .csv)
+	per night; rerunning with the same name and options only evaluates candidates not seen before.
+	"""
+	options = DEFAULT_PLAN_OPTIONS | options
+	name = name or f"{first_night.strftime('%Y%m%d')}-{last_night.strftime('%Y%m%d')}"
+	campaignDir = os.path.join(CAMPAIGNS_DIR, name)
+	os.makedirs(campaignDir, exist_ok=True)
+
+	optionsPath = os.path.join(campaignDir, PLAN_OPTIONS_FNAME)
+	optionsHash = _optionsHash(options, location)
+	reuse = False
+	if os.path.exists(optionsPath):
+		with open(optionsPath, 'r') as optionsFile:
+			reuse = json.load(optionsFile).get('hash') == optionsHash
+	with open(optionsPath, 'w') as optionsFile:
+		json.dump({'hash': optionsHash, 'site': siteKey(location), **options}, optionsFile, indent=1)
+
+	ids = candidates['source_id'].to_numpy().astype(str)
+	ra = candidates['ra'].to_numpy(dtype=float)
+	dec = candidates['dec'].to_numpy(dtype=float)
+	extraColumns = candidates.drop(columns=['ra', 'dec']).assign(source_id=ids)
+
+	nights = [first_night + timedelta(days=i) for i in range((last_night - first_night).days + 1)]
+	plans = {}
+	with ProcessPoolExecutor(max_workers=max(min(max_parallel, len(nights)), 1)) as pool:
+		futures = [pool.submit(_planNight, night, ids, ra, dec, options, location, campaignDir, cache_dir, reuse) for night in nights]
+		for future in futures:
+			night, plan, numComputed = future.result()
+			plan = plan.merge(extraColumns, on='source_id', how='left')
+			plans[night] = plan
+			if write_csv:
+				plan.to_csv(os.path.join(campaignDir, f"{night.strftime('%Y%m%d')}.csv"), index=False)
+			printToLog(f"Planned night {night} | {len(plan)} observable targets | {numComputed} of {len(ids)} candidates evaluated", print_console=True)
+	return plans
@@ -0,0 +1,145 @@
+"""
+Batched visibility of candidate targets from OAU-Iturbide (CDK-20).
+
+Everything that depends only on the night and the site (time grid, local sidereal time, sun and moon positions,
+moon illumination) is computed once per night in `nightEphemeris` through astropy/astroplan. Target altitudes,
+airmasses, transit times and hours above the altitude limit then come from the hour angle in closed form, as numpy
+array operations over (targets x time grid), in chunks of targets so memory stays bounded.
+
+Coordinates are precessed to the equinox of the night once per call; refraction and aberration are ignored
+(well under the arcminute level, irrelevant for scheduling).
+"""
+
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+import astropy.units as u
+from astropy.time import Time
+from astropy.coordinates import AltAz, EarthLocation, FK5, SkyCoord, get_body
+from astroplan import Observer, moon_illumination
+
+from obsrv_plan.general.params import TIMEZONE
+
+ITURBIDE_LOCATION = EarthLocation(lon=-99.895328 * u.deg, lat=24.75521 * u.deg, height=2400 * u.m)
+SIDEREAL_RATE = 2 * np.pi * 1.00273790935 # radians of hour angle per solar day
+
+NightEphemeris = namedtuple("NightEphemeris", "night jd lst sunAltitude moonRa moonDec moonAltitude moonIllumination dark "
+												"latitude step_hours sun_horizon")
+Visibility = namedtuple("Visibility", "maxAltitude minAirmass transitJd transitAltitude hoursAbove moonSeparation observable score")
+
+def iturbideObserver() -> Observer:
+	return Observer(name="Iturbide", timezone=TIMEZONE, location=ITURBIDE_LOCATION)
+
+def nightOf(local_datetime: datetime) -> date:
+	"""
+	Date a night is named after (the evening it starts), for any local time during it.
+	"""
+	return (local_datetime.astimezone(TIMEZONE) - timedelta(hours=12)).date()
+
+def nightEphemeris(night: date, location: EarthLocation = ITURBIDE_LOCATION, step_minutes: float = 5,
+				   sun_horizon: float = -12) -> NightEphemeris:
+	"""
+	Site/night quantities on a grid from local noon of `night` to the next local noon. `dark` marks the samples with
+	the sun below `sun_horizon` degrees. Angles in radians, times as JD.
+	"""
+	start = datetime.combine(night, time(hour=12, tzinfo=TIMEZONE))
+	numSteps = int(round(24 * 60 / step_minutes))
+	times = Time(start) + np.arange(numSteps) * step_minutes * u.min
+	altAz = AltAz(obstime=times, location=location)
+
+	sunAltitude = get_body('sun', times, location).transform_to(altAz).alt.rad
+	moon = get_body('moon', times, location)
+	moonIcrs = moon.icrs
+
+	return NightEphemeris(
+		night=night,
+		jd=times.jd,
+		lst=times.sidereal_time('apparent', longitude=location.lon).rad,
+		sunAltitude=sunAltitude,
+		moonRa=moonIcrs.ra.rad,
+		moonDec=moonIcrs.dec.rad,
+		moonAltitude=moon.transform_to(altAz).alt.rad,
+		moonIllumination=np.asarray(moon_illumination(times)),
+		dark=sunAltitude < np.deg2rad(sun_horizon),
+		latitude=location.lat.rad,
+		step_hours=step_minutes / 60,
+		sun_horizon=sun_horizon,
+	)
+
+def precessToNight(ra: np.ndarray, dec: np.ndarray, ephemeris: NightEphemeris) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	ICRS (degrees) -> equinox of the night's midpoint (radians), for all targets at once.
+	"""
+	equinox = Time(ephemeris.jd[len(ephemeris.jd) // 2], format='jd')
+	ofDate = SkyCoord(ra=np.asarray(ra) * u.deg, dec=np.asarray(dec) * u.deg, frame='icrs').transform_to(FK5(equinox=equinox))
+	return ofDate.ra.rad, ofDate.dec.rad
+
+def altitudeGrid(ra: np.ndarray, dec: np.ndarray, ephemeris: NightEphemeris) -> np.ndarray:
+	"""
+	(targets x time grid) altitudes in radians; `ra`, `dec` already precessed, in radians.
+	"""
+	hourAngle = ephemeris.lst[np.newaxis, :] - ra[:, np.newaxis]
+	sinAlt = np.sin(ephemeris.latitude) * np.sin(dec)[:, np.newaxis] + np.cos(ephemeris.latitude) * np.cos(dec)[:, np.newaxis] * np.cos(hourAngle)
+	return np.arcsin(np.clip(sinAlt, -1, 1))
+
+def airmass(altitude: np.ndarray) -> np.ndarray:
+	"""
+	Plane-parallel sec(z); infinite below the horizon.
+	"""
+	with np.errstate(divide='ignore'):
+		return np.where(altitude > 0, 1 / np.sin(np.maximum(altitude, 1e-9)), np.inf)
+
+def _angularSeparation(ra1, dec1, ra2, dec2) -> np.ndarray:
+	cosSep = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(ra1 - ra2)
+	return np.arccos(np.clip(cosSep, -1, 1))
+
+def computeVisibility(ra: np.ndarray, dec: np.ndarray, ephemeris: NightEphemeris, min_altitude: float = 30, min_hours: float = 1,
+					  min_moon_separation: float = 0, transit_window: tuple[datetime, datetime] = None,
+					  chunk_size: int = 20_000) -> Visibility:
+	"""
+	Visibility of every target (ICRS `ra`, `dec` in degrees) during the dark part of the night.
+
+	A target is observable when it spends at least `min_hours` above `min_altitude` degrees while dark, its distance to
+	the moon at the middle of the night is at least `min_moon_separation` degrees and, if `transit_window` (local
+	datetimes) is given, it transits within that window while dark. The score is the hours above the limit weighted by
+	the best airmass; unobservable targets score 0.
+	"""
+	raRad, decRad = precessToNight(ra, dec, ephemeris)
+	numTargets = len(raRad)
+	darkIdx = np.flatnonzero(ephemeris.dark)
+	midIdx = darkIdx[len(darkIdx) // 2] if len(darkIdx) > 0 else len(ephemeris.jd) // 2
+	minAlt = np.deg2rad(min_altitude)
+
+	maxAltitude = np.full(numTargets, -np.pi / 2)
+	hoursAbove = np.zeros(numTargets)
+	for start in range(0, numTargets, chunk_size):
+		chunk = slice(start, start + chunk_size)
+		alt = altitudeGrid(raRad[chunk], decRad[chunk], ephemeris)[:, darkIdx]
+		if alt.shape[1] == 0:
+			continue
+		maxAltitude[chunk] = alt.max(axis=1)
+		hoursAbove[chunk] = np.count_nonzero(alt >= minAlt, axis=1) * ephemeris.step_hours
+
+	# transit closest to the middle of the night, from the hour angle at that time
+	hourAngleMid = np.angle(np.exp(1j * (ephemeris.lst[midIdx] - raRad)))
+	transitJd = ephemeris.jd[midIdx] - hourAngleMid / SIDEREAL_RATE
+	transitAltitude = np.pi / 2 - np.abs(ephemeris.latitude - decRad)
+	moonSeparation = np.rad2deg(_angularSeparation(raRad, decRad, ephemeris.moonRa[midIdx], ephemeris.moonDec[midIdx]))
+
+	observable = (hoursAbove >= min_hours) & (moonSeparation >= min_moon_separation)
+	if transit_window is not None:
+		windowJd = Time(list(transit_window)).jd
+		darkStart, darkEnd = (ephemeris.jd[darkIdx[0]], ephemeris.jd[darkIdx[-1]]) if len(darkIdx) > 0 else (np.inf, -np.inf)
+		observable &= (transitJd >= max(windowJd.min(), darkStart)) & (transitJd <= min(windowJd.max(), darkEnd))
+
+	minAirmass = airmass(maxAltitude)
+	score = np.where(observable, hoursAbove / minAirmass, 0)
+	return Visibility(np.rad2deg(maxAltitude), minAirmass, transitJd, np.rad2deg(transitAltitude), hoursAbove, moonSeparation, observable, score)
+
+def rankTargets(visibility: Visibility, only_observable: bool = True) -> np.ndarray:
+	"""
+	Target indices by decreasing score (ties broken by airmass).
+	"""
+	order = np.lexsort((visibility.minAirmass, -visibility.score))
+	return order[visibility.observable[order]] if only_observable else order
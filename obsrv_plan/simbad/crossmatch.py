@@ -0,0 +1,242 @@
+"""
+SIMBAD cross-match stage for the Gaia candidate list: resolves Gaia DR3 source ids to (SIMBAD main id, object type).
+
+Every queried id is recorded in a SQLite cache, matched or not, so reruns (or a different candidate file that
+shares sources) only query the ids never seen before. Batches run on a thread pool with bounded concurrency; the
+batch size grows while SIMBAD answers quickly and halves on failures or slow answers, and failed batches are retried
+with exponential backoff.
+
+The query function is injectable (`query_fn`): any callable taking a list of Gaia source ids and returning
+`SimbadMatch` rows works, e.g. a local stand-in for the SIMBAD service.
+"""
+
+import os
+import time
+import random
+import sqlite3
+import warnings
+import threading
+from collections import namedtuple
+from collections.abc import Callable, Iterable, Iterator
+from os.path import join
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from obsrv_plan.general.params import RESULT_DIR
+from obsrv_plan.general.log import printToLog
+
+CROSSMATCH_CACHE_PATH = join(RESULT_DIR, "simbad-crossmatch.sqlite")
+
+SimbadMatch = namedtuple("SimbadMatch", "gaia_source_id simbad_id otype ra dec")
+CrossMatchStats = namedtuple("CrossMatchStats", "numSources numCached numQueried numMatched numFailed seconds")
+
+QueryFunction = Callable[[list[str]], list[SimbadMatch]]
+
+_customSimbad = None
+
+def getGaiaSourceId(ids: list[str]) -> str | None:
+	for s_id in ids:
+		if 'Gaia DR3' in s_id:
+			return s_id.replace('Gaia DR3 ', '').strip()
+	return None
+
+def querySimbad(source_ids: list[str]) -> list[SimbadMatch]:
+	"""
+	Default query function: a single SIMBAD query_objects call for the whole batch. Raises on failure; retries are
+	handled by the caller.
+	"""
+	global _customSimbad
+	if _customSimbad is None:
+		from astroquery.simbad import Simbad
+		_customSimbad = Simbad()
+		_customSimbad.add_votable_fields('otype', 'ids')
+
+	with warnings.catch_warnings(action='ignore'):
+		table = _customSimbad.query_objects([f"Gaia DR3 {s_id}" for s_id in source_ids])
+
+	matches = []
+	for row in (table if table is not None else []):
+		gaiaSourceId = getGaiaSourceId(str(row['IDS']).split('|'))
+		if gaiaSourceId is not None:
+			matches.append(SimbadMatch(gaiaSourceId, str(row['MAIN_ID']), str(row['OTYPE']), str(row['RA']), str(row['DEC'])))
+	return matches
+
+class CrossMatchCache:
+	"""
+	SQLite table of every queried source id; ids without a SIMBAD match are stored with a NULL simbad_id.
+	Only used from the thread that created it.
+	"""
+
+	def __init__(self, db_path: str = CROSSMATCH_CACHE_PATH) -> None:
+		self.db_path = db_path
+		os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+		self._conn = sqlite3.connect(db_path)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("""CREATE TABLE IF NOT EXISTS crossmatch (
+							gaia_source_id TEXT PRIMARY KEY, simbad_id TEXT, otype TEXT, ra TEXT, dec TEXT, queried_at REAL)""")
+		self._conn.commit()
+
+	def missing(self, source_ids: list[str]) -> list[str]:
+		"""
+		Ids (in input order) not yet in the cache.
+		"""
+		self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (gaia_source_id TEXT PRIMARY KEY)")
+		self._conn.execute("DELETE FROM lookup")
+		self._conn.executemany("INSERT OR IGNORE INTO lookup VALUES (?)", ((s,) for s in source_ids))
+		cached = {r[0] for r in self._conn.execute("SELECT gaia_source_id FROM lookup JOIN crossmatch USING (gaia_source_id)")}
+		return [s for s in source_ids if s not in cached]
+
+	def store(self, queried_ids: list[str], matches: list[SimbadMatch]) -> None:
+		now = time.time()
+		matchedIds = {m.gaia_source_id for m in matches}
+		self._conn.executemany("INSERT OR REPLACE INTO crossmatch VALUES (?, ?, ?, ?, ?, ?)",
+							   [(*m, now) for m in matches] + [(s, None, None, None, None, now) for s in queried_ids if s not in matchedIds])
+		self._conn.commit()
+
+	def matches(self, otypes: list[str] = None) -> Iterator[SimbadMatch]:
+		query = "SELECT gaia_source_id, simbad_id, otype, ra, dec FROM crossmatch WHERE simbad_id IS NOT NULL"
+		params = []
+		if otypes is not None:
+			query += f" AND otype IN ({','.join('?' * len(otypes))})"
+			params = list(otypes)
+		for row in self._conn.execute(query, params):
+			yield SimbadMatch(*row)
+
+	def categories(self) -> dict[str, list[dict[str, str]]]:
+		"""
+		otype -> list of matches as dicts, the same layout as the categories.json written by filter-candidates
+		(StarRecord.to_dict: the object type under 'type').
+		"""
+		categories = {}
+		for match in self.matches():
+			categories.setdefault(match.otype, []).append({'gaia_source_id': match.gaia_source_id, 'simbad_id': match.simbad_id,
+														   'ra': match.ra, 'dec': match.dec, 'type': match.otype})
+		return categories
+
+	def __len__(self) -> int:
+		return self._conn.execute("SELECT COUNT(*) FROM crossmatch").fetchone()[0]
+
+	def close(self) -> None:
+		self._conn.close()
+
+class AdaptiveBatchSize:
+	"""
+	Grows the batch size by `growth` while queries finish faster than `target_seconds`, halves it on failures or
+	queries slower than twice the target.
+	"""
+
+	def __init__(self, initial: int = 2000, minimum: int = 100, maximum: int = 10_000, target_seconds: float = 20, growth: float = 1.25) -> None:
+		self.size = initial
+		self.minimum = minimum
+		self.maximum = maximum
+		self.target_seconds = target_seconds
+		self.growth = growth
+		self._lock = threading.Lock()
+
+	def update(self, batch_size: int, seconds: float, failed: bool) -> None:
+		with self._lock:
+			if failed or seconds > 2 * self.target_seconds:
+				self.size = max(self.minimum, min(self.size, batch_size) // 2)
+			elif seconds < self.target_seconds and batch_size >= self.size:
+				self.size = min(self.maximum, int(self.size * self.growth))
+
+def _queryWithRetries(query_fn: QueryFunction, batch: list[str], batchSize: AdaptiveBatchSize, max_retries: int,
+					  min_interval: float, pacing: dict) -> tuple[list[str], list[SimbadMatch] | None, float]:
+	for attempt in range(max_retries + 1):
+		with pacing['lock']: # space out request starts across threads to avoid spamming SIMBAD
+			wait_s = pacing['next'] - time.monotonic()
+			pacing['next'] = max(pacing['next'], time.monotonic()) + min_interval
+		if wait_s > 0:
+			time.sleep(wait_s)
+
+		start = time.perf_counter()
+		try:
+			matches = query_fn(batch)
+			seconds = time.perf_counter() - start
+			batchSize.update(len(batch), seconds, failed=False)
+			return batch, matches, seconds
+		except Exception as e:
+			seconds = time.perf_counter() - start
+			batchSize.update(len(batch), seconds, failed=True)
+			printToLog(f"SIMBAD query failed (attempt {attempt + 1}/{max_retries + 1}): {e}", batch_size=len(batch), latency_s=round(seconds, 3), failed=True)
+			if attempt < max_retries:
+				time.sleep(min(2**attempt, 60) * (1 + random.random()))
+	return batch, None, seconds
+
+def _batches(source_ids: Iterable, cache: CrossMatchCache, batchSize: AdaptiveBatchSize, stats: dict,
+			 lookup_size: int = 50_000) -> Iterator[list[str]]:
+	"""
+	Uncached ids in batches of the current adaptive size; the input is consumed lazily.
+	"""
+	pending = []
+	def lookup(chunk):
+		missing = cache.missing(chunk)
+		stats['numSources'] += len(chunk)
+		stats['numCached'] += len(chunk) - len(missing)
+		return missing
+
+	chunk = []
+	for sourceId in source_ids:
+		chunk.append(str(sourceId))
+		if len(chunk) == lookup_size:
+			pending += lookup(chunk)
+			chunk = []
+		while len(pending) >= batchSize.size:
+			size = batchSize.size
+			yield pending[:size]
+			pending = pending[size:]
+	if len(chunk) > 0:
+		pending += lookup(chunk)
+	while len(pending) > 0:
+		size = batchSize.size
+		yield pending[:size]
+		pending = pending[size:]
+
+def crossMatch(source_ids: Iterable, cache_path: str = CROSSMATCH_CACHE_PATH, query_fn: QueryFunction = querySimbad,
+			   max_concurrency: int = 4, initial_batch_size: int = 2000, min_batch_size: int = 100, max_batch_size: int = 10_000,
+			   target_seconds: float = 20, min_interval: float = 1.0, max_retries: int = 3) -> CrossMatchStats:
+	"""
+	Cross-matches every (Gaia DR3) source id not already in the cache and stores the results. `source_ids` can be
+	any iterable (e.g. a generator over the Gaia CSV) and is consumed lazily. At most `max_concurrency` queries run at
+	once, starting at least `min_interval` seconds apart. Batches that still fail after `max_retries` are not cached,
+	so the next run queries them again.
+	"""
+	cache = CrossMatchCache(cache_path)
+	batchSize = AdaptiveBatchSize(initial_batch_size, min_batch_size, max_batch_size, target_seconds)
+	pacing = {'lock': threading.Lock(), 'next': time.monotonic()}
+	stats = {'numSources': 0, 'numCached': 0, 'numQueried': 0, 'numMatched': 0, 'numFailed': 0}
+	start = time.perf_counter()
+
+	def collect(futures):
+		for future in futures:
+			batch, matches, seconds = future.result()
+			if matches is None:
+				stats['numFailed'] += len(batch)
+				continue
+			cache.store(batch, matches)
+			stats['numQueried'] += len(batch)
+			stats['numMatched'] += len(matches)
+			printToLog("Cross-matched SIMBAD batch", batch_size=len(batch), latency_s=round(seconds, 3), matched=len(matches),
+			  			queried=stats['numQueried'], cached=stats['numCached'], next_batch_size=batchSize.size)
+
+	try:
+		with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+			inFlight = set()
+			for batch in _batches(source_ids, cache, batchSize, stats):
+				if len(inFlight) >= max_concurrency:
+					done, inFlight = wait(inFlight, return_when=FIRST_COMPLETED)
+					collect(done)
+				inFlight.add(pool.submit(_queryWithRetries, query_fn, batch, batchSize, max_retries, min_interval, pacing))
+			collect(wait(inFlight).done)
+	finally:
+		cache.close()
+
+	result = CrossMatchStats(**stats, seconds=time.perf_counter() - start)
+	printToLog(f"SIMBAD cross-match finished: {result}", print_console=True)
+	return result
+
+def loadCategories(cache_path: str = CROSSMATCH_CACHE_PATH) -> dict[str, list[dict[str, str]]]:
+	cache = CrossMatchCache(cache_path)
+	try:
+		return cache.categories()
+	finally:
+		cache.close()